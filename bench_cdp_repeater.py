@@ -0,0 +1,211 @@
+"""Benchmark harness for the CDP Repeater capture pipeline.
+
+Runs the real cdp_client_logic against a stand-in CDP endpoint, with a headless control panel client
+on the UI websocket, and plays a scripted (or recorded) event stream at it at a controlled rate and body size.
+
+    python bench_cdp_repeater.py --requests 20000 --rate 0 --body-bytes 4096
+    python bench_cdp_repeater.py --replay events.jsonl --rate 2000
+
+A recorded stream is a JSONL file of CDP event messages ({"method": ..., "params": ...}), one per line;
+their sessionId is rewritten to the monitored tab's. Reports, as JSON on stdout:
+  * events/sec the reader sustained (first event sent to last body requested)
+  * Fetch.requestPaused -> Fetch.continueRequest latency, measured at the fake browser
+  * UI fan-out lag: event sent -> matching new_request / response_data frame received by the UI client
+  * RSS growth over the run, and per captured entry
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+import threading
+import time
+
+import websockets
+
+import cdp_repeater
+
+BENCH_SESSION_ID = "BENCH-SESSION"
+
+def cdp_json(message):
+    """Serializes like Chrome does: compact, with a flattened session's id as the last key."""
+    return json.dumps(message, separators=(",", ":"))
+
+def rss_bytes():
+    """Current resident set size, or peak RSS where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * 4096
+    except (OSError, IndexError, ValueError):
+        try: import resource
+        except ImportError: return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def scripted_events(count, body_bytes, passive):
+    """Yields (request_key, [event, ...]) for one captured request at a time: the pause (or requestWillBeSent), the response and loadingFinished."""
+    headers = {"Accept": "application/json", "User-Agent": "bench", "Cookie": "session=bench"}
+    for n in range(count):
+        network_id = f"{n}.1"; url = f"https://bench.example/api/items/{n % 50}?page={n}"
+        request = {"url": url, "method": "GET", "headers": headers}
+        now = time.monotonic()
+        timing = {"requestTime": now, "proxyStart": -1, "proxyEnd": -1, "dnsStart": -1, "dnsEnd": -1, "connectStart": -1, "connectEnd": -1,
+                  "sslStart": -1, "sslEnd": -1, "sendStart": 0.1, "sendEnd": 0.2, "receiveHeadersEnd": 5.0}
+        first = {"method": "Network.requestWillBeSent", "params": {"requestId": network_id, "request": request, "type": "XHR"}} if passive else \
+                {"method": "Fetch.requestPaused", "params": {"requestId": f"interception-job-{n}", "networkId": network_id, "request": request, "resourceType": "XHR"}}
+        yield (network_id if passive else f"interception-job-{n}"), [
+            first,
+            {"method": "Network.responseReceived", "params": {"requestId": network_id, "response": {"url": url, "status": 200, "statusText": "OK", "protocol": "h2", "headers": {"content-type": "application/json"}, "mimeType": "application/json", "timing": timing}}},
+            {"method": "Network.loadingFinished", "params": {"requestId": network_id, "timestamp": now + 0.01, "encodedDataLength": body_bytes}},
+        ]
+
+def replayed_events(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip(): continue
+            event = json.loads(line); params = event.get("params", {})
+            key = params.get("requestId") if event.get("method") in ("Fetch.requestPaused", "Network.requestWillBeSent") else None
+            yield key, [{"method": event["method"], "params": params}]
+
+class FakeBrowser:
+    """A stand-in CDP endpoint. Answers the commands the repeater sends at startup, then plays the event stream at the monitored session."""
+
+    def __init__(self, args):
+        self.args = args; self.targets = []; self.instrumented = None
+        self.paused_at = {}; self.continue_ms = []; self.sent_at = {}
+        self.events_sent = 0; self.expected_bodies = 0; self.bodies_served = 0
+        self.first_event = self.last_body = None; self.stream_done = None; self.bodies_done = None
+
+    async def handler(self, websocket, path=None):
+        async for message in websocket:
+            command = json.loads(message); method = command["method"]; params = command.get("params", {}); result = {}
+            if method == "Browser.getVersion": result = {"userAgent": "Mozilla/5.0 (bench) Chrome/120.0 Safari/537.36"}
+            elif method == "Target.createTarget":
+                target_id = f"TARGET-{len(self.targets)}"; self.targets.append((target_id, params.get("url", "")))
+                result = {"targetId": target_id}
+            elif method == "Target.setAutoAttach" and "sessionId" not in command:
+                # Browser-level auto-attach reports the targets that already exist; the last one created is the browsing tab
+                for index, (target_id, url) in enumerate(self.targets):
+                    session_id = BENCH_SESSION_ID if index == len(self.targets) - 1 else f"OWN-{index}"
+                    await websocket.send(cdp_json({"method": "Target.attachedToTarget", "params": {"sessionId": session_id, "targetInfo": {"targetId": target_id, "type": "page", "url": url, "title": ""}, "waitingForDebugger": False}}))
+            elif method == "Fetch.continueRequest":
+                paused_at = self.paused_at.pop(params["requestId"], None)
+                if paused_at is not None: self.continue_ms.append((time.perf_counter() - paused_at) * 1000)
+            elif method == "Network.getResponseBody":
+                result = {"body": "x" * self.args.body_bytes, "base64Encoded": False}
+                self.bodies_served += 1; self.last_body = time.perf_counter()
+                if self.bodies_served >= self.expected_bodies and self.stream_done.is_set(): self.bodies_done.set()
+            elif method == "Target.createBrowserContext": result = {}
+            await websocket.send(cdp_json({"id": command["id"], "result": result, **({"sessionId": command["sessionId"]} if "sessionId" in command else {})}))
+            if method == ("Network.enable" if self.args.passive else "Fetch.enable") and command.get("sessionId") == BENCH_SESSION_ID and not self.instrumented.is_set():
+                self.instrumented.set(); asyncio.ensure_future(self.play(websocket))
+
+    async def play(self, websocket):
+        await self.ui_connected.wait(); await asyncio.sleep(0.2)
+        stream = replayed_events(self.args.replay) if self.args.replay else scripted_events(self.args.requests, self.args.body_bytes, self.args.passive)
+        interval = 1.0 / self.args.rate if self.args.rate else 0; next_start = time.perf_counter(); self.first_event = next_start
+        for sent, (key, events) in enumerate(stream, 1):
+            if interval:
+                delay = next_start - time.perf_counter()
+                if delay > 0: await asyncio.sleep(delay)
+                next_start += interval
+            elif sent % 100 == 0: await asyncio.sleep(0)
+            for event in events:
+                event = dict(event, sessionId=BENCH_SESSION_ID); now = time.perf_counter()
+                if event["method"] == "Fetch.requestPaused":
+                    self.paused_at[event["params"]["requestId"]] = now
+                elif event["method"] == "Network.loadingFinished": self.expected_bodies += 1
+                if key is not None and key not in self.sent_at: self.sent_at[key] = now
+                await websocket.send(cdp_json(event)); self.events_sent += 1
+        self.stream_done.set()
+        if self.bodies_served >= self.expected_bodies: self.bodies_done.set()
+
+class HeadlessUI:
+    """Connects to the UI websocket like the control panel does, and timestamps every entry it hears about."""
+
+    def __init__(self, delay_ms):
+        self.delay_ms = delay_ms; self.new_at = {}; self.response_at = {}; self.frames = 0; self.resyncs = 0; self.greeted = False; self.last_frame = None; self.ws = None
+
+    async def run(self, port, connected):
+        async with websockets.connect(f"ws://127.0.0.1:{port}", max_size=None) as ws:
+            self.ws = ws; connected.set()
+            await ws.send(json.dumps({"type": "hello", "version": cdp_repeater.UI_PROTOCOL_VERSION, "run": None, "seq": 0}))
+            async for frame in ws:
+                now = time.perf_counter(); self.frames += 1; self.last_frame = now
+                message = json.loads(frame)
+                for item in (message["data"] if message["type"] == "batch" else [message]):
+                    if item["type"] == "entry":
+                        # An entry's summary is republished as it fills in; its size means the body has arrived
+                        self.new_at.setdefault(item["data"]["id"], now)
+                        if "size" in item["data"]: self.response_at.setdefault(item["data"]["id"], now)
+                    elif item["type"] == "resync":
+                        # The first one answers the hello; any later one means the repeater dropped updates
+                        if self.greeted: self.resyncs += 1
+                        self.greeted = True
+                if self.delay_ms: await asyncio.sleep(self.delay_ms / 1000)
+
+def run_fake_side(args, fake, ui, ready, finished):
+    """The fake browser and the UI client get their own thread and loop, so they don't compete with the repeater's loop for scheduling."""
+    async def side():
+        fake.instrumented = asyncio.Event(); fake.stream_done = asyncio.Event(); fake.bodies_done = asyncio.Event(); fake.ui_connected = asyncio.Event()
+        async with websockets.serve(fake.handler, "127.0.0.1", args.cdp_port, max_size=None):
+            ready.set()
+            await fake.instrumented.wait()
+            ui_task = asyncio.ensure_future(ui.run(args.ui_port, fake.ui_connected))
+            await fake.stream_done.wait()
+            try: await asyncio.wait_for(fake.bodies_done.wait(), timeout=args.timeout)
+            except asyncio.TimeoutError: pass
+            # Let the UI drain: done once it has every response, or nothing has arrived for a second
+            deadline = time.perf_counter() + args.timeout
+            while time.perf_counter() < deadline and len(ui.response_at) < len(fake.sent_at):
+                if ui.last_frame and time.perf_counter() - ui.last_frame > 1.0: break
+                await asyncio.sleep(0.05)
+            if ui.ws: await ui.ws.close()
+            await asyncio.gather(ui_task, return_exceptions=True)
+        finished.set()
+    asyncio.run(side())
+
+def lag_summary(sent_at, received_at):
+    return cdp_repeater.latency_summary([(received_at[key] - sent) * 1000 for key, sent in sent_at.items() if key in received_at])
+
+async def bench(args):
+    cdp_repeater.REPEAT_WORKERS = 0; cdp_repeater.WEBSOCKET_PORT = args.ui_port
+    cdp_repeater.CAPTURE_MODE = "passive" if args.passive else "intercept"; cdp_repeater.BODY_FETCH_MODE = "eager"
+    fake, ui = FakeBrowser(args), HeadlessUI(args.ui_delay_ms)
+    ready, finished = threading.Event(), threading.Event()
+    threading.Thread(target=run_fake_side, args=(args, fake, ui, ready, finished), daemon=True).start()
+    loop = asyncio.get_running_loop(); await loop.run_in_executor(None, ready.wait)
+
+    rss_before = rss_bytes()
+    async with websockets.serve(cdp_repeater.ui_websocket_handler, "127.0.0.1", args.ui_port, compression="deflate"):
+        client = asyncio.ensure_future(cdp_repeater.cdp_client_logic(f"ws://127.0.0.1:{args.cdp_port}"))
+        await loop.run_in_executor(None, finished.wait)
+        client.cancel()
+    rss_after = rss_bytes()
+
+    # History ids are the Fetch requestId in intercept mode and the network requestId in passive mode, i.e. the stream's keys
+    duration = (fake.last_body or time.perf_counter()) - fake.first_event
+    entries = len(cdp_repeater.request_history.entries)
+    return {
+        "mode": cdp_repeater.CAPTURE_MODE, "requests": len(fake.sent_at), "events": fake.events_sent, "body_bytes": args.body_bytes, "rate": args.rate,
+        "events_per_sec": round(fake.events_sent / duration, 1) if duration > 0 else None,
+        "bodies_requested": fake.bodies_served, "pause_to_continue_ms": cdp_repeater.latency_summary(fake.continue_ms),
+        "ui": {"frames": ui.frames, "resyncs": ui.resyncs, "new_request_lag_ms": lag_summary(fake.sent_at, ui.new_at),
+               "response_data_lag_ms": lag_summary(fake.sent_at, ui.response_at), "entries_seen": len(ui.new_at)},
+        "memory": {"rss_before": rss_before, "rss_after": rss_after, "rss_growth": rss_after - rss_before if rss_before and rss_after else None,
+                   "history_entries": entries, "history_memory_bytes": cdp_repeater.request_history.memory_bytes,
+                   "rss_per_entry": round((rss_after - rss_before) / entries, 1) if rss_before and rss_after and entries else None},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the CDP Repeater capture pipeline against a stand-in CDP server.")
+    parser.add_argument("--requests", type=int, default=5000, help="Scripted requests to play (default 5000)")
+    parser.add_argument("--rate", type=float, default=0, help="Requests per second to play (default 0, as fast as possible)")
+    parser.add_argument("--body-bytes", type=int, default=2048, help="Size of each response body (default 2048)")
+    parser.add_argument("--passive", action="store_true", help="Play Network.requestWillBeSent instead of Fetch.requestPaused")
+    parser.add_argument("--replay", metavar="FILE", help="Play a recorded JSONL event stream instead of the scripted one")
+    parser.add_argument("--ui-delay-ms", type=float, default=0, help="Make the UI client this slow per frame, to exercise the slow-consumer policy")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the pipeline to drain (default 60)")
+    parser.add_argument("--cdp-port", type=int, default=9333); parser.add_argument("--ui-port", type=int, default=8799)
+    args = parser.parse_args()
+    with contextlib.redirect_stdout(sys.stderr): report = asyncio.run(bench(args))
+    print(json.dumps(report, indent=2))
@@ -1,43 +1,163 @@
+import argparse
+import array
 import asyncio
+import base64
+import bisect
+import collections
+import contextlib
+import cProfile
+import datetime
+import email.utils
+import fnmatch
+import functools
+import hashlib
+import io
 import json
+import math
 import threading
-import http.server
-import socketserver
+import itertools
+import urllib.parse
 import urllib.request
-import urllib.error
 import websockets
 import os
 import platform
-import subprocess
+import pstats
+import queue
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
 import time
+import tracemalloc
 import uuid
 
+try:
+    import orjson # Optional: a faster codec for the CDP stream
+    def json_loads(data):
+        try: return orjson.loads(data)
+        except orjson.JSONDecodeError: return json.loads(data) # e.g. lone surrogate escapes, which orjson rejects
+    def json_dumps(obj):
+        try: return orjson.dumps(obj).decode()
+        except TypeError: return json.dumps(obj)
+except ImportError:
+    json_loads, json_dumps = json.loads, json.dumps
+
 # --- Configuration ---
 HTTP_PORT = 9999
 WEBSOCKET_PORT = 8765
 CHROME_DEBUG_PORT = 9222
 USER_DATA_DIR_NAME = "ChromeRepeaterSession"
 
+# --- Capture Scope ---
+# "intercept" pauses in-scope requests via the Fetch domain; "passive" records from Network events only and never pauses.
+CAPTURE_MODE = "intercept"
+SCOPE_HOSTS = []            # Host globs, e.g. ["example.com", "*.example.com"]. Empty matches every host.
+SCOPE_PATH_PREFIXES = []    # Path prefixes, e.g. ["/api/"]. Empty matches every path.
+SCOPE_RESOURCE_TYPES = []   # CDP resource types, e.g. ["Document", "XHR", "Fetch"]. Empty matches every type.
+SCOPE_METHODS = []          # e.g. ["GET", "POST"]. Fetch patterns can't express methods, so these are checked in-process.
+MONITOR_TARGET_TYPES = ["page", "iframe", "worker", "service_worker", "shared_worker"]  # Targets auto-attached for capture (tabs, popups, OOPIFs, workers)
+
+# --- Match and Replace ---
+# Applied to intercepted (in-scope) traffic in intercept mode; see the README for the rule fields. Hit counts are on /metrics.
+MATCH_REPLACE_RULES = []    # e.g. [{"host": "api.example.com", "part": "header", "name": "Authorization", "replace": "Bearer test"}]
+
+# --- Response Bodies ---
+BODY_FETCH_MODE = "eager"               # "eager" pulls every body when it finishes loading; "lazy" only when the UI asks for it
+BODY_CACHE_BYTES = 32 * 1024 * 1024     # LRU budget for spilled bodies read back from disk
+PREFETCH_BODY_MAX_BYTES = 64 * 1024     # Lazy mode still prefetches text bodies up to this size, before Chrome can evict them (0 disables)
+STREAM_BODY_THRESHOLD = 0               # Opt-in: intercepted responses with a Content-Length above this are streamed to the blob store (0 disables)
+STREAM_CHUNK_BYTES = 1024 * 1024        # IO.read chunk size when streaming a body
+BLOB_PREVIEW_BYTES = 16 * 1024          # How much of a streamed body the UI shows inline
+BLOB_DISK_BUDGET = 2 * 1024 * 1024 * 1024   # Bytes of blobs (streamed and binary bodies) kept on disk
+LARGE_REPLY_BYTES = 256 * 1024          # CDP replies larger than this (bodies, repeat results) are parsed in a worker thread after pending continues are sent (0 parses inline)
+
+# --- History Store ---
+HISTORY_MEMORY_BUDGET = 64 * 1024 * 1024    # Bytes of history (search index included) kept in RAM before the oldest entries are evicted
+HISTORY_DISK_BUDGET = 1024 * 1024 * 1024    # Bytes of spilled headers/bodies kept on disk
+HISTORY_SPILL_THRESHOLD = 8 * 1024          # Header/body fields larger than this are spilled to disk
+HISTORY_SEGMENT_BYTES = 64 * 1024 * 1024    # Spill segment size before rotating to a new file
+
+# --- Persistent Sessions ---
+SESSION_DB_PATH = None          # e.g. "repeater_sessions.db" to keep captured traffic across restarts (None disables)
+SESSION_NAME = "default"        # Reusing a session name resumes that session's history
+SESSION_BATCH_SIZE = 500        # Max queued writes committed per transaction
+SESSION_FLUSH_INTERVAL = 0.25   # Seconds the writer waits to fill a batch
+SESSION_PAGE_SIZE = 200         # Entries per page when reloading a session into the UI
+
+# --- UI Updates ---
+UI_QUEUE_LIMIT = 5000           # Queued UI messages before a slow control panel is resynced instead of buffered
+UI_FLUSH_INTERVAL = 0.05        # Seconds the sender collects messages into one frame
+UI_BATCH_MAX = 500              # Max messages per frame
+RENDER_CACHE_BYTES = 32 * 1024 * 1024   # Rendered responses kept in memory for their tabs (oldest dropped first)
+UI_BODY_CACHE_BYTES = 64 * 1024 * 1024  # Bodies the control panel keeps by hash; a body it already has is sent as just the hash
+UI_PROTOCOL_VERSION = 2         # Bumped whenever the messages between the control panel and the backend change shape
+UI_REPLAY_BUFFER = 20000        # Recent list updates kept so a reconnecting panel resumes from its last sequence number
+UI_DETAIL_BODY_CHARS = 256 * 1024   # Body characters sent with a request's details; the rest is read in ranges on demand
+
+# --- Search ---
+SEARCH_PAGE_SIZE = 200                  # Hits per page sent to the UI
+SEARCH_INDEX_BODY_CHARS = 1024 * 1024   # Only this much of a body is indexed; quoted and re: queries still check all of it
+SEARCH_PREFIX_EXPANSION = 500           # Max indexed words a partially typed word expands to
+SEARCH_INDEX_MAX_WORDS = 4096           # Distinct words indexed per field of an entry; the rest are only found by the scan fallback
+SEARCH_SCAN_BATCH = 200                 # Entries checked against quoted/re: terms between yields to the event loop
+
+# --- Cookie Jar ---
+COOKIE_JAR_MAX_AGE = 30         # Seconds before the repeat path re-reads Chrome's cookies, to catch ones set by JavaScript
+
+# --- Repeat Workers ---
+REPEAT_WORKERS = min(4, os.cpu_count() or 1)   # Background tabs, each in its own browser context, that run repeats and attacks (0 sends from the browsing tab)
+WORKER_HEALTH_INTERVAL = 15                     # Seconds between worker liveness checks; unresponsive workers are replaced
+REPEAT_MAX_IN_FLIGHT = 8                        # Sends from the panel running at once; later ones wait for a slot
+
+# --- Request Lifecycle ---
+CDP_COMMAND_TIMEOUT = 30        # Seconds a CDP command waits for its reply before giving up (bodies show as unavailable)
+REPEAT_TIMEOUT = 300            # Seconds a repeat or attack batch may run in the page before it is abandoned
+REPEAT_SEND_TIMEOUT = 30        # Default seconds before the page aborts a Send (the panel's Timeout field overrides it, up to REPEAT_TIMEOUT)
+REPEAT_MIN_TIMEOUT = 1          # Shortest Timeout the panel's field is allowed, in seconds
+NETWORK_ID_TTL = 600            # Seconds a network id stays correlated with its entry; long-polls and websockets that never finish expire
+LIFECYCLE_SWEEP_INTERVAL = 10   # Seconds between sweeps of expired correlation entries
+
+# --- Metrics ---
+# /metrics (Prometheus text format) is always served. The profiling endpoints are opt-in: they expose code paths and allocation sites.
+PROFILING_ENDPOINTS = False     # Enables /debug/profile?seconds=N (cProfile) and /debug/tracemalloc?seconds=N
+PROFILE_MAX_SECONDS = 60        # Upper bound for a profiling window
+
+# --- Attack Mode ---
+ATTACK_MARKER = "§"                         # Insertion points are marked as §original value§
+ATTACK_MAX_CONCURRENCY = 50                 # Upper bound for the per-attack concurrency setting
+ATTACK_RESPONSE_CACHE_BYTES = 64 * 1024 * 1024  # Attack responses kept so a result row can be opened
+
 # --- Global State Management ---
-request_history, request_order = {}, []
-HISTORY_LIMIT = 500
+session_store = None
+session_page_floor = None      # Oldest stored entry seq sent to the panel; search covers stored entries from there on
 ui_websocket_connection = None
 browser_user_agent = None
-MONITORED_SESSION_ID = None
+MONITORED_SESSION_ID = None    # The browsing tab the repeat path sends from
+monitored_sessions = {}        # sessionId -> MonitoredSession, for every attached target we capture from
+known_targets = {}             # targetId -> summary shown in the UI's target filter
+ignored_target_ids = set()     # Our own tabs (control panel, help, rendered responses)
+primary_target_id = None
+chrome_output_task = None      # Drains the stderr of a Chrome we launched
+fetch_patterns, in_scope = [], None
 ui_ready = asyncio.Event()
 CDP_COMMAND_ID = 1000
-pending_futures = {}
-cdp_id_to_req_id = {}
-network_id_to_fetch_id = {}
 cdp_command_queue = asyncio.Queue()
-ui_message_queue = asyncio.Queue() # New decoupled queue for UI updates
+ui_message_queue = asyncio.Queue() # New decoupled queue for UI updates, bounded by send_to_ui()
+ui_resync_needed = False
+ui_sent_bodies = collections.OrderedDict()  # digest -> size: bodies the connected panel holds, mirroring its bodiesByHash LRU
+ui_sent_body_bytes = 0
+ui_run_id = uuid.uuid4().hex   # A panel that outlived a restart can't resume: its sequence numbers belong to the old run
+ui_seq = 0
+ui_replay = collections.deque(maxlen=UI_REPLAY_BUFFER)
+ui_detail_id = None            # The entry the panel has open; its details are pushed again when its body arrives
 
 # --- Part 1: Self-Contained UI and Help Files ---
 HELP_HTML_CONTENT = """
 <!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title>CDP Repeater - Help</title><style>body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; line-height: 1.6; color: #333; max-width: 800px; margin: 0 auto; padding: 20px; background-color: #f8f9fa; } h1, h2 { border-bottom: 2px solid #dee2e6; padding-bottom: 10px; color: #212529; } h1 { font-size: 2.5em; } h2 { font-size: 1.75em; margin-top: 40px;} code { font-family: "Courier New", Courier, monospace; background-color: #e9ecef; padding: 2px 6px; border-radius: 4px; font-size: 0.9em; } pre { background-color: #e9ecef; padding: 15px; border-radius: 5px; white-space: pre-wrap; word-wrap: break-word; } li { margin-bottom: 10px; } .container { background-color: #ffffff; padding: 40px; border-radius: 8px; box-shadow: 0 4px 8px rgba(0,0,0,0.1); }</style></head><body><div class="container"><h1>CDP Repeater</h1><p>This is a lightweight, single-file HTTP repeater tool for web application security testing. It uses the Chrome DevTools Protocol (CDP) to monitor network traffic from a dedicated Chrome tab without needing to configure a traditional proxy.</p><h2>Features</h2><ul><li><strong>Single Python File:</strong> The entire tool is self-contained.</li><li><strong>Sandboxed Browser:</strong> Automatically launches a new, isolated Chrome instance.</li><li><strong>Explicit Tab Monitoring:</strong> Creates and instruments a dedicated tab for your browsing.</li><li><strong>High-Fidelity Repeater:</strong> The "Send" function executes requests via the browser's own engine, automatically including up-to-date cookies and the correct User-Agent.</li><li><strong>Render in Browser:</strong> A "Render in new tab" feature allows you to see the browser's rendered output from any repeated request.</li></ul><h2>Requirements</h2><ul><li>Python 3.8+</li><li>Google Chrome</li><li>The <code>websockets</code> Python library</li></ul><h2>Installation</h2><p>Install the required Python library using pip:</p><pre><code>pip install websockets</code></pre><h2>Usage Instructions</h2><ol><li>When this script is run, this help tab, a "CDP Repeater" control panel tab, and a blank tab are opened.</li><li><strong>Use the blank tab for all your browsing</strong> of the target application.</li><li>As you browse, requests from that tab will appear in the "History" pane of the control panel.</li><li>You can close this help tab at any time.</li></ol><h2>Workflow</h2><ul><li><strong>View a Request:</strong> Click any item in the "History" pane. The full original request and its corresponding response will be displayed.</li><li><strong>Repeat a Request:</strong> Modify the text in the "Request" pane and click the <strong>Send</strong> button. The response to your modified request will appear in the "Response" pane.</li><li><strong>Render a Response:</strong> Check the <strong>"Render in new tab"</strong> box before clicking <strong>Send</strong> to have the response body saved locally and opened in a new Chrome tab.</li></ul></div></body></html>
 """
 HTML_CONTENT = """
-<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><title>CDP Repeater</title><link rel="stylesheet" href="style.css"></head><body><div class="container"><div class="pane history-pane"><h2>History (Last 500)</h2><div class="controls"><button id="clear-history">Clear</button><input type="text" id="search-input" placeholder="Find (UUID, URL, Body)..."></div><ul id="history-list"></ul></div><div class="pane request-pane"><h2>Request</h2><div class="controls controls-row"><button id="send-btn" title="Send Request (Ctrl+Enter)">Send</button><button id="edit-btn">Edit</button><button id="curl-btn">Copy cURL</button><button id="py-btn">Copy Python</button><div class="checkbox-container"><input type="checkbox" id="render-checkbox" name="render-checkbox"><label for="render-checkbox">Render</label></div></div><div id="request-container"><pre id="request-view"></pre><textarea id="request-edit" class="hidden" spellcheck="false"></textarea></div></div><div class="pane response-pane"><h2>Response Headers</h2><pre id="response-headers"></pre><h2>Response Body</h2><pre id="response-body"></pre></div></div><script src="script.js"></script></body></html>
+<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><title>CDP Repeater</title><link rel="stylesheet" href="style.css"></head><body><div class="container"><div class="pane history-pane"><h2>History</h2><div class="controls"><button id="clear-history">Clear</button><button id="load-older" class="hidden">Load older</button><button id="export-har">Export HAR</button><button id="import-har">Import HAR</button><input type="file" id="har-file" accept=".har,.json" class="hidden"><input type="text" id="search-input" placeholder="Find (words, host:, status:, header:, re:)..."><select id="target-filter"><option value="">All targets</option></select><span id="har-status"></span></div><div id="history-viewport"><div id="history-spacer"></div><ul id="history-list"></ul></div></div><div class="pane request-pane"><h2>Request</h2><div class="controls controls-row"><button id="send-btn" title="Send Request (Ctrl+Enter)">Send</button><button id="edit-btn">Edit</button><button id="curl-btn">Copy cURL</button><button id="py-btn">Copy Python</button><button id="attack-btn">Attack</button><div class="checkbox-container"><input type="checkbox" id="render-checkbox" name="render-checkbox"><label for="render-checkbox">Render</label></div><label class="repeat-timeout">Timeout <input type="number" id="repeat-timeout" value="30" min="1" title="Seconds before the browser aborts the request"></label><button id="cancel-btn" class="hidden">Cancel</button><span id="repeat-status"></span></div><div id="request-container"><pre id="request-view"></pre><textarea id="request-edit" class="hidden" spellcheck="false"></textarea></div></div><div class="pane response-pane"><h2>Response Headers</h2><pre id="response-headers"></pre><h2>Timing</h2><div id="timing-view"></div><h2>Response Body</h2><a id="blob-link" class="hidden" target="_blank"></a><pre id="response-body"></pre><button id="body-more" class="hidden">Load more</button></div></div><div id="attack-panel" class="hidden"><div class="attack-header"><h2>Attack</h2><button id="attack-close">Close</button></div><p class="attack-help">Mark insertion points in the request with <code>§value§</code> (select text while editing and click <strong>Mark §</strong>).</p><div class="controls controls-row"><button id="attack-mark">Mark §</button><label>Mode <select id="attack-mode"><option value="sniper">Sniper</option><option value="ram">Battering ram</option></select></label><label>Payloads <select id="attack-payload-type"><option value="list">List</option><option value="numbers">Numbers</option></select></label><label>Concurrency <input type="number" id="attack-concurrency" value="10" min="1"></label><label>Rate/s <input type="number" id="attack-rate" value="0" min="0" title="0 = unlimited"></label><div class="checkbox-container"><input type="checkbox" id="attack-race"><label for="attack-race">Race (send all at once)</label></div></div><textarea id="attack-payloads" spellcheck="false" placeholder="One payload per line"></textarea><div id="attack-numbers" class="controls controls-row hidden"><label>From <input type="number" id="attack-from" value="1"></label><label>To <input type="number" id="attack-to" value="100"></label><label>Step <input type="number" id="attack-step" value="1"></label></div><div class="controls controls-row"><button id="attack-start">Start</button><button id="attack-stop">Stop</button><span id="attack-status"></span></div><div id="attack-results-container"><table id="attack-results"><thead><tr><th data-key="index">#</th><th data-key="position">Pos</th><th data-key="payload">Payload</th><th data-key="status">Status</th><th data-key="length">Length</th><th data-key="time_ms">Time (ms)</th></tr></thead><tbody></tbody></table></div></div><script src="script.js"></script></body></html>
 """
 CSS_CONTENT = """
 body, html { margin: 0; padding: 0; font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; background-color: #f0f0f0; height: 100%; }
@@ -54,14 +174,22 @@ h2 { margin-top: 0; padding-bottom: 5px; border-bottom: 1px solid #ccc; flex-shr
 button { padding: 5px 10px; border: 1px solid #ccc; background-color: #e9e9e9; cursor: pointer; min-width: 60px; font-size: 0.85em;}
 button:hover { background-color: #ddd; }
 input[type="text"]#search-input { padding: 5px; border: 1px solid #ccc; flex-grow: 1; min-width: 0; }
+input[type="text"]#search-input.search-error { border-color: #c0392b; }
+#blob-link { display: block; margin-bottom: 5px; font-size: 0.9em; }
+#body-more { margin-top: 5px; align-self: flex-start; }
+#target-filter { flex-basis: 100%; min-width: 0; padding: 4px; }
+#har-status { flex-basis: 100%; font-size: 0.85em; color: #555; word-break: break-all; }
+#har-status:empty { display: none; }
 #send-btn { background-color: #d4edda; border-color: #c3e6cb; font-weight: bold; }
 #send-btn:hover { background-color: #c3e6cb; }
 #edit-btn { background-color: #fff3cd; border-color: #ffeeba; }
 #edit-btn:hover { background-color: #ffeeba; }
 #curl-btn, #py-btn { background-color: #d1ecf1; border-color: #bee5eb; }
 #curl-btn:hover, #py-btn:hover { background-color: #bee5eb; }
-#history-list { list-style: none; padding: 0; margin: 0; overflow-y: auto; flex-grow: 1; }
-#history-list li { padding: 5px; cursor: pointer; border-bottom: 1px solid #eee; font-size: 0.9em; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; display: flex; align-items: center; }
+#history-viewport { flex-grow: 1; overflow-y: auto; position: relative; }
+#history-spacer { width: 1px; }
+#history-list { list-style: none; padding: 0; margin: 0; position: absolute; top: 0; left: 0; right: 0; }
+#history-list li { height: 26px; box-sizing: border-box; padding: 0 5px; cursor: pointer; border-bottom: 1px solid #eee; font-size: 0.9em; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; display: flex; align-items: center; }
 #history-list li.selected { background-color: #dbeaff; }
 .status-indicator { display: inline-block; width: 8px; height: 8px; border-radius: 50%; margin-right: 8px; flex-shrink: 0; background-color: #ccc; }
 .status-2xx { background-color: #28a745; }
@@ -75,12 +203,44 @@ textarea, #request-view { flex-grow: 1; width: 100%; box-sizing: border-box; fon
 textarea { resize: none; }
 .hidden { display: none !important; }
 pre { background-color: #fff; white-space: pre-wrap; word-break: break-all; padding: 5px; border: 1px solid #ccc; font-family: "Courier New", Courier, monospace; font-size: 0.9em; margin: 0; }
-#response-headers { height: 40%; overflow-y: auto; margin-bottom: 10px; flex-shrink: 0; }
+#response-headers { height: 30%; overflow-y: auto; margin-bottom: 10px; flex-shrink: 0; }
+#timing-view { max-height: 20%; overflow-y: auto; margin-bottom: 10px; flex-shrink: 0; font-size: 0.8em; background-color: #fff; border: 1px solid #ccc; padding: 5px; }
+.timing-row { display: flex; align-items: center; gap: 5px; height: 16px; }
+.timing-label { width: 60px; flex-shrink: 0; }
+.timing-track { position: relative; flex-grow: 1; height: 10px; background-color: #f3f3f3; }
+.timing-bar { position: absolute; top: 0; height: 100%; background-color: #9e9e9e; }
+.timing-dns { background-color: #009688; } .timing-connect { background-color: #ff9800; } .timing-ssl { background-color: #9c27b0; }
+.timing-send { background-color: #2196f3; } .timing-wait { background-color: #4caf50; } .timing-receive { background-color: #03a9f4; }
+.timing-value { width: 70px; flex-shrink: 0; text-align: right; font-family: "Courier New", Courier, monospace; }
+.timing-summary { margin-top: 4px; color: #555; font-family: "Courier New", Courier, monospace; }
 #response-body { flex-grow: 1; overflow-y: auto; }
+#attack-btn { background-color: #f8d7da; border-color: #f5c6cb; }
+#attack-panel { position: fixed; left: 5%; top: 5%; width: 60%; height: 85%; background-color: #fff; border: 1px solid #999; box-shadow: 0 4px 16px rgba(0,0,0,0.3); padding: 10px; box-sizing: border-box; display: flex; flex-direction: column; z-index: 10; }
+.attack-header { display: flex; justify-content: space-between; align-items: flex-start; }
+.attack-help { margin: 0 0 10px 0; font-size: 0.85em; color: #555; }
+#attack-panel label { font-size: 0.85em; display: flex; align-items: center; gap: 4px; }
+#attack-panel input[type="number"] { width: 70px; }
+#attack-payloads { height: 120px; flex-grow: 0; margin-bottom: 10px; }
+#attack-status { font-size: 0.85em; margin-left: 10px; }
+.repeat-timeout { margin-left: 10px; font-size: 0.85em; }
+#repeat-timeout { width: 4em; }
+#repeat-status { font-size: 0.85em; margin-left: 10px; }
+#attack-results-container { flex-grow: 1; overflow-y: auto; border: 1px solid #ccc; }
+#attack-results { width: 100%; border-collapse: collapse; font-size: 0.85em; font-family: "Courier New", Courier, monospace; }
+#attack-results th { position: sticky; top: 0; background-color: #e9e9e9; cursor: pointer; text-align: left; padding: 3px 5px; }
+#attack-results td { padding: 2px 5px; border-bottom: 1px solid #eee; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; max-width: 300px; }
+#attack-results tr.selected td { background-color: #dbeaff; }
+#attack-results tbody tr { cursor: pointer; }
 """
 JS_CONTENT = """
 document.addEventListener('DOMContentLoaded', () => {
-    const ws = new WebSocket(`ws://127.0.0.1:8765`);
+    let ws = null;
+    let reconnectDelay = 250;
+    // Protocol state: list updates carry a sequence number, and a reconnect resumes from the last one applied
+    const PROTOCOL_VERSION = 2;
+    let runId = null, lastSeq = 0, synced = false, resuming = false;
+    const historyViewport = document.getElementById('history-viewport');
+    const historySpacer = document.getElementById('history-spacer');
     const historyList = document.getElementById('history-list');
 
     // Request Pane Elements
@@ -91,15 +251,43 @@ document.addEventListener('DOMContentLoaded', () => {
     const curlBtn = document.getElementById('curl-btn');
     const pyBtn = document.getElementById('py-btn');
     const renderCheckbox = document.getElementById('render-checkbox');
+    const repeatTimeout = document.getElementById('repeat-timeout');
+    const cancelBtn = document.getElementById('cancel-btn');
+    const repeatStatus = document.getElementById('repeat-status');
+    const attackBtn = document.getElementById('attack-btn');
 
     const responseHeaders = document.getElementById('response-headers');
     const responseBody = document.getElementById('response-body');
+    const timingView = document.getElementById('timing-view');
+    const blobLink = document.getElementById('blob-link');
+    const bodyMoreBtn = document.getElementById('body-more');
     const clearHistoryBtn = document.getElementById('clear-history');
+    const loadOlderBtn = document.getElementById('load-older');
     const searchInput = document.getElementById('search-input');
+    const targetFilter = document.getElementById('target-filter');
+    const harStatus = document.getElementById('har-status');
 
-    let requests = {}, selectedRequestId = null;
+    // requests holds list summaries only; openDetail is the full entry the panes show, fetched on select
+    let requests = {}, selectedRequestId = null, targets = {}, openDetail = null;
     let requestCounter = 1;
+    const STORED_COUNT_BASE = 2 ** 40; // Stored entries count from -2^40 + seq, below every live count
     let isEditing = false;
+    let olderBefore = null;
+    // Response bodies by content hash, so a repeated body arrives as just its hash.
+    // The backend mirrors this LRU (UI_BODY_CACHE_BYTES) to know which hashes are safe to send.
+    const BODY_CACHE_BYTES = 64 * 1024 * 1024;
+    const bodiesByHash = new Map();
+    let bodyCacheBytes = 0;
+
+    function rememberBody(hash, body) {
+        if (bodiesByHash.has(hash)) { bodyCacheBytes -= bodiesByHash.get(hash).length; bodiesByHash.delete(hash); }
+        if (body.length > BODY_CACHE_BYTES) return;
+        bodiesByHash.set(hash, body); bodyCacheBytes += body.length;
+        for (const [oldest, old] of bodiesByHash) {
+            if (bodyCacheBytes <= BODY_CACHE_BYTES) break;
+            bodiesByHash.delete(oldest); bodyCacheBytes -= old.length;
+        }
+    }
 
     // --- Keyboard Shortcuts ---
     document.addEventListener('keydown', (e) => {
@@ -115,17 +303,16 @@ document.addEventListener('DOMContentLoaded', () => {
         return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;").replace(/'/g, "&#039;");
     }
 
-    function applyHighlight(text, term) {
-        const safeText = escapeHtml(text);
-        if (!term || term.length === 0) return safeText;
-        const escapedTerm = term.replace(/[.*+?^${}()|[\\]\\\\]/g, '\\\\$&');
-        const parts = text.split(new RegExp(`(${escapedTerm})`, 'gi'));
-        return parts.map(part => {
-             if (part.toLowerCase() === term.toLowerCase()) {
-                 return `<span class="highlight">${escapeHtml(part)}</span>`;
-             }
-             return escapeHtml(part);
-        }).join('');
+    // pattern is the global RegExp the backend built for the current search (null when not searching)
+    function applyHighlight(text, pattern) {
+        if (!pattern) return escapeHtml(text);
+        let html = '', last = 0;
+        for (const match of text.matchAll(pattern)) {
+            if (!match[0]) continue;
+            html += escapeHtml(text.slice(last, match.index)) + `<span class="highlight">${escapeHtml(match[0])}</span>`;
+            last = match.index + match[0].length;
+        }
+        return html + escapeHtml(text.slice(last));
     }
 
     function parseAndDisplayResponse(rawResponse, highlightTerm) {
@@ -146,6 +333,41 @@ document.addEventListener('DOMContentLoaded', () => {
         responseBody.innerHTML = applyHighlight(bodyStr, highlightTerm);
     }
 
+    // Waterfall of phases (ms from request start) plus the backend's queue and pause measurements
+    function renderTiming(timing) {
+        timingView.replaceChildren();
+        if (!timing) { timingView.textContent = 'No timing data.'; return; }
+        const phases = timing.phases || [];
+        const total = timing.total_ms || Math.max(0, ...phases.map(p => p.end));
+        for (const phase of phases) {
+            const row = document.createElement('div');
+            row.className = 'timing-row';
+            const label = document.createElement('span');
+            label.className = 'timing-label';
+            label.textContent = phase.name;
+            const track = document.createElement('span');
+            track.className = 'timing-track';
+            const bar = document.createElement('span');
+            bar.className = `timing-bar timing-${phase.name}`;
+            bar.style.left = `${total ? phase.start / total * 100 : 0}%`;
+            bar.style.width = `${total ? Math.max((phase.end - phase.start) / total * 100, 0.5) : 0}%`;
+            track.appendChild(bar);
+            const value = document.createElement('span');
+            value.className = 'timing-value';
+            value.textContent = `${(phase.end - phase.start).toFixed(1)} ms`;
+            row.append(label, track, value);
+            timingView.appendChild(row);
+        }
+        const extras = [['total', timing.total_ms], ['browser', timing.browser_ms], ['round trip', timing.roundtrip_ms], ['pause-to-continue', timing.pause_to_continue_ms], ['continue queue', timing.continue_queue_ms], ['body queue', timing.body_queue_ms]]
+            .filter(([, v]) => v !== undefined && v !== null);
+        if (extras.length) {
+            const summary = document.createElement('div');
+            summary.className = 'timing-summary';
+            summary.textContent = extras.map(([k, v]) => `${k}: ${v.toFixed(2)} ms`).join(' | ');
+            timingView.appendChild(summary);
+        }
+    }
+
     function getStatusClass(statusCode) {
         if (!statusCode) return '';
         const code = parseInt(statusCode);
@@ -156,20 +378,47 @@ document.addEventListener('DOMContentLoaded', () => {
         return '';
     }
 
-    function updateDetailsPanes(id) {
-        if (!id || !requests[id]) return;
-
+    function updateDetailsPanes(detail) {
         if (isEditing) toggleEditMode();
 
-        const req = requests[id];
-        let rawRequest = `${req.method} ${req.url} HTTP/1.1\\n`;
-        for (const [key, value] of Object.entries(req.headers)) { rawRequest += `${key}: ${value}\\n`; }
-        if (req.postData) { rawRequest += `\\n${req.postData}`; }
+        let rawRequest = `${detail.method} ${detail.url} HTTP/1.1\\n`;
+        for (const [key, value] of Object.entries(detail.headers)) { rawRequest += `${key}: ${value}\\n`; }
+        if (detail.postData) { rawRequest += `\\n${detail.postData}`; }
 
         requestEdit.value = rawRequest;
-        requestView.innerHTML = applyHighlight(rawRequest, searchInput.value.trim());
+        requestView.innerHTML = applyHighlight(rawRequest, highlightPattern);
+        renderResponse(detail);
+    }
 
-        parseAndDisplayResponse(req.response, searchInput.value.trim());
+    function renderResponse(detail) {
+        parseAndDisplayResponse(`${detail.response_headers}\\n\\n${detail.body}`, highlightPattern);
+        renderTiming(detail.timing);
+        renderBlobLink(detail.blob);
+        // Large bodies arrive cut short; the rest is read in ranges
+        // body_end and body_length are the backend's code point counts; body.length would count UTF-16 units
+        bodyMoreBtn.classList.toggle('hidden', detail.body_end >= detail.body_length);
+        bodyMoreBtn.textContent = `Load more (${detail.body_end} of ${detail.body_length} characters shown)`;
+    }
+
+    // The backend answers with the entry's details, and pushes them again while its body is still on the way
+    function selectRequest(id) {
+        selectedRequestId = id;
+        openDetail = null;
+        scheduleRender();
+        if (isEditing) toggleEditMode();
+        requestEdit.value = '';
+        requestView.textContent = 'Loading...';
+        parseAndDisplayResponse('', null);
+        bodyMoreBtn.classList.add('hidden');
+        ws.send(JSON.stringify({ type: 'get_detail', id: id }));
+    }
+
+    // Streamed and binary bodies live on the backend; the pane shows a preview and links to the full body
+    function renderBlobLink(blob) {
+        blobLink.classList.toggle('hidden', !blob);
+        if (!blob) return;
+        blobLink.href = blob.url;
+        blobLink.textContent = `Download full body (${blob.size} bytes, ${blob.mime || 'unknown type'})`;
     }
 
     function toggleEditMode() {
@@ -183,7 +432,7 @@ document.addEventListener('DOMContentLoaded', () => {
             requestView.classList.remove('hidden');
             requestEdit.classList.add('hidden');
             editBtn.textContent = 'Edit';
-            requestView.innerHTML = applyHighlight(requestEdit.value, searchInput.value.trim());
+            requestView.innerHTML = applyHighlight(requestEdit.value, highlightPattern);
         }
     }
 
@@ -191,20 +440,16 @@ document.addEventListener('DOMContentLoaded', () => {
         const item = document.createElement('li');
         item.dataset.id = req.id;
         item.dataset.count = req.count;
+        if (search && req.matches) item.title = 'Matches in ' + [...new Set(req.matches.map(m => m.field))].join(', ');
 
         const statusDot = document.createElement('span');
         statusDot.className = 'status-indicator';
 
-        if (req.response) {
-            const firstLine = req.response.split('\\n')[0];
-            // Regex Permissive Update for HTTP/2 and weird protocols
-            const match = firstLine.match(/HTTP\\/.*?\\s(\\d{3})/);
-            if (match) statusDot.classList.add(getStatusClass(match[1]));
-        }
+        if (req.status) statusDot.classList.add(getStatusClass(req.status));
 
         const textSpan = document.createElement('span');
         textSpan.className = 'req-text';
-        const labelText = `${req.count}. ${req.method} ${req.url}`;
+        const labelText = `${req.label || req.count}. ${req.method} ${req.url}`;
 
         if (query) {
              textSpan.innerHTML = applyHighlight(labelText, query);
@@ -217,34 +462,136 @@ document.addEventListener('DOMContentLoaded', () => {
         return item;
     }
 
-    function filterHistory() {
-        const query = searchInput.value.trim();
-        const lowerQuery = query.toLowerCase();
+    // --- Virtualized History List ---
+    // visibleIds holds the filtered ids in count order. Only the rows inside the viewport exist in the DOM,
+    // and incoming messages patch visibleIds in place instead of rebuilding the whole list.
+    // While a search is active the list holds the backend's ranked hits instead, fetched a page at a time.
+    const HAR_CHUNK_BYTES = 512 * 1024; // Under the backend's 1 MB websocket message limit once base64-encoded
+    const ROW_HEIGHT = 26, OVERSCAN = 10, SEARCH_DEBOUNCE_MS = 150, SEARCH_PAGE_SIZE = 200, SEARCH_REFRESH_MS = 1000;
+    let visibleIds = [], renderScheduled = false, searchTimer = null;
+    let search = null, searchSeq = 0, highlightPattern = null, searchRefreshTimer = null;
+
+    function matchesQuery(req) {
+        return !targetFilter.value || req.target_id === targetFilter.value;
+    }
 
-        historyList.innerHTML = '';
-        const sortedReqs = Object.values(requests).sort((a, b) => a.count - b.count);
-
-        sortedReqs.forEach(req => {
-            let searchable = `${req.method} ${req.url}`;
-            if (req.postData) searchable += ` ${req.postData}`;
-            for (const [key, value] of Object.entries(req.headers)) { searchable += ` ${key} ${value}`; }
-            if (req.response) searchable += ` ${req.response}`;
-
-            if (!query || searchable.toLowerCase().includes(lowerQuery)) {
-                const item = renderListItem(req, query);
-                if (selectedRequestId === req.id) item.classList.add('selected');
-                historyList.appendChild(item);
-            }
-        });
+    function requestSearch(query, offset, limit) {
+        if (!ws || ws.readyState !== WebSocket.OPEN) return;
+        if (offset === 0) search = { id: ++searchSeq, query: query, total: 0, loaded: 0 };
+        search.loading = true;
+        ws.send(JSON.stringify({ type: 'search', search_id: search.id, query: query, offset: offset, limit: limit, target_id: targetFilter.value || null }));
+    }
+
+    // New captures while searching re-run the query (at most once a second) instead of being matched here
+    function refreshSearchSoon() {
+        if (searchRefreshTimer) return;
+        searchRefreshTimer = setTimeout(() => {
+            searchRefreshTimer = null;
+            if (search) requestSearch(search.query, 0, Math.max(SEARCH_PAGE_SIZE, search.loaded));
+        }, SEARCH_REFRESH_MS);
+    }
+
+    function showSearchResults(res) {
+        if (!search || res.search_id !== search.id) return; // Superseded by a newer search
+        search.loading = false;
+        search.total = res.total;
+        searchInput.classList.toggle('search-error', !!res.error);
+        searchInput.title = res.error || '';
+        try { highlightPattern = res.highlight ? new RegExp(res.highlight, 'gi') : null; } catch (e) { highlightPattern = null; }
+        const shown = new Set(res.offset ? visibleIds : []);
+        const ids = [];
+        for (const hit of res.hits) {
+            if (!requests[hit.id] || shown.has(hit.id)) continue; // Cleared here, or already listed from an earlier page
+            requests[hit.id].matches = hit.matches;
+            ids.push(hit.id);
+        }
+        visibleIds = res.offset ? visibleIds.concat(ids) : ids;
+        search.loaded = res.offset + res.hits.length;
+        scheduleRender();
+        refreshSelectedHighlight();
+    }
+
+    function renderTargetOptions() {
+        const selected = targetFilter.value;
+        const options = [new Option('All targets', '')];
+        for (const t of Object.values(targets)) {
+            let label = `${t.type}: ${t.title || t.url || t.id}`;
+            if (label.length > 80) label = label.slice(0, 77) + '...';
+            options.push(new Option(t.open ? label : `${label} (closed)`, t.id));
+        }
+        targetFilter.replaceChildren(...options);
+        targetFilter.value = targets[selected] ? selected : '';
+        if (targetFilter.value !== selected) filterHistory();
+    }
+
+    // First position in visibleIds whose count is >= count
+    function visibleIndex(count) {
+        let lo = 0, hi = visibleIds.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (requests[visibleIds[mid]].count < count) lo = mid + 1; else hi = mid;
+        }
+        return lo;
+    }
+
+    function showIfMatching(req) {
+        if (search) { refreshSearchSoon(); return; }
+        if (!matchesQuery(req)) return;
+        const last = visibleIds.length ? requests[visibleIds[visibleIds.length - 1]] : null;
+        if (!last || last.count < req.count) { visibleIds.push(req.id); return; }
+        const index = visibleIndex(req.count);
+        if (visibleIds[index] !== req.id) visibleIds.splice(index, 0, req.id);
+    }
+
+    function hideRow(req) {
+        const index = search ? visibleIds.indexOf(req.id) : visibleIndex(req.count);
+        if (visibleIds[index] === req.id) visibleIds.splice(index, 1);
+    }
+
+    function scheduleRender() {
+        if (renderScheduled) return;
+        renderScheduled = true;
+        requestAnimationFrame(renderVisibleRows);
+    }
+
+    function renderVisibleRows() {
+        renderScheduled = false;
+        historySpacer.style.height = `${visibleIds.length * ROW_HEIGHT}px`;
+        const first = Math.max(0, Math.floor(historyViewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+        const last = Math.min(visibleIds.length, Math.ceil((historyViewport.scrollTop + historyViewport.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+        historyList.style.transform = `translateY(${first * ROW_HEIGHT}px)`;
+        const fragment = document.createDocumentFragment();
+        for (let i = first; i < last; i++) {
+            const item = renderListItem(requests[visibleIds[i]], highlightPattern);
+            if (selectedRequestId === visibleIds[i]) item.classList.add('selected');
+            fragment.appendChild(item);
+        }
+        historyList.replaceChildren(fragment);
+        if (search && !search.loading && search.loaded < search.total && last >= visibleIds.length - OVERSCAN) {
+            requestSearch(search.query, search.loaded, SEARCH_PAGE_SIZE);
+        }
+    }
 
-        if (selectedRequestId && !isEditing) {
-             requestView.innerHTML = applyHighlight(requestEdit.value, query);
-             if (requests[selectedRequestId].response) {
-                 parseAndDisplayResponse(requests[selectedRequestId].response, query);
-             }
+    function refreshSelectedHighlight() {
+        if (openDetail && !isEditing) {
+             requestView.innerHTML = applyHighlight(requestEdit.value, highlightPattern);
+             parseAndDisplayResponse(`${openDetail.response_headers}\\n\\n${openDetail.body}`, highlightPattern);
         }
     }
 
+    // An empty query lists everything locally; anything else is searched on the backend, which indexes all it has captured
+    function filterHistory() {
+        const query = searchInput.value.trim();
+        if (query) { requestSearch(query, 0, SEARCH_PAGE_SIZE); return; }
+        search = null;
+        highlightPattern = null;
+        searchInput.classList.remove('search-error');
+        searchInput.title = '';
+        visibleIds = Object.values(requests).filter(matchesQuery).sort((a, b) => a.count - b.count).map(req => req.id);
+        scheduleRender();
+        refreshSelectedHighlight();
+    }
+
     function parseRequestParts(rawRequest) {
         const headerEndIndex = rawRequest.indexOf('\\n\\n');
         let headersPart = rawRequest;
@@ -310,34 +657,163 @@ document.addEventListener('DOMContentLoaded', () => {
         return py;
     }
 
-    ws.onopen = () => console.log('Connected to backend.');
-    ws.onerror = (error) => console.error('WebSocket Error:', error);
+    // Reconnects with backoff, so a restarted backend (e.g. with --attach) picks this tab back up
+    function connect() {
+        ws = new WebSocket(`ws://127.0.0.1:8765`);
+        ws.onopen = () => {
+            console.log('Connected to backend.');
+            bodiesByHash.clear(); bodyCacheBytes = 0;
+            synced = false;
+            resuming = false;
+            resume();
+            if (selectedRequestId) ws.send(JSON.stringify({ type: 'get_detail', id: selectedRequestId }));
+            reconnectDelay = 250;
+        };
+        ws.onerror = (error) => console.error('WebSocket Error:', error);
+        ws.onclose = () => {
+            setTimeout(connect, reconnectDelay);
+            reconnectDelay = Math.min(reconnectDelay * 2, 2000);
+        };
+        ws.onmessage = (event) => {
+            const frame = JSON.parse(event.data);
+            const messages = frame.type === 'batch' ? frame.data : [frame];
+            const from = frame.type === 'batch' ? frame.from : frame.seq;
+            const to = frame.type === 'batch' ? frame.to : frame.seq;
+            // A frame that starts past lastSeq + 1 means updates went missing: ask to resume from lastSeq
+            if (from !== undefined && synced && from > lastSeq + 1) { resume(); return; }
+            for (const message of messages) {
+                // Updates already applied, or sent before the snapshot this tab is waiting for, are skipped
+                if (message.seq !== undefined && (!synced || message.seq <= lastSeq)) continue;
+                handleMessage(message);
+            }
+            if (to !== undefined && synced && to > lastSeq) lastSeq = to;
+        };
+    }
+
+    // The backend replays what this tab missed, or sends a resync when it no longer has it
+    function resume() {
+        if (resuming) return;
+        resuming = true;
+        synced = false;
+        ws.send(JSON.stringify({ type: 'hello', version: PROTOCOL_VERSION, run: runId, seq: lastSeq }));
+    }
+    connect();
+
+    function showDetail(detail) {
+        if (detail.id !== selectedRequestId) return;
+        if (detail.body === undefined) {
+            // Only the hash was sent: this tab already holds an identical body
+            const cached = bodiesByHash.get(detail.hash);
+            if (cached === undefined) { ws.send(JSON.stringify({ type: 'get_detail', id: detail.id, resend: true })); return; }
+            rememberBody(detail.hash, cached);
+            detail.body = cached;
+        } else if (detail.hash) {
+            rememberBody(detail.hash, detail.body);
+        }
+        // A detail pushed for the open entry (its body arrived) only refreshes the response, so edits survive
+        if (openDetail && openDetail.id === detail.id) renderResponse(detail);
+        else updateDetailsPanes(detail);
+        openDetail = detail;
+    }
 
-    ws.onmessage = (event) => {
-        const message = JSON.parse(event.data);
-        if (message.type === 'new_request') {
-            const req = message.data;
-            req.count = requestCounter;
-            requests[req.id] = req;
-            requestCounter++;
+    function handleMessage(message) {
+        if (message.type === 'hello') {
+            resuming = false;
+            if (message.data.error) { harStatus.textContent = message.data.error; return; }
+            runId = message.data.run;
+            // Not resumed: a resync with the whole list follows
+            synced = !!message.data.resumed;
+        } else if (message.type === 'entry') {
+            // Summaries are complete, so each one replaces what the row showed
+            const summary = message.data;
+            const req = requests[summary.id];
+            if (req) {
+                delete req.pending;
+                Object.assign(req, summary);
+            } else {
+                summary.count = requestCounter++;
+                requests[summary.id] = summary;
+            }
+            showIfMatching(requests[summary.id]);
+            scheduleRender();
+        } else if (message.type === 'detail') {
+            showDetail(message.data);
+        } else if (message.type === 'body_range') {
+            const range = message.data;
+            if (!openDetail || openDetail.id !== range.id || range.offset !== openDetail.body_end) return;
+            openDetail.body += range.chunk;
+            openDetail.body_end = range.end;
+            openDetail.body_length = range.body_length;
+            renderResponse(openDetail);
+        } else if (message.type === 'session_page') {
+            // Stored entries from a resumed session, newest first. They sort before every live entry, in stored
+            // order, and are labelled with their stored sequence number
+            for (const entry of message.data.entries) {
+                entry.count = entry.seq - STORED_COUNT_BASE;
+                entry.label = entry.seq;
+                requests[entry.id] = entry;
+            }
+            olderBefore = message.data.before;
+            loadOlderBtn.classList.toggle('hidden', olderBefore === null);
             filterHistory();
-        } else if (message.type === 'response_data') {
-            const res = message.data;
-            if (requests[res.id]) {
-                requests[res.id].response = res.body;
-                if (selectedRequestId === res.id) {
-                    parseAndDisplayResponse(res.body, searchInput.value.trim());
-                }
-                filterHistory();
+        } else if (message.type === 'attack_result') {
+            if (message.data.attack_id === currentAttackId) {
+                attackResults.push(message.data);
+                scheduleAttackRender();
             }
-        } else if (message.type === 'repeated_response') {
-            parseAndDisplayResponse(message.data, searchInput.value.trim());
-        } else if (message.type === 'remove_request') {
-            const idToRemove = message.data.id;
-            if (requests[idToRemove]) delete requests[idToRemove];
+        } else if (message.type === 'attack_done') {
+            if (message.data.attack_id === currentAttackId) {
+                const d = message.data;
+                attackRunning = false;
+                attackStatus.textContent = d.error ? `Failed: ${d.error}` : `${d.stopped ? 'Stopped' : 'Done'} - ${d.sent} sent`;
+            }
+        } else if (message.type === 'resync') {
+            // A new tab, a restarted backend, or one that dropped updates while this tab was behind: rebuild from its history
+            requests = {};
+            requestCounter = 1;
+            for (const entry of message.data.entries) {
+                entry.count = requestCounter++;
+                requests[entry.id] = entry;
+            }
+            runId = message.data.run;
+            lastSeq = message.data.seq;
+            synced = true;
+            for (const t of message.data.targets) targets[t.id] = t;
+            renderTargetOptions();
             filterHistory();
+        } else if (message.type === 'error') {
+            // A request the backend couldn't serve: say so in the response pane rather than leave it loading
+            const e = message.data;
+            if (e.id === selectedRequestId) responseBody.textContent = `[${e.message}]`;
+            else console.warn(`${e.command} ${e.id}: ${e.message}`);
+        } else if (message.type === 'search_results') {
+            showSearchResults(message.data);
+        } else if (message.type === 'har_status') {
+            harStatus.innerHTML = escapeHtml(message.data.message) + (message.data.url ? ` <a href="${escapeHtml(message.data.url)}" download>Download</a>` : '');
+        } else if (message.type === 'target_list') {
+            for (const t of message.data) targets[t.id] = t;
+            renderTargetOptions();
+        } else if (message.type === 'repeated_response') {
+            // Sends carry the id they went out with; only the latest one is shown. An attack row's response has no id.
+            if (message.id !== undefined) {
+                repeatsInFlight.delete(message.id);
+                renderRepeatStatus();
+                if (message.id !== shownRepeatId) return;
+            }
+            shownRepeatId = null;
+            cancelBtn.classList.add('hidden');
+            parseAndDisplayResponse(message.data, highlightPattern);
+            renderTiming(message.timing);
+            renderBlobLink(null);
+        } else if (message.type === 'remove') {
+            const req = requests[message.data.id];
+            if (req) {
+                hideRow(req);
+                delete requests[req.id];
+                scheduleRender();
+            }
         }
-    };
+    }
 
     historyList.addEventListener('click', (e) => {
         let target = e.target;
@@ -345,26 +821,42 @@ document.addEventListener('DOMContentLoaded', () => {
             target = target.parentElement;
         }
 
-        if (target && target.nodeName === 'LI') {
-            const id = target.dataset.id;
-            selectedRequestId = id;
-            filterHistory();
-            updateDetailsPanes(id);
-        }
+        if (target && target.nodeName === 'LI') selectRequest(target.dataset.id);
+    });
+
+    bodyMoreBtn.addEventListener('click', () => {
+        if (openDetail) ws.send(JSON.stringify({ type: 'get_body_range', id: openDetail.id, offset: openDetail.body_end }));
     });
 
+    // Each Send runs on its own on the backend, so a slow one never holds up the next
+    let repeatCounter = 0, shownRepeatId = null;
+    const repeatsInFlight = new Set();
+
+    function renderRepeatStatus() {
+        repeatStatus.textContent = repeatsInFlight.size ? `${repeatsInFlight.size} in flight` : '';
+    }
+
     sendBtn.addEventListener('click', () => {
         const rawRequest = requestEdit.value;
         if (!rawRequest) return;
 
         if (!isEditing) {
-             requestView.innerHTML = applyHighlight(rawRequest, searchInput.value.trim());
+             requestView.innerHTML = applyHighlight(rawRequest, highlightPattern);
         }
 
         const shouldRender = renderCheckbox.checked;
+        const id = `send-${Date.now()}-${++repeatCounter}`;
+        shownRepeatId = id;
+        repeatsInFlight.add(id);
+        renderRepeatStatus();
+        cancelBtn.classList.remove('hidden');
         responseHeaders.textContent = 'Sending request via browser...';
         responseBody.textContent = '';
-        ws.send(JSON.stringify({ type: 'repeat_request', data: rawRequest, render: shouldRender }));
+        ws.send(JSON.stringify({ type: 'repeat_request', id: id, data: rawRequest, render: shouldRender, timeout: Number(repeatTimeout.value) || null }));
+    });
+
+    cancelBtn.addEventListener('click', () => {
+        if (shownRepeatId) ws.send(JSON.stringify({ type: 'repeat_cancel', id: shownRepeatId }));
     });
 
     editBtn.addEventListener('click', toggleEditMode);
@@ -383,60 +875,1597 @@ document.addEventListener('DOMContentLoaded', () => {
     curlBtn.addEventListener('click', () => handleCopy(curlBtn, generateCurl));
     pyBtn.addEventListener('click', () => handleCopy(pyBtn, generatePython));
 
+    // --- Attack Mode ---
+    const attackPanel = document.getElementById('attack-panel');
+    const attackPayloadType = document.getElementById('attack-payload-type');
+    const attackPayloads = document.getElementById('attack-payloads');
+    const attackNumbers = document.getElementById('attack-numbers');
+    const attackStatus = document.getElementById('attack-status');
+    const attackTableBody = document.querySelector('#attack-results tbody');
+    let currentAttackId = null, attackResults = [], attackSort = { key: 'index', dir: 1 }, attackRenderScheduled = false, attackRunning = false;
+
+    function scheduleAttackRender() {
+        if (attackRenderScheduled) return;
+        attackRenderScheduled = true;
+        requestAnimationFrame(renderAttackResults);
+    }
+
+    function renderAttackResults() {
+        attackRenderScheduled = false;
+        const { key, dir } = attackSort;
+        const rows = attackResults.slice().sort((a, b) => {
+            const x = a[key] === null || a[key] === undefined ? '' : a[key], y = b[key] === null || b[key] === undefined ? '' : b[key];
+            return (x < y ? -1 : x > y ? 1 : 0) * dir;
+        });
+        const fragment = document.createDocumentFragment();
+        for (const r of rows) {
+            const tr = document.createElement('tr');
+            tr.dataset.index = r.index;
+            for (const value of [r.index, r.position, r.payload, r.error ? 'ERR' : r.status, r.length, r.time_ms]) {
+                const td = document.createElement('td');
+                td.textContent = value;
+                tr.appendChild(td);
+            }
+            if (r.error) tr.title = r.error;
+            fragment.appendChild(tr);
+        }
+        attackTableBody.replaceChildren(fragment);
+        // Once attack_done arrives its Done/Stopped/Failed summary stays
+        if (attackRunning) attackStatus.textContent = `${attackResults.length} received`;
+    }
+
+    attackBtn.addEventListener('click', () => attackPanel.classList.toggle('hidden'));
+    document.getElementById('attack-close').addEventListener('click', () => attackPanel.classList.add('hidden'));
+    attackPayloadType.addEventListener('change', () => {
+        const numbers = attackPayloadType.value === 'numbers';
+        attackPayloads.classList.toggle('hidden', numbers);
+        attackNumbers.classList.toggle('hidden', !numbers);
+    });
+
+    document.getElementById('attack-mark').addEventListener('click', () => {
+        if (!isEditing) toggleEditMode();
+        const { selectionStart, selectionEnd, value } = requestEdit;
+        requestEdit.value = `${value.substring(0, selectionStart)}§${value.substring(selectionStart, selectionEnd)}§${value.substring(selectionEnd)}`;
+        requestEdit.focus();
+    });
+
+    document.getElementById('attack-start').addEventListener('click', () => {
+        const template = requestEdit.value;
+        if (!template.includes('§')) { attackStatus.textContent = 'No § insertion points in the request.'; return; }
+        const payloads = attackPayloadType.value === 'numbers'
+            ? { type: 'numbers', from: document.getElementById('attack-from').value, to: document.getElementById('attack-to').value, step: document.getElementById('attack-step').value }
+            : { type: 'list', values: attackPayloads.value.split('\\n').filter(line => line.length) };
+        currentAttackId = `attack-${Date.now()}`;
+        attackResults = [];
+        attackRunning = true;
+        attackStatus.textContent = 'Running...';
+        scheduleAttackRender();
+        ws.send(JSON.stringify({ type: 'attack_start', data: {
+            attack_id: currentAttackId, template: template, payloads: payloads,
+            mode: document.getElementById('attack-mode').value,
+            concurrency: document.getElementById('attack-concurrency').value,
+            rate: document.getElementById('attack-rate').value,
+            race: document.getElementById('attack-race').checked,
+        }}));
+    });
+
+    document.getElementById('attack-stop').addEventListener('click', () => {
+        if (currentAttackId) ws.send(JSON.stringify({ type: 'attack_stop', attack_id: currentAttackId }));
+    });
+
+    document.querySelector('#attack-results thead').addEventListener('click', (e) => {
+        const key = e.target.dataset.key;
+        if (!key) return;
+        attackSort = { key: key, dir: attackSort.key === key ? -attackSort.dir : 1 };
+        scheduleAttackRender();
+    });
+
+    attackTableBody.addEventListener('click', (e) => {
+        const tr = e.target.closest('tr');
+        if (!tr) return;
+        attackTableBody.querySelectorAll('tr.selected').forEach(row => row.classList.remove('selected'));
+        tr.classList.add('selected');
+        responseHeaders.textContent = 'Loading attack response...';
+        responseBody.textContent = '';
+        ws.send(JSON.stringify({ type: 'get_attack_response', attack_id: currentAttackId, index: parseInt(tr.dataset.index) }));
+    });
+
+    loadOlderBtn.addEventListener('click', () => {
+        if (olderBefore !== null) ws.send(JSON.stringify({ type: 'load_session_page', before: olderBefore }));
+    });
+
     clearHistoryBtn.addEventListener('click', () => {
         historyList.innerHTML = '';
+        visibleIds = [];
+        scheduleRender();
         requests = {};
         selectedRequestId = null;
+        openDetail = null;
+        bodyMoreBtn.classList.add('hidden');
         requestEdit.value = '';
         requestView.textContent = '';
         responseHeaders.textContent = '';
         responseBody.textContent = '';
         requestCounter = 1;
         searchInput.value = '';
+        search = null;
+        highlightPattern = null;
+    });
+
+    searchInput.addEventListener('input', () => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(filterHistory, SEARCH_DEBOUNCE_MS);
+    });
+    historyViewport.addEventListener('scroll', scheduleRender);
+    window.addEventListener('resize', scheduleRender);
+    targetFilter.addEventListener('change', filterHistory);
+
+    document.getElementById('export-har').addEventListener('click', () => {
+        harStatus.textContent = 'Exporting...';
+        ws.send(JSON.stringify({ type: 'export_har' }));
     });
 
-    searchInput.addEventListener('input', filterHistory);
+    const harFile = document.getElementById('har-file');
+    document.getElementById('import-har').addEventListener('click', () => harFile.click());
+    harFile.addEventListener('change', () => {
+        const file = harFile.files[0];
+        harFile.value = '';
+        if (file) uploadHar(file);
+    });
+
+    function readBase64(blob) {
+        return new Promise((resolve, reject) => {
+            const reader = new FileReader();
+            reader.onload = () => resolve(reader.result.slice(reader.result.indexOf(',') + 1));
+            reader.onerror = () => reject(reader.error);
+            reader.readAsDataURL(blob);
+        });
+    }
+
+    // The file goes up in base64 pieces, each sent once the socket has drained, so a large HAR is never held whole
+    async function uploadHar(file) {
+        const uploadId = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        let offset = 0;
+        try {
+            do {
+                const data = await readBase64(file.slice(offset, offset + HAR_CHUNK_BYTES));
+                while (ws.bufferedAmount > HAR_CHUNK_BYTES) await new Promise(resolve => setTimeout(resolve, 20));
+                offset += HAR_CHUNK_BYTES;
+                ws.send(JSON.stringify({ type: 'import_har_chunk', upload_id: uploadId, name: file.name, data: data, done: offset >= file.size }));
+                harStatus.textContent = offset >= file.size ? 'Importing...' : `Uploading ${Math.round(100 * offset / file.size)}%...`;
+            } while (offset < file.size);
+        } catch (e) {
+            harStatus.textContent = `Import failed: ${e}`;
+        }
+    }
+
+    // Enter pulls bodies not yet fetched from Chrome (lazy mode) into the backend, so the search can cover them too
+    searchInput.addEventListener('keydown', (e) => {
+        if (e.key !== 'Enter') return;
+        const ids = Object.values(requests).filter(req => req.pending).map(req => req.id);
+        if (ids.length) ws.send(JSON.stringify({ type: 'get_bodies', ids: ids }));
+    });
 });
 """
 
 # --- Part 2: Backend Logic ---
 
-async def execute_cdp_command(method, params={}, session_id=None):
+async def execute_cdp_command(method, params={}, session_id=None, timeout=None):
+    """Sends a command and returns its result: {} on a CDP error, or when no reply comes within timeout (CDP_COMMAND_TIMEOUT)."""
     global CDP_COMMAND_ID
     CDP_COMMAND_ID += 1; command_id = CDP_COMMAND_ID
-    future = asyncio.Future()
-    command = {"id": command_id, "method": method, "params": params, "future": future}
+    future = asyncio.get_running_loop().create_future(); lifecycle.track("command", command_id, future)
+    command = {"id": command_id, "method": method, "params": params}
     if session_id: command["sessionId"] = session_id
-    await cdp_command_queue.put(command)
-    return await future
-
-def host_response_body(response_data):
+    queue_cdp_command(command)
+    try: return await asyncio.wait_for(future, timeout or CDP_COMMAND_TIMEOUT)
+    except asyncio.TimeoutError:
+        lifecycle.pop("command", command_id, "timed_out"); print(f"CDP command {method} (id {command_id}) got no reply; giving up.")
+        return {}
+    except asyncio.CancelledError:
+        lifecycle.pop("command", command_id, "cancelled"); raise
+
+def queue_cdp_command(command, history_id=None, timing_key=None, started_at=None):
+    """Queues a command for the CDP writer. With a history_id, the writer records how long it waited (and since started_at)."""
+    command["_queued_at"] = time.perf_counter()
+    if history_id is not None: command["_history_id"] = history_id; command["_timing_key"] = timing_key; command["_started_at"] = started_at
+    cdp_command_queue.put_nowait(command)
+
+def record_timing(history_id, **values):
+    if history_id not in request_history: return
+    timing = dict(request_history.get(history_id, 'timing') or {}); timing.update(values)
+    update_request(history_id, timing=timing)
+
+NETWORK_PHASES = (("proxy", "proxyStart", "proxyEnd"), ("dns", "dnsStart", "dnsEnd"), ("connect", "connectStart", "connectEnd"), ("ssl", "sslStart", "sslEnd"), ("send", "sendStart", "sendEnd"), ("wait", "sendEnd", "receiveHeadersEnd"))
+
+def network_phases(resource_timing):
+    """Converts a CDP ResourceTiming into waterfall phases, in ms from the start of the request (-1 marks an unused phase)."""
+    phases = []
+    for name, start_key, end_key in NETWORK_PHASES:
+        start, end = resource_timing.get(start_key, -1), resource_timing.get(end_key, -1)
+        if start >= 0 and end >= 0: phases.append({"name": name, "start": round(start, 3), "end": round(end, 3)})
+    return phases
+
+def compile_scope(hosts, path_prefixes, resource_types, methods):
+    """Compiles the scope into the narrowest Fetch.enable pattern list plus an in-process matcher."""
+    host_re = re.compile("|".join(fnmatch.translate(h.lower()) for h in hosts)) if hosts else None
+    prefixes = tuple(p if p.startswith('/') else f"/{p}" for p in path_prefixes)
+    types = frozenset(resource_types); allowed_methods = frozenset(m.upper() for m in methods)
+
+    def in_scope(url, method=None, resource_type=None):
+        if allowed_methods and method and method.upper() not in allowed_methods: return False
+        if types and resource_type and resource_type not in types: return False
+        if host_re or prefixes:
+            parts = urllib.parse.urlsplit(url)
+            if host_re and not host_re.match(parts.hostname or ""): return False
+            if prefixes and not (parts.path or "/").startswith(prefixes): return False
+        return True
+
+    # Fetch wildcards are a coarse pre-filter; in_scope() has the final say on anything that still pauses.
+    if hosts or prefixes:
+        host_globs = [g for h in hosts for g in (h.lower(), f"{h.lower()}:*")] or ["*"]
+        url_patterns = [f"*://{h}{p}*" for h in host_globs for p in (prefixes or ("/",))]
+    else:
+        url_patterns = ["*"]
+    if types: patterns = [{"urlPattern": u, "resourceType": t} for u in url_patterns for t in sorted(types)]
+    else: patterns = [{"urlPattern": u} for u in url_patterns]
+    return patterns, in_scope
+
+ReplaceRule = collections.namedtuple("ReplaceRule", "index stage method url_re part name match replace")
+
+class MatchReplaceRules:
+    """MATCH_REPLACE_RULES, compiled once: regexes are built up front and rules are indexed by host.
+
+    A lookup costs a dict hit for a host seen before (the rules that can apply to it are cached per host),
+    then only those rules' method and URL checks. Hits are counted per rule index.
+    """
+    STAGES = ('request', 'response'); PARTS = {'request': ('header', 'url', 'body'), 'response': ('header', 'body')}
+    HOST_CACHE_SIZE = 4096
+
+    def __init__(self, specs):
+        self.exact = collections.defaultdict(list); self.suffix = collections.defaultdict(list); self.globs = []; self.any_host = []
+        self.host_cache = {}; self.hits = collections.Counter()
+        self.request_rules = self.response_rules = 0
+        for index, spec in enumerate(specs):
+            if not isinstance(spec, dict): raise ValueError(f"Match-and-replace rule {index}: expected a dict, got {type(spec).__name__}")
+            stage = spec.get('stage', 'request'); part = spec.get('part', 'header')
+            if stage not in self.STAGES or part not in self.PARTS[stage]: raise ValueError(f"Match-and-replace rule {index}: can't replace the {part} at the {stage} stage")
+            if part != 'header' and not spec.get('match'): raise ValueError(f"Match-and-replace rule {index}: a {part} rule needs a match regex")
+            if part == 'header' and not spec.get('name'): raise ValueError(f"Match-and-replace rule {index}: a header rule needs a name")
+            if not isinstance(spec.get('replace', ''), (str, type(None))): raise ValueError(f"Match-and-replace rule {index}: replace must be a string or None")
+            try:
+                rule = ReplaceRule(index, stage, str(spec['method']).upper() if spec.get('method') else None, re.compile(spec['url']) if spec.get('url') else None,
+                                   part, spec['name'] if part == 'header' else '', re.compile(spec['match']) if spec.get('match') else None, spec.get('replace'))
+            except re.error as e: raise ValueError(f"Match-and-replace rule {index}: bad regex ({e})") from e
+            if stage == 'request': self.request_rules += 1
+            else: self.response_rules += 1
+            host = str(spec.get('host') or '').lower()
+            if not host: self.any_host.append(rule)
+            elif not any(c in host for c in "*?["): self.exact[host].append(rule)
+            elif host.startswith("*.") and not any(c in host[2:] for c in "*?["): self.suffix[host[1:]].append(rule)
+            else: self.globs.append((re.compile(fnmatch.translate(host)), rule))
+
+    def _rules_for_host(self, host):
+        rules = self.host_cache.get(host)
+        if rules is not None: return rules
+        rules = self.any_host + self.exact.get(host, []) + [rule for pattern, rule in self.globs if pattern.match(host)]
+        dot = host.find('.')
+        while dot >= 0:
+            rules += self.suffix.get(host[dot:], []); dot = host.find('.', dot + 1)
+        rules = tuple(sorted(rules, key=lambda rule: rule.index)) # Declaration order, so later rules see earlier rules' output
+        if len(self.host_cache) >= self.HOST_CACHE_SIZE: self.host_cache.clear()
+        self.host_cache[host] = rules
+        return rules
+
+    def matching(self, stage, url, method):
+        host = urllib.parse.urlsplit(url).hostname or ""
+        return [rule for rule in self._rules_for_host(host) if rule.stage == stage and (rule.method is None or rule.method == method) and (rule.url_re is None or rule.url_re.search(url))]
+
+    @staticmethod
+    def _replace_header(headers, rule):
+        """Applies a header rule to a [(name, value)] list. Without match the header is set (or removed when replace is None);
+        with match, only that text in its existing values is replaced."""
+        lower = rule.name.lower()
+        if rule.match is not None: return [(k, rule.match.sub(rule.replace or '', v) if k.lower() == lower else v) for k, v in headers]
+        changed, found = [], False
+        for k, v in headers:
+            if k.lower() != lower: changed.append((k, v))
+            elif not found:
+                found = True
+                if rule.replace is not None: changed.append((k, rule.replace)) # In place, keeping the page's own spelling
+        if not found and rule.replace is not None: changed.append((rule.name, rule.replace))
+        return changed
+
+    def rewrite_request(self, request):
+        """Returns the request as rewritten by the matching request rules, plus the Fetch.continueRequest overrides that send it that way
+        (empty when nothing changed). Post data Chrome left out of the event (large uploads) is never rewritten."""
+        rules = self.matching('request', request['url'], request['method'])
+        if not rules: return request, {}
+        url = request['url']; headers = list(request.get('headers', {}).items()); post_data = request.get('postData'); changed_parts = set()
+        for rule in rules:
+            if rule.part == 'header': changed = self._replace_header(headers, rule); applied = changed != headers; headers = changed
+            elif rule.part == 'url': changed = rule.match.sub(rule.replace or '', url); applied = changed != url; url = changed
+            elif post_data is None: continue
+            else: changed = rule.match.sub(rule.replace or '', post_data); applied = changed != post_data; post_data = changed
+            if applied: self.hits[rule.index] += 1; changed_parts.add(rule.part)
+        if not changed_parts: return request, {}
+        request = dict(request, url=url, headers=dict(headers), postData=post_data); overrides = {}
+        if 'url' in changed_parts: overrides["url"] = url
+        if 'header' in changed_parts: overrides["headers"] = [{"name": k, "value": v} for k, v in headers]
+        if 'body' in changed_parts: overrides["postData"] = base64.b64encode(post_data.encode("utf-8")).decode()
+        return request, overrides
+
+    def rewrite_response_headers(self, rules, response_headers):
+        """Applies the header rules among rules to a paused response's [{name, value}] headers; returns None when nothing changed."""
+        headers = [(h["name"], h["value"]) for h in response_headers]; original = headers
+        for rule in rules:
+            if rule.part != 'header': continue
+            changed = self._replace_header(headers, rule)
+            if changed != headers: self.hits[rule.index] += 1; headers = changed
+        return [{"name": k, "value": v} for k, v in headers] if headers != original else None
+
+    def rewrite_response_body(self, rules, body):
+        for rule in rules:
+            if rule.part != 'body': continue
+            changed = rule.match.sub(rule.replace or '', body)
+            if changed != body: self.hits[rule.index] += 1; body = changed
+        return body
+
+match_replace = MatchReplaceRules([])
+
+class LRUCache:
+    """A byte-budgeted LRU map. Values must support len()."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes; self.size = 0; self.items = collections.OrderedDict()
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is not None: self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.pop(key)
+        if len(value) > self.max_bytes: return
+        self.items[key] = value; self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.items.popitem(last=False); self.size -= len(evicted)
+
+    def pop(self, key):
+        value = self.items.pop(key, None)
+        if value is not None: self.size -= len(value)
+        return value
+
+body_cache = LRUCache(BODY_CACHE_BYTES)
+
+SpillRef = collections.namedtuple("SpillRef", "segment offset length")
+BodyRef = collections.namedtuple("BodyRef", "digest length")
+
+def body_digest(body): return hashlib.blake2b(body.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+class HistoryStore:
+    """Insertion-ordered request history bounded by a RAM budget in bytes.
+
+    Large header and body fields are appended to on-disk segment files and only a SpillRef stays in RAM.
+    A segment file is deleted once no live entry points into it. Bodies are content-addressed: identical bodies
+    (the same bundle on every reload) are held, or spilled, once and reference-counted, and freed with their last entry.
+    """
+    SPILLABLE_FIELDS = ('headers', 'postData', 'response_headers', 'body')
+
+    def __init__(self, memory_budget, disk_budget, spill_threshold, segment_bytes, read_cache, on_evict=None):
+        self.memory_budget = memory_budget; self.disk_budget = disk_budget
+        self.spill_threshold = spill_threshold; self.segment_bytes = segment_bytes
+        self.read_cache = read_cache; self.on_evict = on_evict
+        self.entries = collections.OrderedDict(); self.entry_sizes = {}
+        self.memory_bytes = 0; self.disk_bytes = 0
+        self.spill_dir = None; self.segments = {}; self.current_segment = -1
+        self.bodies = {}    # digest -> [body or SpillRef, references, bytes held in RAM]
+
+    def __contains__(self, history_id): return history_id in self.entries
+    def __len__(self): return len(self.entries)
+    def __iter__(self): return iter(self.entries)
+
+    @staticmethod
+    def _field_size(value):
+        if value is None: return 8
+        if isinstance(value, (SpillRef, BodyRef)): return 32
+        if isinstance(value, dict): return sum(len(str(k)) + len(str(v)) + 16 for k, v in value.items())
+        return len(value) if isinstance(value, str) else 16
+
+    def _entry_size(self, entry): return 64 + sum(len(k) + self._field_size(v) for k, v in entry.items())
+
+    def _spill(self, value):
+        data = json.dumps(value).encode("utf-8")
+        segment = self.segments.get(self.current_segment)
+        if segment is not None and segment[2] == 0 and segment[1]:
+            # Everything in the current segment was released: write over it instead of rotating away from dead bytes
+            segment[0].truncate(0); self.disk_bytes -= segment[1]; segment[1] = 0
+        if segment is None or segment[1] + len(data) > self.segment_bytes:
+            if self.spill_dir is None: self.spill_dir = tempfile.mkdtemp(prefix="cdp_repeater_history_")
+            if segment is not None and segment[2] == 0: self._drop_segment(self.current_segment)
+            self.current_segment += 1
+            segment = self.segments[self.current_segment] = [open(os.path.join(self.spill_dir, f"segment-{self.current_segment}.bin"), "w+b"), 0, 0]
+        handle, offset, _ = segment
+        handle.seek(offset); handle.write(data)
+        segment[1] += len(data); segment[2] += 1; self.disk_bytes += len(data)
+        return SpillRef(self.current_segment, offset, len(data))
+
+    def _share_body(self, body):
+        digest = body_digest(body); shared = self.bodies.get(digest)
+        if shared: shared[1] += 1
+        elif len(body) > self.spill_threshold: self.bodies[digest] = [self._spill(body), 1, 0]
+        else: self.bodies[digest] = [body, 1, len(body)]; self.memory_bytes += len(body)
+        return BodyRef(digest, len(body))
+
+    def _release(self, value):
+        if isinstance(value, BodyRef):
+            shared = self.bodies.get(value.digest)
+            if shared is None: return
+            shared[1] -= 1
+            if shared[1] > 0: return
+            del self.bodies[value.digest]; self.memory_bytes -= shared[2]; self.read_cache.pop(value.digest)
+            value = shared[0]
+        if not isinstance(value, SpillRef): return
+        segment = self.segments.get(value.segment)
+        if segment is None: return
+        segment[2] -= 1
+        # The current segment is kept for the next write; _spill reclaims or drops it if it is still empty then
+        if segment[2] <= 0 and value.segment != self.current_segment: self._drop_segment(value.segment)
+
+    def _drop_segment(self, index):
+        segment = self.segments.pop(index)
+        segment[0].close(); self.disk_bytes -= segment[1]
+        os.remove(os.path.join(self.spill_dir, f"segment-{index}.bin"))
+
+    def _store_fields(self, history_id, entry, fields):
+        for key, value in fields.items():
+            previous = entry.get(key)
+            if key == 'body' and isinstance(value, str): value = self._share_body(value)
+            elif key in self.SPILLABLE_FIELDS and self._field_size(value) > self.spill_threshold: value = self._spill(value)
+            self._release(previous) # After sharing, so storing the same body again keeps it
+            entry[key] = value
+            if key in self.SPILLABLE_FIELDS: self.read_cache.pop((history_id, key))
+        new_size = self._entry_size(entry)
+        self.memory_bytes += new_size - self.entry_sizes.get(history_id, 0); self.entry_sizes[history_id] = new_size
+
+    def charge(self, size):
+        """Counts RAM held for the history elsewhere (the search index) against the budget; negative to release it."""
+        self.memory_bytes += size
+        if size > 0: self._enforce_budgets()
+
+    def _enforce_budgets(self):
+        while len(self.entries) > 1 and (self.memory_bytes > self.memory_budget or self.disk_bytes > self.disk_budget):
+            oldest_id, _ = next(iter(self.entries.items()))
+            self.remove(oldest_id)
+            if self.on_evict: self.on_evict(oldest_id)
+
+    def add(self, history_id, entry):
+        self.remove(history_id)
+        self.entries[history_id] = {}
+        self._store_fields(history_id, self.entries[history_id], entry)
+        self._enforce_budgets()
+
+    def update(self, history_id, **fields):
+        entry = self.entries.get(history_id)
+        if entry is None: return
+        self._store_fields(history_id, entry, fields)
+        self._enforce_budgets()
+
+    def remove(self, history_id):
+        entry = self.entries.pop(history_id, None)
+        if entry is None: return
+        for key, value in entry.items():
+            self._release(value)
+            if key in self.SPILLABLE_FIELDS: self.read_cache.pop((history_id, key))
+        self.memory_bytes -= self.entry_sizes.pop(history_id, 0)
+
+    def get(self, history_id, field, default=None):
+        """Returns one field of an entry, reading it back from disk if it was spilled."""
+        entry = self.entries.get(history_id)
+        if entry is None or field not in entry: return default
+        value = entry[field]; cache_key = (history_id, field)
+        if isinstance(value, BodyRef): cache_key = value.digest; value = self.bodies[value.digest][0]
+        if not isinstance(value, SpillRef): return value
+        cached = self.read_cache.get(cache_key)
+        if cached is not None: return cached
+        handle = self.segments[value.segment][0]
+        handle.seek(value.offset); value = json.loads(handle.read(value.length).decode("utf-8"))
+        if isinstance(value, str): self.read_cache.put(cache_key, value)
+        return value
+
+    def body_digest(self, history_id):
+        value = self.entries.get(history_id, {}).get('body')
+        return value.digest if isinstance(value, BodyRef) else None
+
+    def body_length(self, history_id):
+        """Length of an entry's body without reading a spilled one back."""
+        value = self.entries.get(history_id, {}).get('body')
+        return value.length if isinstance(value, BodyRef) else None
+
+    def load(self, history_id):
+        entry = self.entries.get(history_id)
+        return None if entry is None else {key: self.get(history_id, key) for key in entry}
+
+    def close(self):
+        for handle, _, _ in self.segments.values(): handle.close()
+        self.segments.clear(); self.bodies.clear()
+        if self.spill_dir: shutil.rmtree(self.spill_dir, ignore_errors=True); self.spill_dir = None
+
+class BlobStore:
+    """Response bodies kept as raw bytes on disk (large or binary ones), served in ranges by the HTTP server.
+
+    Blobs belong to a history entry and go away with it; past disk_budget the oldest blobs are dropped first.
+    """
+    def __init__(self, disk_budget):
+        self.disk_budget = disk_budget; self.directory = None
+        self.blobs = collections.OrderedDict()  # blob_id -> [history_id, size, mime]
+        self.by_history = {}; self.disk_bytes = 0
+
+    def path(self, blob_id): return os.path.join(self.directory, blob_id)
+
+    def create(self, history_id, mime):
+        if self.directory is None: self.directory = tempfile.mkdtemp(prefix="cdp_repeater_blobs_")
+        self.discard(history_id)
+        blob_id = uuid.uuid4().hex
+        self.blobs[blob_id] = [history_id, 0, mime]; self.by_history[history_id] = blob_id
+        return blob_id, open(self.path(blob_id), "wb")
+
+    def finish(self, blob_id, size):
+        if blob_id not in self.blobs: return
+        self.blobs[blob_id][1] = size; self.disk_bytes += size
+        while len(self.blobs) > 1 and self.disk_bytes > self.disk_budget:
+            self._drop(next(iter(self.blobs)))
+
+    def store(self, history_id, data, mime):
+        blob_id, handle = self.create(history_id, mime)
+        with handle: handle.write(data)
+        self.finish(blob_id, len(data))
+        return blob_id
+
+    def info(self, blob_id):
+        blob = self.blobs.get(blob_id)
+        return None if blob is None else {"id": blob_id, "size": blob[1], "mime": blob[2], "url": f"http://127.0.0.1:{HTTP_PORT}/blob/{blob_id}"}
+
+    def read(self, blob_id, start=0, length=-1):
+        with open(self.path(blob_id), "rb") as f:
+            f.seek(start); return f.read(length)
+
+    def discard(self, history_id):
+        blob_id = self.by_history.get(history_id)
+        if blob_id: self._drop(blob_id)
+
+    def _drop(self, blob_id):
+        history_id, size, _ = self.blobs.pop(blob_id)
+        if self.by_history.get(history_id) == blob_id: del self.by_history[history_id]
+        self.disk_bytes -= size
+        try: os.remove(self.path(blob_id))
+        except OSError: pass
+
+    def close(self):
+        if self.directory: shutil.rmtree(self.directory, ignore_errors=True); self.directory = None
+        self.blobs.clear(); self.by_history.clear(); self.disk_bytes = 0
+
+SEARCH_WORD = re.compile(r"\w{2,64}")
+SEARCH_QUERY_TERM = re.compile(r'(?:(host|status|header|re):)?(?:"([^"]*)"?|(\S+))')
+SearchTerm = collections.namedtuple("SearchTerm", "kind text value pattern")
+
+def search_words(text, limit=None, max_words=SEARCH_INDEX_MAX_WORDS):
+    """Distinct words of text[:limit], in first-seen order, at most max_words of them."""
+    return tuple(sys.intern(word) for word in itertools.islice(dict.fromkeys(SEARCH_WORD.findall(text[:limit].lower())), max_words))
+
+@functools.lru_cache(maxsize=4096)
+def header_words(text): return frozenset(search_words(text)) # Request headers repeat almost verbatim across a capture
+
+def url_trigrams(url): return {url[i:i + 3] for i in range(len(url) - 2)}
+
+def parse_search_query(query):
+    """Splits a query into SearchTerms. Raises re.error for a bad re: pattern."""
+    terms = []
+    for match in SEARCH_QUERY_TERM.finditer(query):
+        prefix, quoted, bare = match.groups(); text = quoted if quoted is not None else bare
+        if not text: continue
+        if prefix == 're': terms.append(SearchTerm('re', text, None, re.compile(text, re.IGNORECASE)))
+        elif prefix == 'host': terms.append(SearchTerm('host', text.lower(), None, re.compile(re.escape(text), re.IGNORECASE)))
+        elif prefix == 'status': terms.append(SearchTerm('status', text.lower().replace('x', '?'), None, None))
+        elif prefix == 'header':
+            name, _, value = text.partition('=')
+            terms.append(SearchTerm('header', name.lower(), value.lower(), re.compile(re.escape(value or name), re.IGNORECASE)))
+        else:
+            words = SEARCH_WORD.findall(text.lower())
+            kind = 'word' if quoted is None and len(words) == 1 and words[0] == text.lower() else 'phrase'
+            terms.append(SearchTerm(kind, text.lower(), words, re.compile(re.escape(text), re.IGNORECASE)))
+    return terms
+
+class SearchIndex:
+    """Incremental inverted index over the captured history, so a search never scans every captured byte.
+
+    Each word of an entry's URL, headers and bodies maps to the entries holding it, tagged with the fields it
+    appeared in. URLs also get a trigram index for substring matches, and hosts, status codes and header names
+    are kept as maps for the host:, status: and header: filters. Identical bodies share one word list.
+    Postings are packed ints (doc id << 5 | field bits): one int for a word a single entry holds, else a sorted
+    array. Their estimated size is charged to the history's RAM budget, so eviction bounds the index too.
+    """
+    FIELD_BITS = {'url': 1, 'headers': 2, 'response_headers': 4, 'postData': 8, 'body': 16}
+    DOC_SHIFT = 5; BIT_MASK = 31
+    MAX_OFFSETS = 5     # Match offsets reported per field of a hit
+    WORD_BYTES = 200    # Estimated RAM per distinct indexed word, plus its length (interned string, postings and vocabulary slots)
+    POSTING_BYTES = 8   # ... per further entry holding a word
+    TRIGRAM_BYTES = 40  # ... per URL trigram
+
+    def __init__(self, history):
+        self.history = history
+        self.postings = {}      # word -> packed posting, or sorted array('I') of them
+        self.doc_ids, self.doc_names, self.next_doc = {}, {}, 0   # history_id <-> int doc id
+        self.vocabulary = []    # Words for prefix lookups; sorted lazily, may hold words no longer indexed
+        self.vocabulary_unsorted = False
+        self.memory_bytes = 0   # Estimated, and included in the history's memory_bytes
+        self.sources = {}       # history_id -> {field: words}
+        self.keys = {}          # history_id -> {field: [(map, key)]} entries in the maps below
+        self.urls = {}          # history_id -> lowercased URL, in capture order
+        self.trigrams, self.hosts, self.statuses, self.header_names = {}, {}, {}, {}   # key -> {history_id}
+        self.body_digests = {}  # history_id -> digest of its indexed body
+        self.shared_words = {}  # digest -> [words, references]
+
+    def __len__(self): return len(self.urls)
+
+    def _charge(self, size):
+        self.memory_bytes += size; self.history.charge(size)
+
+    def add(self, history_id, entry):
+        self.remove(history_id)
+        self.urls[history_id] = ""; self.sources[history_id] = {}; self.keys[history_id] = {}
+        self.doc_ids[history_id] = self.next_doc; self.doc_names[self.next_doc] = history_id; self.next_doc += 1
+        self.update(history_id, {field: entry.get(field) for field in self.FIELD_BITS})
+
+    def update(self, history_id, fields):
+        if history_id not in self.sources: return
+        doc, size = self.doc_ids[history_id], 0
+        for field, value in fields.items():
+            if field not in self.FIELD_BITS: continue
+            size -= self._drop_field(history_id, field)
+            if not value: continue
+            if field == 'body': words, words_size = self._body_words(history_id, value)
+            elif field == 'headers': words, words_size = header_words(" ".join(f"{k} {v}" for k, v in value.items())), 0 # Cached and shared
+            else: words = search_words(value, SEARCH_INDEX_BODY_CHARS); words_size = 8 * len(words)
+            self.sources[history_id][field] = words; bit = self.FIELD_BITS[field]; size += words_size
+            for word in words: size += self._post(word, doc, bit)
+            keys = self.keys[history_id][field] = self._field_keys(history_id, field, value)
+            for mapping, key in keys: mapping.setdefault(key, set()).add(history_id)
+            if field == 'url': size += len(value) * self.TRIGRAM_BYTES
+        # Charged last: it may evict this very entry, which removes it from the index
+        self._charge(size)
+
+    def _post(self, word, doc, bit):
+        """Adds doc to word's postings under bit. Returns the estimated bytes added."""
+        posting = self.postings.get(word); packed = doc << self.DOC_SHIFT
+        if posting is None:
+            self.postings[word] = packed | bit; self.vocabulary.append(word); self.vocabulary_unsorted = True
+            return len(word) + self.WORD_BYTES
+        if type(posting) is int:
+            if posting >> self.DOC_SHIFT == doc: self.postings[word] = posting | bit; return 0
+            posting = self.postings[word] = array.array('I', (posting,))
+        if posting[-1] < packed: posting.append(packed | bit); return self.POSTING_BYTES # The usual case: docs are numbered in capture order
+        i = bisect.bisect_left(posting, packed)
+        if i < len(posting) and posting[i] >> self.DOC_SHIFT == doc: posting[i] |= bit; return 0
+        posting.insert(i, packed | bit); return self.POSTING_BYTES
+
+    def _unpost(self, word, doc, bit):
+        """Clears bit from doc in word's postings. Returns the estimated bytes freed."""
+        posting = self.postings.get(word)
+        if posting is None: return 0
+        if type(posting) is int:
+            if posting >> self.DOC_SHIFT != doc: return 0
+            if posting & self.BIT_MASK & ~bit: self.postings[word] = posting & ~bit; return 0
+            del self.postings[word]; return len(word) + self.WORD_BYTES
+        i = bisect.bisect_left(posting, doc << self.DOC_SHIFT)
+        if i == len(posting) or posting[i] >> self.DOC_SHIFT != doc: return 0
+        if posting[i] & self.BIT_MASK & ~bit: posting[i] &= ~bit; return 0
+        del posting[i]
+        if len(posting) == 1: self.postings[word] = posting[0]
+        return self.POSTING_BYTES
+
+    def _body_words(self, history_id, body):
+        """The body's words, shared by entries with the same body, and the bytes to charge for them (only when new)."""
+        digest = self.history.body_digest(history_id); shared = self.shared_words.get(digest); size = 0
+        if shared: shared[1] += 1
+        else:
+            shared = [search_words(body, SEARCH_INDEX_BODY_CHARS), 1]; size = 8 * len(shared[0])
+            if digest: self.shared_words[digest] = shared
+        self.body_digests[history_id] = digest
+        return shared[0], size
+
+    def _field_keys(self, history_id, field, value):
+        if field == 'url':
+            url = self.urls[history_id] = value.lower()
+            for trigram in url_trigrams(url): self.trigrams.setdefault(trigram, set()).add(history_id)
+            host = urllib.parse.urlsplit(url).hostname
+            return [(self.hosts, host)] if host else []
+        if field == 'headers': return [(self.header_names, name.lower()) for name in value]
+        if field == 'response_headers':
+            _, status, _, headers = parse_response_headers(value)
+            return [(self.statuses, str(status))] + [(self.header_names, name.lower()) for name, _ in headers]
+        return []
+
+    def _drop_field(self, history_id, field):
+        """Unindexes one field of an entry. Returns the estimated bytes freed."""
+        size = 0
+        if field == 'url':
+            url = self.urls[history_id]
+            for trigram in url_trigrams(url):
+                ids = self.trigrams[trigram]; ids.discard(history_id)
+                if not ids: del self.trigrams[trigram]
+            self.urls[history_id] = ""; size += len(url) * self.TRIGRAM_BYTES
+        words = self.sources[history_id].pop(field, None)
+        if words:
+            doc, bit = self.doc_ids[history_id], self.FIELD_BITS[field]
+            for word in words: size += self._unpost(word, doc, bit)
+            if field not in ('headers', 'body'): size += 8 * len(words)
+        if field == 'body' and history_id in self.body_digests:
+            digest = self.body_digests.pop(history_id); shared = self.shared_words.get(digest)
+            if shared:
+                shared[1] -= 1
+                if shared[1] <= 0: del self.shared_words[digest]; size += 8 * len(shared[0])
+            elif words: size += 8 * len(words) # Not shared (no digest): charged to this entry alone
+        for mapping, key in self.keys[history_id].pop(field, ()):
+            ids = mapping.get(key)
+            if ids is None: continue
+            ids.discard(history_id)
+            if not ids: del mapping[key]
+        return size
+
+    def remove(self, history_id):
+        if history_id not in self.sources: return
+        size = sum(self._drop_field(history_id, field) for field in self.FIELD_BITS)
+        del self.sources[history_id], self.keys[history_id], self.urls[history_id], self.doc_names[self.doc_ids.pop(history_id)]
+        # Evicted words would stay alive in the vocabulary until the next prefix lookup: rebuild once they are a fifth of it
+        if len(self.vocabulary) > 1.25 * len(self.postings) + 1024: self.vocabulary = list(self.postings); self.vocabulary_unsorted = True
+        self._charge(-size)
+
+    def _prefix_words(self, prefix):
+        if self.vocabulary_unsorted:
+            self.vocabulary.sort(); self.vocabulary_unsorted = False
+        words, vocabulary = [], self.vocabulary
+        i = bisect.bisect_left(vocabulary, prefix)
+        while i < len(vocabulary) and vocabulary[i].startswith(prefix) and len(words) < SEARCH_PREFIX_EXPANSION:
+            word = vocabulary[i]; i += 1
+            if word in self.postings and (not words or words[-1] != word): words.append(word)
+        return words
+
+    def _url_substring(self, text):
+        if len(text) < 3: return set()
+        sets = sorted((self.trigrams.get(text[i:i + 3], set()) for i in range(len(text) - 2)), key=len)
+        return {history_id for history_id in sets[0] if text in self.urls[history_id] and all(history_id in s for s in sets[1:])}
+
+    def _lookup(self, term, scores):
+        """Entries the index says can match a term, adding their rank to scores. None means any entry may match.
+        For a word term, None means it is no indexed word's prefix (e.g. it starts mid-word), so it must be scanned for."""
+        if term.kind in ('word', 'phrase'):
+            matched, total, names = None, len(self.urls) or 1, self.doc_names
+            # A phrase may start mid-word ("beef-12" in "deadbeef-1234"), so only its later words narrow the candidates
+            words = term.value[1:] if term.kind == 'phrase' else term.value
+            for position, word in enumerate(words):
+                last = position == len(words) - 1
+                word_matches = {}
+                indexed_words = self._prefix_words(word) if last else [word] if word in self.postings else []
+                if not indexed_words and term.kind == 'word': return None
+                for indexed in indexed_words:
+                    posting = self.postings[indexed]; posting = (posting,) if type(posting) is int else posting
+                    rank = math.log(1 + total / len(posting)) * (1.0 if indexed == word else 0.5)
+                    for packed in posting:
+                        bits = packed & self.BIT_MASK; history_id = names[packed >> self.DOC_SHIFT]
+                        weight = rank * (3.0 if bits & 1 else 2.0 if bits & 6 else 1.0)
+                        if weight > word_matches.get(history_id, 0): word_matches[history_id] = weight
+                for history_id, weight in word_matches.items(): scores[history_id] += weight
+                matched = set(word_matches) if matched is None else matched & word_matches.keys()
+            in_urls = self._url_substring(term.text)
+            for history_id in in_urls: scores[history_id] += 3.0
+            return None if matched is None else matched | in_urls # No words (e.g. "?id="): every entry gets checked
+        if term.kind == 'host':
+            return set().union(*(ids for host, ids in self.hosts.items() if host == term.text or host.endswith("." + term.text) or fnmatch.fnmatch(host, term.text)))
+        if term.kind == 'status':
+            return set().union(*(ids for status, ids in self.statuses.items() if fnmatch.fnmatch(status, term.text)))
+        if term.kind == 'header':
+            return set().union(*(ids for name, ids in self.header_names.items() if fnmatch.fnmatch(name, term.text)))
+        return None
+
+    def texts(self, history_id):
+        get = lambda field: self.history.get(history_id, field) or ""
+        headers = self.history.get(history_id, 'headers') or {}
+        return {'url': get('url'), 'headers': "\n".join(f"{k}: {v}" for k, v in headers.items()), 'postData': get('postData'), 'response_headers': get('response_headers'), 'body': get('body')}
+
+    @staticmethod
+    def _check(term, texts):
+        if term.kind == 'header':
+            lines = texts['headers'].split("\n") + texts['response_headers'].split("\n")[1:]
+            return any(fnmatch.fnmatch(name.strip().lower(), term.text) and term.value in value.lower() for name, _, value in (line.partition(":") for line in lines))
+        if term.kind == 'phrase': return any(term.text in text.lower() for text in texts.values())
+        return any(term.pattern.search(text) for text in texts.values())
+
+    @classmethod
+    def matches(cls, terms, texts):
+        """Checks every term against an entry's texts directly, for entries that aren't indexed (stored sessions)."""
+        for term in terms:
+            if term.kind == 'host':
+                host = urllib.parse.urlsplit(texts['url']).hostname or ""
+                if not (host == term.text or host.endswith("." + term.text) or fnmatch.fnmatch(host, term.text)): return False
+            elif term.kind == 'status':
+                if not texts['response_headers'] or not fnmatch.fnmatch(str(parse_response_headers(texts['response_headers'])[1]), term.text): return False
+            elif not cls._check(term, texts): return False
+        return True
+
+    def _offsets(self, texts, terms):
+        offsets = []
+        for field, text in texts.items():
+            spans = []
+            for term in terms:
+                if term.pattern is None or (term.kind == 'host' and field != 'url') or (term.kind == 'header' and field not in ('headers', 'response_headers')): continue
+                spans += [match.span() for match in itertools.islice(term.pattern.finditer(text), self.MAX_OFFSETS) if match.end() > match.start()]
+            offsets += [{"field": field, "start": start, "end": end} for start, end in sorted(spans)[:self.MAX_OFFSETS]]
+        return offsets
+
+    async def search(self, query, offset=0, limit=SEARCH_PAGE_SIZE, target_id=None, stored=None):
+        """Returns one page of hits, best first (newest first among equals), with match offsets per field.
+        stored, if given, is awaited with the terms for ids of matching entries outside the index; they are listed last."""
+        terms = parse_search_query(query)
+        scores, candidates, checks = collections.Counter(), None, []
+        for term in terms:
+            matched = self._lookup(term, scores)
+            if matched is not None: candidates = matched if candidates is None else candidates & matched
+            elif term.kind == 'word': checks.append(term) # Not the start of any indexed word: scan for it as a substring
+        checks += [term for term in terms if term.kind in ('phrase', 're') or (term.kind == 'header' and term.value)]
+        ids = list(self.urls) if candidates is None else [history_id for history_id in self.urls if history_id in candidates]
+        hits, checked = [], 0
+        for position, history_id in enumerate(ids):
+            if history_id not in self.urls: continue # Evicted while this search was yielding
+            if target_id and self.history.get(history_id, 'target_id') != target_id: continue
+            if checks:
+                texts = self.texts(history_id); checked += 1
+                if not all(self._check(term, texts) for term in checks): continue
+                if checked % SEARCH_SCAN_BATCH == 0: await asyncio.sleep(0)
+            hits.append((scores[history_id], position, history_id))
+        hits.sort(key=lambda hit: (-hit[0], -hit[1]))
+        if stored and not target_id: hits += [(0, 0, history_id) for history_id in await stored(terms)]
+        page = [{"id": history_id, "score": round(score, 3), "matches": self._offsets(self.texts(history_id), terms)} for score, _, history_id in hits[offset:offset + limit]]
+        highlight = "|".join(f"(?:{term.pattern.pattern})" for term in terms if term.pattern)
+        return {"query": query, "offset": offset, "total": len(hits), "hits": page, "highlight": highlight}
+
+class CookieJar:
+    """Cookies keyed by (domain, path, name), kept current from Network events and synced into the repeat workers' contexts.
+
+    Domains use CDP's convention: a leading dot marks a domain cookie, no dot a host-only one.
+    """
+    def __init__(self, max_age):
+        self.max_age = max_age; self.cookies = {}; self.loaded_at = None; self.version = 0
+
+    def is_fresh(self): return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age
+    def invalidate(self): self.loaded_at = None
+
+    def load(self, cdp_cookies):
+        self.cookies = {}; self.version += 1
+        for cookie in cdp_cookies: self.upsert(cookie)
+        self.loaded_at = time.monotonic()
+
+    def upsert(self, cookie):
+        key = (cookie['domain'], cookie.get('path', '/'), cookie['name']); self.version += 1
+        expires = cookie.get('expires', -1)
+        if expires is not None and 0 <= expires < time.time(): self.cookies.pop(key, None)
+        else: self.cookies[key] = cookie
+
+    def apply_set_cookie(self, header_value, url, blocked_lines=()):
+        """Applies newline-separated Set-Cookie lines received for url. Unparseable input invalidates the jar."""
+        parts = urllib.parse.urlsplit(url) if url else None
+        for line in header_value.split('\n'):
+            if not line.strip() or line in blocked_lines: continue
+            cookie = self.parse_set_cookie(line, parts)
+            if cookie is None: self.invalidate(); return
+            self.upsert(cookie)
+
+    @staticmethod
+    def parse_set_cookie(line, url_parts):
+        attributes = line.split(';'); name, sep, value = attributes[0].partition('=')
+        if not sep: return None
+        cookie = {"name": name.strip(), "value": value.strip(), "domain": None, "path": None, "expires": -1, "secure": False, "httpOnly": False}
+        max_age_seen = False
+        for attribute in attributes[1:]:
+            key, _, val = attribute.strip().partition('='); key = key.lower(); val = val.strip()
+            if key == 'domain' and val: cookie['domain'] = '.' + val.lstrip('.').lower()
+            elif key == 'path' and val.startswith('/'): cookie['path'] = val
+            elif key == 'max-age':
+                try: cookie['expires'] = time.time() + int(val); max_age_seen = True
+                except ValueError: pass
+            elif key == 'expires' and not max_age_seen:
+                try: cookie['expires'] = email.utils.parsedate_to_datetime(val).timestamp()
+                except (TypeError, ValueError): pass
+            elif key == 'secure': cookie['secure'] = True
+            elif key == 'httponly': cookie['httpOnly'] = True
+            elif key == 'samesite': cookie['sameSite'] = val.capitalize()
+        if cookie['domain'] is None:
+            # Host-only cookie: only knowable when we know which URL set it
+            if url_parts is None or not url_parts.hostname: return None
+            cookie['domain'] = url_parts.hostname
+        if cookie['path'] is None:
+            request_path = url_parts.path if url_parts and url_parts.path.startswith('/') else '/'
+            cookie['path'] = request_path[:request_path.rfind('/')] or '/'
+        return cookie
+
+    def cookie_params(self):
+        """The live cookies as Storage.setCookies parameters. Host-only cookies are set by URL, which keeps them host-only."""
+        params, now = [], time.time()
+        for (domain, path, name), cookie in self.cookies.items():
+            expires = cookie.get('expires', -1)
+            if expires is not None and 0 <= expires < now: continue
+            param = {"name": name, "value": cookie['value'], "path": path, "secure": bool(cookie.get('secure')), "httpOnly": bool(cookie.get('httpOnly'))}
+            if domain.startswith('.'): param["domain"] = domain
+            else: param["url"] = f"{'https' if cookie.get('secure') else 'http'}://{domain}{path}"
+            if expires is not None and expires >= 0: param["expires"] = expires
+            if cookie.get('sameSite'): param["sameSite"] = cookie['sameSite']
+            params.append(param)
+        return params
+
+cookie_jar = CookieJar(COOKIE_JAR_MAX_AGE)
+cookie_refresh = None          # The jar reload in flight, if any
+
+class LifecycleTracker:
+    """Correlation maps for in-flight CDP work, by kind: command futures, body fetches and network ids.
+
+    Each kind has one TTL, so its insertion-ordered map is also in deadline order and a sweep only walks expired entries.
+    Outcomes are counted per kind (tracked, completed, replaced, expired, ...) so leaks show up instead of piling up.
+    """
+    def __init__(self, ttls):
+        self.ttls = ttls; self.entries = {kind: collections.OrderedDict() for kind in ttls}
+        self.counters = collections.Counter()
+
+    def track(self, kind, key, value):
+        entries = self.entries[kind]
+        if key in entries: entries.move_to_end(key); self.counters[f"{kind}_replaced"] += 1
+        entries[key] = (value, time.monotonic() + self.ttls[kind]); self.counters[f"{kind}_tracked"] += 1
+
+    def get(self, kind, key):
+        entry = self.entries[kind].get(key)
+        return entry[0] if entry else None
+
+    def pop(self, kind, key, outcome="completed"):
+        entry = self.entries[kind].pop(key, None)
+        if entry is None: return None
+        self.counters[f"{kind}_{outcome}"] += 1; return entry[0]
+
+    def discard_where(self, kind, predicate, outcome="orphaned"):
+        for key in [key for key in self.entries[kind] if predicate(key)]: self.pop(kind, key, outcome)
+
+    def sweep(self):
+        """Removes and returns {kind: [(key, value), ...]} for every entry past its deadline."""
+        now = time.monotonic(); expired = {}
+        for kind, entries in self.entries.items():
+            while entries:
+                key, (value, deadline) = next(iter(entries.items()))
+                if deadline > now: break
+                del entries[key]; self.counters[f"{kind}_expired"] += 1; expired.setdefault(kind, []).append((key, value))
+        return expired
+
+    def stats(self): return {"in_flight": {kind: len(entries) for kind, entries in self.entries.items()}, **self.counters}
+
+# "command" entries are removed by execute_cdp_command on every path; their TTL is only a backstop
+lifecycle = LifecycleTracker({"command": CDP_COMMAND_TIMEOUT + REPEAT_TIMEOUT, "body": CDP_COMMAND_TIMEOUT, "network": NETWORK_ID_TTL})
+
+# --- Metrics ---
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+    """A Prometheus-style histogram: per-bucket counts, rendered cumulatively."""
+    def __init__(self, buckets):
+        self.buckets = buckets; self.counts = [0] * len(buckets); self.sum = 0.0; self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts): self.counts[index] += 1
+        self.sum += value; self.count += 1
+
+    def render(self, name, help_text):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]; cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count; lines.append(f'{name}_bucket{{le="{bound:g}"}} {cumulative}')
+        return lines + [f'{name}_bucket{{le="+Inf"}} {self.count}', f"{name}_sum {self.sum:.6f}", f"{name}_count {self.count}"]
+
+cdp_event_counts = collections.Counter()    # CDP method -> events handled
+metric_counters = collections.Counter()     # cdp_replies, cdp_messages_dropped, ui_frames
+pause_to_continue_seconds = Histogram(LATENCY_BUCKETS)
+repeat_seconds = Histogram(LATENCY_BUCKETS)
+profiling_active = False
+
+def prometheus_lines(name, kind, help_text, samples):
+    """Renders a counter or gauge; samples are (labels, value) pairs. Label values are CDP method names and fixed words, so never need escaping."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+async def render_metrics():
+    """The /metrics page. Runs on the event loop, so every value is read at one consistent moment."""
+    lifecycle_stats = lifecycle.stats(); in_flight = lifecycle_stats.pop("in_flight")
+    outcomes = [({"kind": key.split("_", 1)[0], "outcome": key.split("_", 1)[1]}, count) for key, count in sorted(lifecycle_stats.items())]
+    lines = prometheus_lines("cdp_repeater_queue_depth", "gauge", "Messages waiting in each internal queue.",
+                             [({"queue": "cdp_command"}, cdp_command_queue.qsize()), ({"queue": "ui_message"}, ui_message_queue.qsize()), ({"queue": "large_reply"}, large_reply_queue.qsize())])
+    lines += prometheus_lines("cdp_repeater_cdp_events_total", "counter", "CDP events handled, by method.", [({"method": method}, count) for method, count in sorted(cdp_event_counts.items())])
+    lines += prometheus_lines("cdp_repeater_cdp_replies_total", "counter", "CDP command replies received.", [({}, metric_counters["cdp_replies"])])
+    lines += prometheus_lines("cdp_repeater_cdp_messages_dropped_total", "counter", "CDP messages from unmonitored sessions, dropped before parsing.", [({}, metric_counters["cdp_messages_dropped"])])
+    lines += pause_to_continue_seconds.render("cdp_repeater_pause_to_continue_seconds", "Fetch.requestPaused received to Fetch.continueRequest written.")
+    lines += repeat_seconds.render("cdp_repeater_repeat_seconds", "Round trip of a repeat (or attack batch) through the browser.")
+    lines += prometheus_lines("cdp_repeater_history_entries", "gauge", "Requests in the capture history.", [({}, len(request_history))])
+    lines += prometheus_lines("cdp_repeater_history_bytes", "gauge", "Capture history size.", [({"where": "memory"}, request_history.memory_bytes), ({"where": "disk"}, request_history.disk_bytes)])
+    lines += prometheus_lines("cdp_repeater_blob_bytes", "gauge", "Streamed and binary bodies on disk.", [({}, blob_store.disk_bytes)])
+    lines += prometheus_lines("cdp_repeater_monitored_sessions", "gauge", "Attached targets being captured.", [({}, len(monitored_sessions))])
+    lines += prometheus_lines("cdp_repeater_in_flight_entries", "gauge", "Correlation entries awaiting completion, by kind.", [({"kind": kind}, count) for kind, count in in_flight.items()])
+    lines += prometheus_lines("cdp_repeater_lifecycle_entries_total", "counter", "Correlation entries by kind and outcome.", outcomes)
+    lines += prometheus_lines("cdp_repeater_ui_frames_total", "counter", "Frames sent to the control panel.", [({}, metric_counters["ui_frames"])])
+    lines += prometheus_lines("cdp_repeater_match_replace_hits_total", "counter", "Requests and responses each match-and-replace rule changed, by its index in MATCH_REPLACE_RULES.",
+                              [({"rule": index}, match_replace.hits[index]) for index in range(match_replace.request_rules + match_replace.response_rules)])
+    return "\n".join(lines) + "\n"
+
+async def profile_loop(kind, seconds):
+    """Profiles the event loop for a few seconds: a cProfile report, or the allocation sites that grew (tracemalloc).
+
+    Returns None if another profile is already running.
+    """
+    global profiling_active
+    if profiling_active: return None
+    profiling_active = True
     try:
-        _, _, body = response_data.partition('\n\n')
-        filename = f"response-{uuid.uuid4().hex}.html"
-        with open(filename, "w", encoding="utf-8", errors="replace") as f: f.write(body)
-        print(f"Hosted response body in {filename}")
-        return f"http://127.0.0.1:{HTTP_PORT}/{filename}"
+        if kind == "profile":
+            profiler = cProfile.Profile(); profiler.enable()
+            try: await asyncio.sleep(seconds)
+            finally: profiler.disable()
+            out = io.StringIO(); pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+            return out.getvalue()
+        started = not tracemalloc.is_tracing()
+        if started: tracemalloc.start(16)
+        try:
+            before = tracemalloc.take_snapshot(); await asyncio.sleep(seconds); after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started: tracemalloc.stop()
+        growth = after.compare_to(before, "lineno")[:30]
+        return f"Traced memory: {current} bytes (peak {peak}). Top allocation growth over {seconds:g}s:\n" + "\n".join(str(stat) for stat in growth) + "\n"
+    finally: profiling_active = False
+
+attacks = {}
+attack_responses = LRUCache(ATTACK_RESPONSE_CACHE_BYTES)
+repeats = {}                   # Panel-assigned id -> task, for Sends in flight
+repeat_tabs = {}               # Abort id (a Send's or an attack's) -> {session: fetches} for the pages running its fetches
+repeat_slots = asyncio.Semaphore(REPEAT_MAX_IN_FLIGHT)
+
+def forget_request(history_id):
+    blob_store.discard(history_id); search_index.remove(history_id)
+    publish_ui({"type": "remove", "data": {"id": history_id}})
+
+blob_store = BlobStore(BLOB_DISK_BUDGET)
+request_history = HistoryStore(HISTORY_MEMORY_BUDGET, HISTORY_DISK_BUDGET, HISTORY_SPILL_THRESHOLD, HISTORY_SEGMENT_BYTES, body_cache, on_evict=forget_request)
+search_index = SearchIndex(request_history)
+search_task = None
+
+class SessionStore:
+    """SQLite (WAL) capture session.
+
+    The capture hot path only enqueues writes; a background thread commits them in batches.
+    Reads are indexed, paginated queries run in the default executor.
+    """
+    FIELD_COLUMNS = {'url': 'url', 'method': 'method', 'headers': 'headers', 'postData': 'post_data', 'response_headers': 'response_headers', 'mime_type': 'mime_type', 'error_text': 'error_text', 'body': 'body'}
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, created REAL);
+        CREATE TABLE IF NOT EXISTS entries (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, session_id INTEGER NOT NULL, run_id TEXT NOT NULL, request_id TEXT NOT NULL, created REAL,
+            url TEXT, method TEXT, headers TEXT, post_data TEXT, response_headers TEXT, mime_type TEXT, error_text TEXT, body TEXT,
+            UNIQUE (run_id, request_id));
+        CREATE INDEX IF NOT EXISTS entries_by_session ON entries (session_id, seq);
+    """
+
+    def __init__(self, path, name, batch_size, flush_interval):
+        self.path = path; self.batch_size = batch_size; self.flush_interval = flush_interval
+        self.run_id = uuid.uuid4().hex[:12]; self.writes = queue.Queue()
+        self.read_conn = self._connect(); self.read_lock = threading.Lock()
+        with self.read_conn:
+            self.read_conn.executescript(self.SCHEMA)
+            self.read_conn.execute("INSERT OR IGNORE INTO sessions (name, created) VALUES (?, ?)", (name, time.time()))
+        self.session_id = self.read_conn.execute("SELECT id FROM sessions WHERE name = ?", (name,)).fetchone()[0]
+        self.resumed_count = self.read_conn.execute("SELECT COUNT(*) FROM entries WHERE session_id = ?", (self.session_id,)).fetchone()[0]
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True); self.writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @classmethod
+    def _columns(cls, fields):
+        columns = {}
+        for key, value in fields.items():
+            column = cls.FIELD_COLUMNS.get(key)
+            if column: columns[column] = json.dumps(value) if key == 'headers' else value
+        return columns
+
+    # Hot path: never touches SQLite directly
+    def record(self, request_id, fields): self.writes.put(("record", request_id, fields, time.time()))
+    def update(self, request_id, fields): self.writes.put(("update", request_id, fields, None))
+
+    def _apply(self, conn, op):
+        kind, request_id, fields, created = op
+        columns = self._columns(fields)
+        if kind == "record":
+            names = ["session_id", "run_id", "request_id", "created"] + list(columns)
+            conn.execute(f"INSERT OR REPLACE INTO entries ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", [self.session_id, self.run_id, request_id, created] + list(columns.values()))
+        elif columns:
+            conn.execute(f"UPDATE entries SET {', '.join(f'{c} = ?' for c in columns)} WHERE run_id = ? AND request_id = ?", list(columns.values()) + [self.run_id, request_id])
+
+    def _writer_loop(self):
+        conn = self._connect(); running = True
+        while running:
+            op = self.writes.get()
+            if op is None: break
+            batch = [op]; deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try: op = self.writes.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty: break
+                if op is None: running = False; break
+                batch.append(op)
+            try:
+                with conn:
+                    for op in batch: self._apply(conn, op)
+            except sqlite3.Error as e: print(f"Session store write failed ({len(batch)} entries dropped): {e}")
+        conn.close()
+
+    def _read(self, sql, params):
+        with self.read_lock: return self.read_conn.execute(sql, params).fetchall()
+
+    async def load_page(self, before_seq=None, limit=SESSION_PAGE_SIZE):
+        """Returns one page of summaries of earlier runs' entries older than before_seq (newest first). This run's are in the live history."""
+        sql = "SELECT seq, url, method, response_headers, mime_type, error_text, length(body) FROM entries WHERE session_id = ? AND run_id != ?"
+        params = [self.session_id, self.run_id]
+        if before_seq is not None: sql += " AND seq < ?"; params.append(before_seq)
+        sql += " ORDER BY seq DESC LIMIT ?"; params.append(limit)
+        rows = await asyncio.get_running_loop().run_in_executor(None, self._read, sql, params)
+        entries = [{"seq": seq, "url": url, "method": method, "response_headers": response_headers, "mime_type": mime_type, "error_text": error_text, "body_length": body_length} for seq, url, method, response_headers, mime_type, error_text, body_length in rows]
+        return entries, (entries[-1]["seq"] if len(entries) == limit else None)
+
+    async def load_entry(self, seq):
+        """Returns one stored entry in full, or None."""
+        rows = await asyncio.get_running_loop().run_in_executor(None, self._read, "SELECT url, method, headers, post_data, response_headers, error_text, body FROM entries WHERE seq = ? AND session_id = ?", (seq, self.session_id))
+        if not rows: return None
+        url, method, headers, post_data, response_headers, error_text, body = rows[0]
+        return {"url": url, "method": method, "headers": json.loads(headers or "{}"), "postData": post_data, "response_headers": response_headers, "error_text": error_text, "body": body}
+
+    def _search(self, terms, since_seq):
+        sql = "SELECT seq, url, headers, post_data, response_headers, body FROM entries WHERE session_id = ? AND run_id != ? AND seq >= ?"
+        params = [self.session_id, self.run_id, since_seq]
+        for term in terms:
+            # Narrowed in SQL when the text reads the same in the JSON headers column; SearchIndex.matches decides
+            if term.kind in ('word', 'phrase') and term.text.isascii() and term.text.isprintable() and not any(c in term.text for c in '"\\'):
+                sql += " AND (" + " OR ".join(f"instr(lower({column}), ?) > 0" for column in ('url', 'headers', 'post_data', 'response_headers', 'body')) + ")"
+                params += [term.text] * 5
+        seqs = []
+        with self.read_lock:
+            for seq, url, headers, post_data, response_headers, body in self.read_conn.execute(sql + " ORDER BY seq DESC", params):
+                texts = {'url': url or "", 'headers': "\n".join(f"{k}: {v}" for k, v in json.loads(headers or "{}").items()), 'postData': post_data or "", 'response_headers': response_headers or "", 'body': body or ""}
+                if SearchIndex.matches(terms, texts): seqs.append(seq)
+        return seqs
+
+    async def search(self, terms, since_seq):
+        """Returns the seqs of stored entries from earlier runs, from since_seq on, that match every term (newest first)."""
+        return await asyncio.get_running_loop().run_in_executor(None, self._search, terms, since_seq)
+
+    def close(self):
+        self.writes.put(None); self.writer.join(timeout=10)
+        self.read_conn.close()
+
+def update_request(history_id, **fields):
+    """Updates a captured entry in the history and, when enabled, the persistent session."""
+    if history_id not in request_history: return
+    request_history.update(history_id, **fields); search_index.update(history_id, fields)
+    if session_store: session_store.update(history_id, fields)
+
+TEXT_MIME_HINTS = ("json", "javascript", "xml", "html", "x-www-form-urlencoded")
+
+def is_text_mime(mime_type): return mime_type.startswith("text/") or any(hint in mime_type for hint in TEXT_MIME_HINTS)
+
+def should_prefetch_body(history_id, encoded_length):
+    if not PREFETCH_BODY_MAX_BYTES or encoded_length > PREFETCH_BODY_MAX_BYTES: return False
+    return is_text_mime(request_history.get(history_id, 'mime_type', ''))
+
+def remember_sent_body(digest, size):
+    """Records a body as held by the panel, evicting like its bodiesByHash LRU does. A size of None forgets it."""
+    global ui_sent_body_bytes
+    if digest in ui_sent_bodies: ui_sent_body_bytes -= ui_sent_bodies.pop(digest)
+    if size is None or size > UI_BODY_CACHE_BYTES: return
+    ui_sent_bodies[digest] = size; ui_sent_body_bytes += size
+    while ui_sent_body_bytes > UI_BODY_CACHE_BYTES: ui_sent_body_bytes -= ui_sent_bodies.popitem(last=False)[1]
+
+def publish_ui(message):
+    """Queues a list update under the next sequence number, and keeps it for panels that resume."""
+    global ui_seq
+    ui_seq += 1; message["seq"] = ui_seq; ui_replay.append(message)
+    send_to_ui(message)
+
+def entry_summary(history_id):
+    """The compact row the panel's list holds; everything else is fetched when the row is selected."""
+    get = functools.partial(request_history.get, history_id)
+    summary = {"id": history_id, "method": get('method'), "url": get('url'), "target_id": get('target_id')}
+    if get('response_headers'): summary["status"] = parse_response_headers(get('response_headers'))[1]
+    if get('mime_type'): summary["mime"] = get('mime_type')
+    if get('error_text'): summary["error"] = get('error_text')
+    blob = blob_store.info(blob_store.by_history.get(history_id))
+    size = blob["size"] if blob else request_history.body_length(history_id)
+    if size is not None: summary["size"] = size
+    elif get('body_pending'): summary["pending"] = True
+    return summary
+
+def publish_entry(history_id):
+    """Sends an entry's (new or changed) list row, and its details again if the panel has it open."""
+    if history_id not in request_history: return
+    publish_ui({"type": "entry", "data": entry_summary(history_id)})
+    if history_id == ui_detail_id: send_to_ui(entry_detail(history_id))
+
+def publish_body(history_id, body):
+    """Stores a captured body and tells the UI it arrived."""
+    if history_id not in request_history: return
+    update_request(history_id, body=body, body_pending=False); publish_entry(history_id)
+
+def set_body_note(history_id, note, pending=False):
+    """Records why an entry has no body (yet); its details show the note in place of one."""
+    if history_id not in request_history: return
+    request_history.update(history_id, body_note=note, body_pending=pending); publish_entry(history_id)
+
+def detail_message(history_id, entry, body, digest=None):
+    """Details of one entry. A body past UI_DETAIL_BODY_CHARS is cut there (the panel reads on with get_body_range),
+    and one the panel already holds is sent as just its hash.
+
+    body_length and body_end (how much of it was sent) count code points, like the offsets of get_body_range.
+    The panel echoes them back rather than measuring its string, whose length is in UTF-16 units.
+    """
+    data = {"id": history_id, "method": entry['method'], "url": entry['url'], "headers": entry['headers'] or {}, "postData": entry['postData'],
+            "response_headers": entry['response_headers'] or 'HTTP/1.1 000 Unknown', "timing": entry.get('timing'), "body_length": len(body),
+            "body_end": min(len(body), UI_DETAIL_BODY_CHARS)}
+    if entry.get('blob'): data["blob"] = entry['blob']
+    if entry.get('pending'): data["pending"] = True
+    if len(body) > UI_DETAIL_BODY_CHARS: data["body"] = body[:UI_DETAIL_BODY_CHARS]
+    elif digest and digest in ui_sent_bodies:
+        # e.g. the same bundle on an earlier load
+        ui_sent_bodies.move_to_end(digest); data["hash"] = digest
+    else:
+        data["body"] = body
+        if digest: data["hash"] = digest; remember_sent_body(digest, len(body))
+    return {"type": "detail", "data": data}
+
+def entry_detail(history_id):
+    get = functools.partial(request_history.get, history_id)
+    body = get('body'); pending = body is None and bool(get('body_pending'))
+    if body is None: body = get('body_note') or (f"[Request Failed: {get('error_text')}]" if get('error_text') else "[Waiting for the response body...]")
+    entry = {"method": get('method'), "url": get('url'), "headers": get('headers'), "postData": get('postData'), "response_headers": get('response_headers'),
+             "timing": get('timing'), "blob": blob_store.info(blob_store.by_history.get(history_id)), "pending": pending}
+    return detail_message(history_id, entry, body, request_history.body_digest(history_id))
+
+async def stored_entry(history_id):
+    """A resumed session's entry ("db:<seq>") from the session store, shaped like a history entry, or None."""
+    seq = history_id[3:]
+    entry = await session_store.load_entry(int(seq)) if session_store and seq.isdigit() else None
+    if entry and entry['body'] is None: entry['body'] = f"[Request Failed: {entry['error_text']}]" if entry['error_text'] else "[Response body not available]"
+    return entry
+
+def send_error(command, history_id, message):
+    """Answers a panel request that can't be served, so the panel doesn't wait on it."""
+    send_to_ui({"type": "error", "data": {"command": command, "id": history_id, "message": message}})
+
+async def send_detail(history_id, resend=False):
+    """Answers get_detail. The entry stays open, so a body still on its way is pushed when it arrives."""
+    global ui_detail_id
+    ui_detail_id = history_id
+    if history_id.startswith("db:"):
+        entry = await stored_entry(history_id)
+        if entry: send_to_ui(detail_message(history_id, entry, entry['body']))
+        else: send_error("get_detail", history_id, "Stored entry not found")
+        return
+    if history_id not in request_history: send_error("get_detail", history_id, "Entry no longer in the history"); return
+    # resend: the panel was sent only the hash, and no longer holds that body
+    if resend: remember_sent_body(request_history.body_digest(history_id), None)
+    send_to_ui(entry_detail(history_id))
+    if request_history.get(history_id, 'body_pending'): await request_response_body(history_id)
+
+async def send_body_range(history_id, offset, length):
+    """Sends a slice of a body too large to go out with its details."""
+    if history_id.startswith("db:"): body = ((await stored_entry(history_id)) or {}).get('body')
+    else: body = request_history.get(history_id, 'body')
+    if body is None: send_error("get_body_range", history_id, "Body not available"); return
+    length = min(max(length, 0), UI_DETAIL_BODY_CHARS); offset = max(offset, 0)
+    chunk = body[offset:offset + length]
+    send_to_ui({"type": "body_range", "data": {"id": history_id, "offset": offset, "end": offset + len(chunk), "chunk": chunk, "body_length": len(body)}})
+
+def continue_rewritten_response(session_id, fetch_id, event, rules):
+    """Response stage, body unchanged: continues with the headers rewritten by rules (Fetch.continueResponse), or as it was."""
+    try: headers = match_replace.rewrite_response_headers(rules, event.get("responseHeaders", []))
+    except re.error as e: print(f"Match-and-replace failed on {fetch_id}: {e}"); headers = None # e.g. a group reference the regex lacks
+    if headers is None: send_cdp_command("Fetch.continueRequest", {"requestId": fetch_id}, session_id)
+    else: send_cdp_command("Fetch.continueResponse", {"requestId": fetch_id, "responseCode": event["responseStatusCode"], "responseHeaders": headers}, session_id)
+
+async def fulfill_rewritten_response(session_id, fetch_id, event, rules):
+    """Response stage, with body rules: reads the body and fulfills the page with the rewritten one. Bodies that aren't UTF-8 text are left alone.
+    If anything fails, the response goes on unchanged rather than staying paused."""
+    try:
+        result = await execute_cdp_command("Fetch.getResponseBody", {"requestId": fetch_id}, session_id); text = None
+        if "body" in result:
+            try: text = base64.b64decode(result["body"]).decode("utf-8") if result.get("base64Encoded") else result["body"]
+            except UnicodeDecodeError: pass
+        body = match_replace.rewrite_response_body(rules, text) if text is not None else None
+        if body == text: continue_rewritten_response(session_id, fetch_id, event, rules); return
+        response_headers = match_replace.rewrite_response_headers(rules, event.get("responseHeaders", [])) or event.get("responseHeaders", [])
+        # getResponseBody returns the body decoded, so the encoding and length headers no longer apply
+        fulfill = {"requestId": fetch_id, "responseCode": event["responseStatusCode"], "body": base64.b64encode(body.encode("utf-8")).decode(),
+                   "responseHeaders": [h for h in response_headers if h["name"].lower() not in ("content-encoding", "content-length")]}
+        if event.get("responseStatusText"): fulfill["responsePhrase"] = event["responseStatusText"]
+        send_cdp_command("Fetch.fulfillRequest", fulfill, session_id)
     except Exception as e:
-        print(f"Error hosting response body: {e}"); return None
+        print(f"Rewriting the response of {fetch_id} failed, sending it unchanged: {str(e) or type(e).__name__}")
+        send_cdp_command("Fetch.continueResponse", {"requestId": fetch_id}, session_id)
+
+def should_stream_body(event):
+    """Response-stage check: only bodies declared larger than STREAM_BODY_THRESHOLD, and never ones the page reads incrementally."""
+    status = event.get("responseStatusCode")
+    if not STREAM_BODY_THRESHOLD or status is None or not 200 <= status < 300 or status in (204, 206): return False
+    if event.get("resourceType") in ("Media", "EventSource", "WebSocket"): return False
+    length = next((h["value"] for h in event.get("responseHeaders", []) if h["name"].lower() == "content-length"), None)
+    return length is not None and length.isdigit() and int(length) > STREAM_BODY_THRESHOLD
+
+def body_preview(blob_id, size, mime_type):
+    """What the UI shows inline for a blob-backed body; the rest is behind the download link."""
+    if not is_text_mime(mime_type): return f"[Binary Content ({size} bytes, {mime_type or 'unknown type'}) - use the download link]"
+    preview = blob_store.read(blob_id, 0, BLOB_PREVIEW_BYTES).decode("utf-8", errors="replace")
+    if size > BLOB_PREVIEW_BYTES: preview += f"\n\n[... truncated: showing {BLOB_PREVIEW_BYTES} of {size} bytes - use the download link for the rest]"
+    return preview
+
+def store_binary_body(fetch_id, encoded):
+    if fetch_id not in request_history: return "[Binary Content - request no longer in history]"
+    data = base64.b64decode(encoded); mime_type = request_history.get(fetch_id, 'mime_type', '')
+    return body_preview(blob_store.store(fetch_id, data, mime_type), len(data), mime_type)
+
+async def stream_body_to_blob(session_id, fetch_id, event, rules=()):
+    """Streams a paused response's body to the blob store in IO.read chunks, then fulfills the page with it.
+
+    The body never passes through the history or a UI frame; they get a preview and a download link. The page does,
+    in one piece: it waits for the whole download, and fulfillRequest briefly holds the body base64-encoded in RAM.
+    Header rules among the match-and-replace rules are applied to the fulfilled response; body rules are not.
+    """
+    loop = asyncio.get_running_loop()
+    response_headers = event.get("responseHeaders", [])
+    mime_type = next((h["value"] for h in response_headers if h["name"].lower() == "content-type"), "").split(";")[0].strip()
+    stream = {}
+    try:
+        stream = await execute_cdp_command("Fetch.takeResponseBodyAsStream", {"requestId": fetch_id}, session_id)
+        if not stream.get("stream"):
+            send_cdp_command("Fetch.continueRequest", {"requestId": fetch_id}, session_id); return
+        blob_id, handle = blob_store.create(fetch_id, mime_type); size = 0
+        with handle:
+            while True:
+                chunk = await execute_cdp_command("IO.read", {"handle": stream["stream"], "size": STREAM_CHUNK_BYTES}, session_id)
+                if "data" not in chunk: raise RuntimeError("IO.read returned no data")
+                data = base64.b64decode(chunk["data"]) if chunk.get("base64Encoded") else chunk["data"].encode("utf-8")
+                await loop.run_in_executor(None, handle.write, data); size += len(data)
+                if chunk.get("eof"): break
+        send_cdp_command("IO.close", {"handle": stream["stream"]}, session_id)
+        blob_store.finish(blob_id, size)
+
+        # The page still needs its body, and fulfillRequest takes it in one piece. The stream is already decoded.
+        body = await loop.run_in_executor(None, lambda: base64.b64encode(blob_store.read(blob_id)).decode())
+        if rules: response_headers = match_replace.rewrite_response_headers(rules, response_headers) or response_headers
+        fulfill = {"requestId": fetch_id, "responseCode": event["responseStatusCode"], "body": body,
+                   "responseHeaders": [h for h in response_headers if h["name"].lower() not in ("content-encoding", "content-length")]}
+        if event.get("responseStatusText"): fulfill["responsePhrase"] = event["responseStatusText"]
+        send_cdp_command("Fetch.fulfillRequest", fulfill, session_id); del body, fulfill
+    except Exception as e:
+        # Never leave the request paused: before the stream is taken it can still be continued, after that only failed
+        reason = str(e) or type(e).__name__; print(f"Streaming the body of {fetch_id} failed: {reason}")
+        blob_store.discard(fetch_id)
+        if not stream.get("stream"): send_cdp_command("Fetch.continueRequest", {"requestId": fetch_id}, session_id); return
+        send_cdp_command("IO.close", {"handle": stream["stream"]}, session_id)
+        send_cdp_command("Fetch.failRequest", {"requestId": fetch_id, "errorReason": "Failed"}, session_id)
+        set_body_note(fetch_id, f"[Body Unavailable - streaming it failed: {reason}]")
+        return
+
+    preview = body_preview(blob_id, size, mime_type)
+    publish_body(fetch_id, preview)
+
+async def send_session_page(before_seq=None):
+    global session_page_floor
+    entries, next_before = await session_store.load_page(before_seq)
+    if entries: session_page_floor = entries[-1]['seq'] if before_seq is None else min(session_page_floor or entries[-1]['seq'], entries[-1]['seq'])
+    page = []
+    for entry in entries:
+        summary = {"id": f"db:{entry['seq']}", "seq": entry['seq'], "url": entry['url'], "method": entry['method']}
+        if entry['response_headers']: summary["status"] = parse_response_headers(entry['response_headers'])[1]
+        if entry['mime_type']: summary["mime"] = entry['mime_type']
+        if entry['error_text']: summary["error"] = entry['error_text']
+        if entry['body_length'] is not None: summary["size"] = entry['body_length']
+        page.append(summary)
+    send_to_ui({"type": "session_page", "data": {"entries": page, "before": next_before}})
+
+async def request_response_body(fetch_id):
+    """Pulls a lazily-loaded body from Chrome into the history; publish_body tells the UI when it lands."""
+    if fetch_id not in request_history or request_history.get(fetch_id, 'body') is not None: return
+    network_id = request_history.get(fetch_id, 'network_id')
+    if not network_id: return
+    # Network requestIds belong to the session that saw the request
+    queue_body_fetch(request_history.get(fetch_id, 'session_id') or MONITORED_SESSION_ID, network_id, fetch_id)
+
+def format_response_headers(response):
+    status_line = f"HTTP/{response.get('protocol', '1.1')} {response['status']} {response['statusText']}"
+    headers = "\n".join([f"{k}: {v}" for k, v in response["headers"].items()])
+    return f"{status_line}\n{headers}"
+
+def record_request(history_id, request, network_id=None, session=None):
+    """Stores a captured request in the history and queues it for the UI."""
+    request_data = { "id": history_id, "url": request["url"], "method": request["method"], "headers": request["headers"], "postData": request.get("postData"), "network_id": network_id }
+    if session: request_data["session_id"] = session.session_id; request_data["target_id"] = session.target_id
+    request_data["started"] = time.time()
+    request_history.add(history_id, request_data)
+    if history_id in request_history: search_index.add(history_id, request_data)
+    if session_store: session_store.record(history_id, request_data)
+
+    # DECOUPLED: Put in queue
+    publish_entry(history_id)
+
+# --- HAR Import/Export ---
+HAR_TIMING_PHASES = ("dns", "connect", "ssl", "send", "wait", "receive")
+
+def har_headers(headers): return [{"name": k, "value": v} for k, v in headers.items()]
+
+def parse_response_headers(response_headers):
+    """Splits a stored 'HTTP/x status text' header block back into (http_version, status, status_text, [(name, value)])."""
+    lines = (response_headers or "HTTP/1.1 000 Unknown").split("\n")
+    version, _, rest = lines[0].partition(" "); status, _, status_text = rest.partition(" ")
+    headers = [tuple(part.strip() for part in line.split(":", 1)) for line in lines[1:] if ":" in line]
+    return version, int(status) if status.isdigit() else 0, status_text, headers
+
+def iter_blob_base64(blob_id, chunk_bytes=3 * 256 * 1024):
+    # Multiples of 3 bytes encode without padding, so the pieces concatenate into one valid base64 string
+    with open(blob_store.path(blob_id), "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""): yield base64.b64encode(chunk).decode()
+
+def iter_har(history_ids, stats=None):
+    """Yields a HAR 1.2 document as text pieces, one history entry at a time. Blob bodies are streamed in base64 pieces."""
+    yield '{"log": {"version": "1.2", "creator": {"name": "CDP Repeater", "version": "6.3"}, "pages": [], "entries": ['
+    first = True
+    for history_id in history_ids:
+        entry = request_history.load(history_id)
+        if entry is None: continue # Evicted while exporting
+        version, status, status_text, response_headers = parse_response_headers(entry.get('response_headers'))
+        timing = entry.get('timing') or {}; phases = {p["name"]: p["end"] - p["start"] for p in timing.get('phases', [])}
+        url_parts = urllib.parse.urlsplit(entry['url'])
+        request = {"method": entry['method'], "url": entry['url'], "httpVersion": "HTTP/1.1", "cookies": [], "headers": har_headers(entry.get('headers', {})),
+                   "queryString": [{"name": k, "value": v} for k, v in urllib.parse.parse_qsl(url_parts.query, keep_blank_values=True)], "headersSize": -1, "bodySize": len(entry.get('postData') or "")}
+        if entry.get('postData') is not None:
+            request["postData"] = {"mimeType": next((v for k, v in entry.get('headers', {}).items() if k.lower() == "content-type"), ""), "text": entry['postData']}
+        blob_id = blob_store.by_history.get(history_id); blob = blob_store.info(blob_id)
+        content = {"size": blob["size"] if blob else len(entry.get('body') or ""), "mimeType": entry.get('mime_type', "")}
+        if not blob and entry.get('body') is not None: content["text"] = entry['body']
+        response = {"status": status, "statusText": status_text, "httpVersion": version, "cookies": [], "headers": [{"name": k, "value": v} for k, v in response_headers],
+                    "content": content, "redirectURL": next((v for k, v in response_headers if k.lower() == "location"), ""), "headersSize": -1, "bodySize": -1}
+        har_entry = {"startedDateTime": datetime.datetime.fromtimestamp(entry.get('started', time.time()), datetime.timezone.utc).isoformat(),
+                     "time": timing.get('total_ms', -1), "request": request, "response": response, "cache": {},
+                     "timings": {"blocked": -1, **{name: round(phases.get(name, -1), 3) for name in HAR_TIMING_PHASES}}}
+        if entry.get('error_text'): har_entry["_error"] = entry['error_text']
+        text = json.dumps(har_entry)
+        if blob:
+            # Splice the blob into content.text without holding it in memory
+            head, _, tail = text.partition('"content": {'); yield ("" if first else ",") + head + '"content": {"encoding": "base64", "text": "'
+            yield from iter_blob_base64(blob_id)
+            yield '", ' + tail
+        else: yield ("" if first else ",") + text
+        first = False
+        if stats is not None: stats["entries"] += 1
+    yield ']}}'
+
+def iter_har_entries(path, chunk_chars=1024 * 1024):
+    """Yields log.entries items from a HAR file one at a time, reading it incrementally."""
+    decoder = json.JSONDecoder(); entries_start = re.compile(r'"entries"\s*:\s*\[')
+    with open(path, encoding="utf-8-sig") as f:
+        buffer = ""
+        while True:
+            match = entries_start.search(buffer)
+            if match: buffer = buffer[match.end():]; break
+            chunk = f.read(chunk_chars)
+            if not chunk: raise ValueError("Not a HAR file: no log.entries array found")
+            buffer = buffer[-64:] + chunk
+        read_size = chunk_chars
+        while True:
+            buffer = buffer.lstrip(" \t\r\n,")
+            if buffer.startswith("]"): return
+            try:
+                entry, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # Incomplete entry: read more, doubling the read so one huge entry isn't re-parsed once per chunk
+                chunk = f.read(read_size)
+                if not chunk: raise ValueError("Truncated HAR file")
+                buffer += chunk; read_size *= 2
+                continue
+            read_size = chunk_chars; buffer = buffer[end:]
+            yield entry
+
+def import_har_entry(har_entry):
+    """Adds one HAR entry to the history as if it had been captured."""
+    request, response = har_entry.get("request", {}), har_entry.get("response", {})
+    if not request.get("url") or not request.get("method"): return None
+    history_id = f"har-{uuid.uuid4().hex[:12]}"
+    # HTTP/2 pseudo-headers can't be replayed through fetch()
+    headers = {h["name"]: h["value"] for h in request.get("headers", []) if not h["name"].startswith(":")}
+    record_request(history_id, {"url": request["url"], "method": request["method"], "headers": headers, "postData": (request.get("postData") or {}).get("text")})
+    try: update_request(history_id, started=datetime.datetime.fromisoformat(har_entry["startedDateTime"].replace("Z", "+00:00")).timestamp())
+    except (KeyError, ValueError): pass
+    status_line = f"{response.get('httpVersion') or 'HTTP/1.1'} {response.get('status', 0)} {response.get('statusText', '')}"
+    response_headers = "\n".join([status_line] + [f"{h['name']}: {h['value']}" for h in response.get("headers", []) if not h["name"].startswith(":")])
+    content = response.get("content", {}); mime_type = content.get("mimeType", "")
+    update_request(history_id, response_headers=response_headers, mime_type=mime_type)
+    if content.get("encoding") == "base64" and "text" in content: body = store_binary_body(history_id, content["text"])
+    else: body = content.get("text", "[No body in HAR]")
+    publish_body(history_id, body)
+    return history_id
+
+async def export_har(path):
+    """Writes the history to path as HAR, a piece at a time, letting capture run between entries."""
+    stats = {"entries": 0}
+    with open(path, "w", encoding="utf-8") as f:
+        for pieces, piece in enumerate(iter_har(list(request_history), stats), 1):
+            f.write(piece)
+            if pieces % 200 == 0: await asyncio.sleep(0)
+    return stats["entries"]
+
+async def run_har_export():
+    filename = f"capture-{time.strftime('%Y%m%d-%H%M%S')}.har"
+    try: count = await export_har(filename)
+    except OSError as e: send_to_ui({"type": "har_status", "data": {"message": f"Export failed: {e}"}}); return
+    print(f"Exported {count} entries to {filename}"); exported_files[filename] = os.path.abspath(filename)
+    send_to_ui({"type": "har_status", "data": {"message": f"Exported {count} entries to {os.path.abspath(filename)}", "url": f"{UI_ORIGIN}/export/{filename}"}})
+
+async def receive_har_chunk(command):
+    """Appends one base64 piece of a HAR the panel is uploading to a temporary file, and imports it after the last piece."""
+    upload_id = str(command.get('upload_id')); upload = har_uploads.get(upload_id)
+    try:
+        if upload is None:
+            fd, path = tempfile.mkstemp(prefix="cdp_repeater_import_", suffix=".har")
+            upload = har_uploads[upload_id] = (os.fdopen(fd, "wb"), path)
+        data = base64.b64decode(command.get('data') or "", validate=True)
+        await asyncio.get_running_loop().run_in_executor(None, upload[0].write, data)
+    except (OSError, ValueError) as e:
+        discard_har_upload(upload_id)
+        send_to_ui({"type": "har_status", "data": {"message": f"Import failed: {e}"}}); return
+    if command.get('done'):
+        har_uploads.pop(upload_id)[0].close()
+        asyncio.create_task(run_har_import(upload[1], str(command.get('name') or "the uploaded file"), remove=True))
+
+def discard_har_upload(upload_id):
+    upload = har_uploads.pop(upload_id, None)
+    if upload:
+        upload[0].close()
+        with contextlib.suppress(OSError): os.remove(upload[1])
+
+async def run_har_import(path, name=None, remove=False):
+    """Imports a HAR file and reports to the panel; remove deletes the file afterwards (an upload's temporary copy)."""
+    name = name or path
+    try: count = await import_har(path)
+    except (OSError, ValueError) as e: send_to_ui({"type": "har_status", "data": {"message": f"Import failed: {e}"}}); return
+    except Exception as e:
+        # An entry of an unexpected shape (not an object, headers that aren't a list of name/value pairs, ...)
+        send_to_ui({"type": "har_status", "data": {"message": f"Import failed: malformed HAR entry ({type(e).__name__}: {e})"}}); return
+    finally:
+        if remove:
+            with contextlib.suppress(OSError): os.remove(path)
+    print(f"Imported {count} entries from {name}")
+    send_to_ui({"type": "har_status", "data": {"message": f"Imported {count} entries from {name}"}})
+
+async def import_har(path, batch_size=200):
+    """Parses path in the default executor, a batch of entries at a time, and adds them to the history on the loop."""
+    loop = asyncio.get_running_loop(); entries = iter_har_entries(path); count = 0
+    while True:
+        batch = await loop.run_in_executor(None, lambda: list(itertools.islice(entries, batch_size)))
+        if not batch: return count
+        for har_entry in batch:
+            if import_har_entry(har_entry): count += 1
 
-async def wait_for_http_server(port, timeout=5):
-    start_time = time.monotonic()
-    while time.monotonic() - start_time < timeout:
-        try:
-            with urllib.request.urlopen(f"http://127.0.0.1:{port}", timeout=1) as response:
-                if response.status == 200: print("UI server is up and running."); return True
-        except (urllib.error.URLError, ConnectionRefusedError): await asyncio.sleep(0.1)
-    print("Error: UI server did not start within the timeout period."); return False
-
-def create_ui_files():
-    print("Creating UI files...")
-    with open("index.html", "w", encoding="utf-8") as f: f.write(HTML_CONTENT)
-    with open("style.css", "w", encoding="utf-8") as f: f.write(CSS_CONTENT)
-    with open("script.js", "w", encoding="utf-8") as f: f.write(JS_CONTENT)
-    with open("help.html", "w", encoding="utf-8") as f: f.write(HELP_HTML_CONTENT)
-
-def launch_chrome(port, user_data_dir):
+def find_chrome():
     system = platform.system()
     chrome_path = ""
     if system == 'Windows':
@@ -446,8 +2475,19 @@ def launch_chrome(port, user_data_dir):
     elif system == 'Darwin': chrome_path = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
     elif system == 'Linux': chrome_path = "google-chrome"
     if not chrome_path or (system != 'Linux' and not os.path.exists(chrome_path)):
-         print("Error: Chrome executable not found."); return False
-
+         print("Error: Chrome executable not found."); return None
+    return chrome_path
+
+async def launch_chrome(port, user_data_dir, headless=False, keep_open=False, timeout=20):
+    """Starts Chrome and returns (process, browser ws URL) as soon as it reports its DevTools endpoint, or (None, None).
+
+    The endpoint comes from Chrome's "DevTools listening on" stderr line. DevToolsActivePort covers a Chrome whose stderr
+    isn't attached (Windows), and one that handed off to an instance already running on this profile.
+    With keep_open, Chrome gets its own session so Ctrl+C leaves it running for the next --attach.
+    """
+    global chrome_output_task
+    chrome_path = find_chrome()
+    if not chrome_path: return None, None
     command = [
         chrome_path,
         f"--remote-debugging-port={port}",
@@ -457,227 +2497,1185 @@ def launch_chrome(port, user_data_dir):
         "--disable-sync",
         "--disable-breakpad",
         "--disable-background-networking",
-        f"http://127.0.0.1:{HTTP_PORT}/help.html"
     ]
+    command += ["--headless=new", "about:blank"] if headless else [f"{UI_ORIGIN}/help.html"]
 
     print(f"Launching Chrome with command: {' '.join(command)}")
-    try: subprocess.Popen(command)
-    except FileNotFoundError: print("Error: Chrome executable not found in system PATH (for Linux)."); return False
-    return True
-
-def get_websocket_url(port):
-    url = f"http://127.0.0.1:{port}/json/version"
-    print(f"Attempting to connect to Chrome's browser endpoint at {url}...")
+    launched_at = time.time(); listening = asyncio.get_running_loop().create_future()
+    try: process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE, start_new_session=keep_open and os.name == "posix")
+    except FileNotFoundError: print("Error: Chrome executable not found in system PATH (for Linux)."); return None, None
+
+    async def watch_output():
+        # Keeps draining after the endpoint line too, or Chrome would block on a full pipe
+        async for line in process.stderr:
+            text = line.decode("utf-8", "replace").strip()
+            if text.startswith("DevTools listening on ") and not listening.done(): listening.set_result(text[len("DevTools listening on "):])
+    chrome_output_task = asyncio.create_task(watch_output())
+
+    active_port_file = os.path.join(user_data_dir, "DevToolsActivePort"); deadline = time.monotonic() + timeout
+    while not listening.done() and time.monotonic() < deadline:
+        with contextlib.suppress(OSError):
+            # A file older than this launch is only trusted once our process has exited (i.e. it handed off)
+            if process.returncode is not None or os.path.getmtime(active_port_file) >= launched_at:
+                url = read_devtools_active_port(user_data_dir)
+                if url: listening.set_result(url); break
+        await asyncio.wait({listening}, timeout=0.05)
+    if not listening.done(): print("Chrome did not report a DevTools endpoint in time."); process.terminate(); return None, None
+    return process, listening.result()
+
+def read_devtools_active_port(user_data_dir):
+    """Chrome writes its debugging port and browser path to DevToolsActivePort once it is listening."""
     try:
-        with urllib.request.urlopen(url) as response: return json.load(response)["webSocketDebuggerUrl"]
-    except Exception: return None
+        with open(os.path.join(user_data_dir, "DevToolsActivePort"), encoding="utf-8") as f: port, path = f.read().split()[:2]
+        return f"ws://127.0.0.1:{int(port)}{path}"
+    except (OSError, ValueError): return None
 
-def run_http_server(port):
-    server_address = ("127.0.0.1", port); handler = http.server.SimpleHTTPRequestHandler
-    with socketserver.TCPServer(server_address, handler) as httpd:
-        print(f"UI server running at http://{server_address[0]}:{server_address[1]}"); httpd.serve_forever()
+async def get_websocket_url(port):
+    """Asks a Chrome on port for its browser endpoint, off the loop. None if nothing answers."""
+    def fetch():
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/json/version", timeout=2) as response: return json.load(response)["webSocketDebuggerUrl"]
+        except Exception: return None
+    return await asyncio.get_running_loop().run_in_executor(None, fetch)
+
+async def find_running_chrome(endpoint, user_data_dir):
+    """Locates a Chrome to attach to: an explicit ws:// URL or port, else this profile's DevToolsActivePort, else CHROME_DEBUG_PORT."""
+    if endpoint and endpoint.startswith("ws"): return endpoint
+    if endpoint: return await get_websocket_url(int(endpoint) if endpoint.isdigit() else urllib.parse.urlsplit(endpoint).port)
+    url = read_devtools_active_port(user_data_dir)
+    if url:
+        # The file outlives a crashed or closed Chrome; only trust it if the port still accepts connections
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", urllib.parse.urlsplit(url).port), 1); writer.close()
+            return url
+        except (OSError, asyncio.TimeoutError): pass
+    return await get_websocket_url(CHROME_DEBUG_PORT)
+
+# --- UI HTTP Server ---
+# Runs on the event loop. Assets are served from memory and rendered responses from an LRU,
+# so nothing is written to (or served from) the working directory.
+UI_ASSETS = {path: (content.encode("utf-8"), content_type) for path, content, content_type in [
+    ("/", HTML_CONTENT, "text/html; charset=utf-8"), ("/index.html", HTML_CONTENT, "text/html; charset=utf-8"),
+    ("/style.css", CSS_CONTENT, "text/css; charset=utf-8"), ("/script.js", JS_CONTENT, "text/javascript; charset=utf-8"),
+    ("/help.html", HELP_HTML_CONTENT, "text/html; charset=utf-8")]}
+HTTP_REASONS = {200: "OK", 206: "Partial Content", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 416: "Range Not Satisfiable"}
+rendered_responses = LRUCache(RENDER_CACHE_BYTES)   # render_id -> b"<content type>\n<body>"
+exported_files = {}                                 # HAR export file name -> path on disk
+har_uploads = {}                                    # Panel upload id -> (open temporary file, path) while a HAR arrives in pieces
+
+def host_response_body(response_data):
+    """Keeps a repeated response's body in memory for a render tab and returns its URL."""
+    head, _, body = response_data.partition('\n\n')
+    content_type = next((line.split(":", 1)[1].strip() for line in head.split("\n")[1:] if line.lower().startswith("content-type:")), "") or "text/html; charset=utf-8"
+    render_id = uuid.uuid4().hex
+    rendered_responses.put(render_id, content_type.encode("latin-1", "replace") + b"\n" + body.encode("utf-8", "replace"))
+    return f"{UI_ORIGIN}/render/{render_id}"
+
+def parse_range(value, size):
+    """Returns (start, end, status) for a single-range Range header; status 416 when it can't be satisfied."""
+    match = re.match(r"bytes=(\d*)-(\d*)$", value or "")
+    if not match or not (match.group(1) or match.group(2)): return 0, size - 1, 200
+    if match.group(1): start = int(match.group(1)); end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else: start = max(0, size - int(match.group(2))); end = size - 1
+    return (start, end, 206) if start <= end else (0, 0, 416)
+
+async def send_http_response(writer, status, body=b"", headers=None, head_only=False):
+    lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'OK')}", f"Content-Length: {len(body)}", "Cache-Control: no-store"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    if not head_only: writer.write(body)
+    await writer.drain()
+
+async def send_text(writer, status, text, content_type="text/plain; charset=utf-8", head_only=False):
+    await send_http_response(writer, status, text.encode("utf-8"), {"Content-Type": content_type}, head_only)
+
+async def send_file_range(writer, path, size, content_type, range_header, extra_headers, head_only):
+    """Streams a file (or one range of it) in STREAM_CHUNK_BYTES reads off the loop."""
+    start, end, status = parse_range(range_header, size)
+    if status == 416:
+        await send_http_response(writer, 416, headers={"Content-Range": f"bytes */{size}"}); return
+    headers = {"Content-Type": content_type, "Accept-Ranges": "bytes", **extra_headers}
+    if status == 206: headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    length = max(0, end - start + 1)
+    lines = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}", f"Content-Length: {length}", "Cache-Control: no-store"] + [f"{k}: {v}" for k, v in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    if head_only: await writer.drain(); return
+    loop = asyncio.get_running_loop()
+    with open(path, "rb") as f:
+        f.seek(start); remaining = length
+        while remaining > 0:
+            chunk = await loop.run_in_executor(None, f.read, min(remaining, STREAM_CHUNK_BYTES))
+            if not chunk: break
+            writer.write(chunk); remaining -= len(chunk); await writer.drain()
+
+async def handle_http_request(writer, method, target, headers):
+    """Routes one request: UI assets, /render/<id>, /blob/<id>, /export/<file>, /metrics and the opt-in profilers."""
+    url = urllib.parse.urlsplit(target); path = url.path; head_only = method == "HEAD"
+    if method not in ("GET", "HEAD"): await send_text(writer, 405, "Only GET and HEAD are supported.\n"); return
+    if path in UI_ASSETS:
+        body, content_type = UI_ASSETS[path]
+        await send_http_response(writer, 200, body, {"Content-Type": content_type}, head_only)
+    elif path.startswith("/render/"):
+        stored = rendered_responses.get(path[8:])
+        if stored is None: await send_text(writer, 404, "Rendered response expired; render it again.\n", head_only=head_only); return
+        content_type, _, body = stored.partition(b"\n")
+        # Rendered pages keep their scripts, but in an opaque origin rather than the control panel's
+        await send_http_response(writer, 200, body, {"Content-Type": content_type.decode("latin-1"), "Content-Security-Policy": "sandbox allow-scripts allow-forms allow-popups allow-modals"}, head_only)
+    elif path.startswith("/blob/"):
+        blob = blob_store.info(path[6:])
+        if blob is None or not os.path.exists(blob_store.path(blob["id"])): await send_text(writer, 404, "Body not stored (evicted or never captured)\n", head_only=head_only); return
+        # Captured content must not run scripts on the control panel's origin
+        await send_file_range(writer, blob_store.path(blob["id"]), blob["size"], blob["mime"] or "application/octet-stream", headers.get("range"),
+                              {"X-Content-Type-Options": "nosniff", "Content-Security-Policy": "sandbox"}, head_only)
+    elif path.startswith("/export/") and path[8:] in exported_files and os.path.exists(exported_files[path[8:]]):
+        file_path = exported_files[path[8:]]
+        await send_file_range(writer, file_path, os.path.getsize(file_path), "application/json", headers.get("range"),
+                              {"Content-Disposition": f'attachment; filename="{path[8:]}"'}, head_only)
+    elif path == "/metrics":
+        await send_text(writer, 200, await render_metrics(), "text/plain; version=0.0.4; charset=utf-8", head_only)
+    elif path in ("/debug/profile", "/debug/tracemalloc"):
+        if not PROFILING_ENDPOINTS: await send_text(writer, 404, "Profiling endpoints are disabled; set PROFILING_ENDPOINTS = True to enable them.\n"); return
+        try: seconds = min(max(float(urllib.parse.parse_qs(url.query).get("seconds", ["5"])[0]), 0.1), PROFILE_MAX_SECONDS)
+        except ValueError: await send_text(writer, 400, "seconds must be a number\n"); return
+        report = await profile_loop(path[7:], seconds)
+        if report is None: await send_text(writer, 409, "A profile is already running.\n")
+        else: await send_text(writer, 200, report)
+    else: await send_text(writer, 404, "Not found\n", head_only=head_only)
+
+async def handle_http_connection(reader, writer):
+    """A minimal HTTP/1.1 server loop: keep-alive, no request bodies."""
+    try:
+        while True:
+            try: head = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.LimitOverrunError: await send_text(writer, 413, "Request head too large\n"); return
+            lines = head.decode("latin-1").split("\r\n")
+            parts = lines[0].split(" ")
+            if len(parts) != 3: await send_text(writer, 400, "Malformed request line\n"); return
+            method, target, version = parts
+            headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in lines[1:] if line)}
+            if headers.get("content-length", "0") != "0" or "transfer-encoding" in headers: await send_text(writer, 400, "Request bodies are not accepted\n"); return
+            await handle_http_request(writer, method, target, headers)
+            if version == "HTTP/1.0" or headers.get("connection", "").lower() == "close": return
+    except (asyncio.IncompleteReadError, ConnectionError): pass
+    finally:
+        writer.close()
+        with contextlib.suppress(Exception): await writer.wait_closed()
 
 # --- Async UI Sender Loop (The Fix for Backpressure) ---
+UI_LIST_UPDATES = ("entry", "remove", "target_list")    # What a resync rebuilds, so the only messages a slow panel may lose
+
+def send_to_ui(message):
+    """Queues a message for the UI, applying the slow-consumer policy.
+
+    At UI_QUEUE_LIMIT, list updates are dropped and the UI is resynced from the history once the queue drains.
+    Everything else answers something the panel asked for (details, body ranges, searches, attacks), so it always goes out.
+    """
+    global ui_resync_needed
+    if message["type"] in UI_LIST_UPDATES:
+        if ui_resync_needed: return
+        if ui_message_queue.qsize() >= UI_QUEUE_LIMIT:
+            ui_resync_needed = True; print("UI is falling behind; dropping updates until it can be resynced.")
+            return
+    ui_message_queue.put_nowait(message)
+
+def coalesce_ui_messages(messages):
+    """Drops updates that a later message in the same batch supersedes. Summaries are complete, so only an entry's last one counts."""
+    out, entry_index, detail_index, target_index = [], {}, {}, None
+    for message in messages:
+        kind = message["type"]; history_id = message["data"].get("id") if isinstance(message["data"], dict) else None
+        if kind in ("entry", "remove") and history_id in entry_index:
+            out[entry_index.pop(history_id)] = None
+        elif kind == "detail" and history_id in detail_index:
+            out[detail_index[history_id]] = None
+        elif kind == "target_list":
+            # Each target list is complete, so only the last one in a frame matters
+            if target_index is not None: out[target_index] = None
+            target_index = len(out)
+        if kind == "entry": entry_index[history_id] = len(out)
+        elif kind == "detail": detail_index[history_id] = len(out)
+        out.append(message)
+    return [message for message in out if message is not None]
+
+async def search_stored(terms):
+    """Ids of the stored session entries the panel has loaded (Load older) that match the terms."""
+    return [f"db:{seq}" for seq in await session_store.search(terms, session_page_floor)]
+
+async def run_search(command):
+    """Answers a UI search with one page of ranked hits from the index, then matching stored session entries."""
+    stored = search_stored if session_store and session_page_floor is not None else None
+    try: result = await search_index.search(command.get('query', ''), int(command.get('offset', 0)), int(command.get('limit', SEARCH_PAGE_SIZE)), command.get('target_id'), stored)
+    except re.error as e: result = {"query": command.get('query', ''), "error": f"Bad regex: {e}", "total": 0, "hits": []}
+    except sqlite3.Error as e: result = {"query": command.get('query', ''), "error": f"Searching the stored session failed: {e}", "total": 0, "hits": []}
+    result["search_id"] = command.get('search_id')
+    send_to_ui({"type": "search_results", "data": result}) # Queued behind the entry updates its hits refer to
+
+def history_snapshot():
+    """Every entry's summary as of the current sequence number; the panel rebuilds its list from it."""
+    entries = [entry_summary(history_id) for history_id in request_history]
+    return {"type": "resync", "data": {"entries": entries, "targets": list(known_targets.values()), "seq": ui_seq, "run": ui_run_id}}
+
+async def resume_ui(websocket, hello):
+    """Answers a panel's hello by replaying the list updates it missed, or resyncing it when they are gone."""
+    reply = {"version": UI_PROTOCOL_VERSION, "run": ui_run_id}
+    if hello.get('version') != UI_PROTOCOL_VERSION:
+        reply["error"] = "The control panel is out of date - reload it"
+        await websocket.send(json.dumps({"type": "hello", "data": reply})); return
+    seq = hello.get('seq') or 0
+    reply["resumed"] = hello.get('run') == ui_run_id and (seq == ui_seq or bool(ui_replay) and ui_replay[0]["seq"] <= seq + 1)
+    await websocket.send(json.dumps({"type": "hello", "data": reply}))
+    if reply["resumed"]:
+        missed = [message for message in ui_replay if message["seq"] > seq]
+        if missed: await websocket.send(json.dumps({"type": "batch", "from": missed[0]["seq"], "to": missed[-1]["seq"], "data": missed}))
+        return
+    send_to_ui(history_snapshot())
+    if session_store and session_store.resumed_count: await send_session_page()
+
 async def ui_sender_loop():
-    """Reads messages from the queue and sends them to the websocket without blocking CDP."""
+    """Reads messages from the queue and sends them to the websocket in coalesced frames, without blocking CDP."""
+    global ui_resync_needed
+    loop = asyncio.get_running_loop()
     while True:
-        message = await ui_message_queue.get()
-        if ui_websocket_connection:
+        batch = [await ui_message_queue.get()]
+        deadline = loop.time() + UI_FLUSH_INTERVAL
+        while len(batch) < UI_BATCH_MAX:
+            if ui_message_queue.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0: break
+                try: batch.append(await asyncio.wait_for(ui_message_queue.get(), remaining))
+                except asyncio.TimeoutError: break
+            else: batch.append(ui_message_queue.get_nowait())
+        for _ in batch: ui_message_queue.task_done()
+        if ui_resync_needed and ui_message_queue.empty():
+            # The snapshot replaces the list updates; replies in the batch still go out after it
+            batch = [history_snapshot()] + [message for message in batch if message["type"] not in UI_LIST_UPDATES]; ui_resync_needed = False
+        messages = coalesce_ui_messages(batch)
+        if ui_websocket_connection and messages:
+            frame = messages[0] if len(batch) == 1 else {"type": "batch", "data": messages}
+            # The sequence range the frame covers, including updates coalesced away, so the panel can spot a gap
+            seqs = [message["seq"] for message in batch if "seq" in message]
+            if seqs and len(batch) > 1: frame["from"], frame["to"] = seqs[0], seqs[-1]
             try:
-                await ui_websocket_connection.send(json.dumps(message))
+                await ui_websocket_connection.send(json.dumps(frame)); metric_counters["ui_frames"] += 1
             except Exception:
-                pass # Connection closed or error, just drop the message
-        ui_message_queue.task_done()
+                pass # Connection closed or error, just drop the frame
 
 async def ui_websocket_handler(websocket, path=None):
-    global ui_websocket_connection
+    global ui_websocket_connection, ui_sent_body_bytes, search_task
     ui_websocket_connection = websocket; print("UI connected via WebSocket."); ui_ready.set()
+    ui_sent_bodies.clear(); ui_sent_body_bytes = 0
+    if known_targets: send_target_list()
     try:
         async for message in websocket:
             command = json.loads(message)
             if command['type'] == 'repeat_request':
-                should_render = command.get('render', False)
-                response_data = await repeat_request_via_cdp(command['data'])
+                # A task per Send, so this loop goes straight back to reading commands
+                repeat_id = str(command.get('id') or uuid.uuid4().hex)
+                if repeat_id not in repeats:
+                    repeats[repeat_id] = asyncio.create_task(run_repeat(repeat_id, command['data'], command.get('render', False), command.get('timeout')))
+            elif command['type'] == 'repeat_cancel':
+                cancel_repeat(str(command['id']))
+            elif command['type'] == 'hello':
+                # Sent on every (re)connect, and again whenever the panel spots a gap in the sequence
+                await resume_ui(websocket, command)
+            elif command['type'] == 'get_detail':
+                await send_detail(str(command.get('id')), command.get('resend', False))
+            elif command['type'] == 'get_body_range':
+                try: offset, length = int(command['offset']), int(command.get('length', UI_DETAIL_BODY_CHARS))
+                except (KeyError, TypeError, ValueError): send_error("get_body_range", command.get('id'), "Bad body range"); continue
+                await send_body_range(str(command.get('id')), offset, length)
+            elif command['type'] == 'search':
+                if search_task: search_task.cancel() # Superseded by the next keystroke
+                search_task = asyncio.create_task(run_search(command))
+            elif command['type'] == 'get_bodies':
+                for fetch_id in command.get('ids', []): await request_response_body(fetch_id)
+            elif command['type'] == 'load_session_page' and session_store:
+                await send_session_page(command.get('before'))
+            elif command['type'] == 'export_har':
+                asyncio.create_task(run_har_export())
+            elif command['type'] == 'import_har_chunk':
+                await receive_har_chunk(command)
+            elif command['type'] == 'attack_start':
+                attack = command['data']; attack_id = attack['attack_id']
+                # Cleared number fields arrive as ''
+                try: concurrency, rate = int(attack.get('concurrency') or 10), float(attack.get('rate') or 0)
+                except (TypeError, ValueError):
+                    send_to_ui({"type": "attack_done", "data": {"attack_id": attack_id, "sent": 0, "error": "Concurrency must be a whole number and Rate/s a number"}}); continue
+                if attack_id not in attacks:
+                    attacks[attack_id] = asyncio.create_task(run_attack(attack_id, attack['template'], attack['payloads'], attack.get('mode', 'sniper'), concurrency, rate, bool(attack.get('race'))))
+            elif command['type'] == 'attack_stop':
+                task = attacks.get(command['attack_id'])
+                # Aborted in the pages first: cancelling the task alone would leave its fetches running against the target
+                if task: abort_fetches(command['attack_id'], "Stopped"); task.cancel()
+            elif command['type'] == 'get_attack_response':
+                response_data = attack_responses.get((command['attack_id'], command['index'])) or "[Response no longer cached]"
                 if ui_websocket_connection: await ui_websocket_connection.send(json.dumps({"type": "repeated_response", "data": response_data}))
-                if should_render and response_data:
-                    local_url = host_response_body(response_data)
-                    if local_url: await execute_cdp_command("Target.createTarget", {"url": local_url})
     finally:
+        for upload_id in list(har_uploads): discard_har_upload(upload_id) # Cut off mid-upload
         ui_websocket_connection = None; ui_ready.clear(); print("UI disconnected.")
 
-async def repeat_request_via_cdp(raw_request):
-    if not MONITORED_SESSION_ID: return "Error: No monitored tab is available to send the request from."
-    try:
-        cookie_data = await execute_cdp_command("Network.getAllCookies")
-        cookies = {c['name']: c['value'] for c in cookie_data.get('cookies', [])}
-        cookie_header = "; ".join([f"{name}={value}" for name, value in cookies.items()])
-        headers_part, _, body_part = raw_request.partition('\n\n')
-        request_lines = headers_part.split('\n'); method, url, _ = request_lines[0].split(' ', 2)
-        headers = {line.split(': ', 1)[0]: line.split(': ', 1)[1] for line in request_lines[1:] if ': ' in line}
-        headers['Cookie'] = cookie_header
+def parse_raw_request(raw_request):
+    headers_part, _, body_part = raw_request.partition('\n\n')
+    request_lines = headers_part.split('\n'); method, url, _ = request_lines[0].split(' ', 2)
+    headers = {line.split(': ', 1)[0]: line.split(': ', 1)[1] for line in request_lines[1:] if ': ' in line}
+    return method, url, headers, body_part
+
+async def load_cookie_jar():
+    global cookie_refresh
+    try: cookie_jar.load((await execute_cdp_command("Network.getAllCookies")).get('cookies', []))
+    finally: cookie_refresh = None
+
+async def refresh_cookie_jar():
+    """Reloads the jar from Chrome, but only when network events haven't kept it current.
+    Concurrent sends share one Network.getAllCookies; shielded, so one cancelled send doesn't cancel it for the rest."""
+    global cookie_refresh
+    if cookie_jar.is_fresh(): return
+    if cookie_refresh is None: cookie_refresh = asyncio.ensure_future(load_cookie_jar())
+    await asyncio.shield(cookie_refresh)
+
+def browser_fetch_expression(specs):
+    """JS that runs every spec through fetch() at once and resolves to a list of response dicts.
+
+    Each fetch gets an AbortController: a spec's timeout_ms aborts it, and one with an id is kept in the
+    window.__cdpRepeaterAborts set for that id until it settles, so abort_fetches() can abort it from another evaluate.
+    """
+    return f"""(async () => {{ const specs = {json.dumps(specs)}; const aborts = window.__cdpRepeaterAborts = window.__cdpRepeaterAborts || {{}}; return await Promise.all(specs.map(async (s) => {{ const started = performance.now(); const controller = new AbortController(); if (s.id) (aborts[s.id] = aborts[s.id] || new Set()).add(controller); const timer = s.timeout_ms ? setTimeout(() => controller.abort(new DOMException(`Timed out after ${{s.timeout_ms}} ms`, 'TimeoutError')), s.timeout_ms) : null; try {{ const response = await fetch(s.url, {{ method: s.method, headers: s.headers, body: s.method === 'GET' || s.method === 'HEAD' ? undefined : s.body, credentials: "include", mode: 'cors', signal: controller.signal }}); const responseBody = await response.text(); const time_ms = performance.now() - started; const responseHeaders = {{}}; for (const [key, value] of response.headers.entries()) {{ responseHeaders[key] = value; }} const phases = []; const entry = performance.getEntriesByName(response.url).pop(); if (entry) {{ const add = (name, a, b) => {{ if (a > 0 && b >= a) phases.push({{ name: name, start: a - entry.startTime, end: b - entry.startTime }}); }}; add('dns', entry.domainLookupStart, entry.domainLookupEnd); add('connect', entry.connectStart, entry.connectEnd); add('ssl', entry.secureConnectionStart, entry.connectEnd); add('wait', entry.requestStart, entry.responseStart); add('receive', entry.responseStart, entry.responseEnd); }} return {{ status: response.status, statusText: response.statusText, headers: responseHeaders, body: responseBody, time_ms: time_ms, phases: phases }}; }} catch (e) {{ return {{ error: String(controller.signal.aborted ? controller.signal.reason : e), time_ms: performance.now() - started }}; }} finally {{ clearTimeout(timer); if (s.id) {{ aborts[s.id].delete(controller); if (!aborts[s.id].size) delete aborts[s.id]; }} }} }})); }})()"""
+
+async def evaluate_fetches(specs, session_id):
+    """Runs fetch specs in one page, all in flight at once, and returns their response dicts."""
+    started = time.perf_counter(); ids = {spec['id'] for spec in specs if spec.get('id')}
+    # The page aborts fetches with a timeout itself; the CDP timeout only catches a page that never answers
+    page_timeout = max((spec.get('timeout_ms') or 0 for spec in specs), default=0) / 1000
+    for abort_id in ids: repeat_tabs.setdefault(abort_id, collections.Counter())[session_id] += 1
+    try: result = await execute_cdp_command("Runtime.evaluate", { "expression": browser_fetch_expression(specs), "awaitPromise": True, "returnByValue": True }, session_id=session_id, timeout=min(REPEAT_TIMEOUT, page_timeout + 5) if page_timeout else REPEAT_TIMEOUT)
+    finally:
+        for abort_id in ids:
+            tabs = repeat_tabs[abort_id]; tabs[session_id] -= 1
+            if tabs[session_id] <= 0: del tabs[session_id]
+            if not tabs: del repeat_tabs[abort_id]
+    roundtrip_ms = round((time.perf_counter() - started) * 1000, 3); repeat_seconds.observe(roundtrip_ms / 1000)
+    if 'result' in result and isinstance(result['result'].get('value'), list):
+        for res_val in result['result']['value']: res_val['roundtrip_ms'] = roundtrip_ms
+        return result['result']['value']
+    raise RuntimeError(f"Failed to get a valid response from browser. CDP Result: {result}")
+
+async def send_via_browser(requests, timeout=None, abort_id=None):
+    """Sends (method, url, headers, body) tuples and returns their response dicts, in order.
+
+    Requests are grouped by origin; each group runs in one page (so race mode stays in one JS tick),
+    on the repeat worker pool when it is up, otherwise from the monitored tab. The page aborts each
+    fetch after timeout seconds; abort_id tags the fetches (a Send's, or an attack's) so abort_fetches() can abort them.
+    """
+    await refresh_cookie_jar()
+    groups = {}
+    for index, (method, url, headers, body) in enumerate(requests):
+        headers = dict(headers) # No Cookie: fetch() drops it. Cookies come from the page's context, which the pool syncs from the jar
         if browser_user_agent: headers['User-Agent'] = browser_user_agent
-        js_headers = json.dumps(headers); js_body = json.dumps(body_part)
-        js_expression = f"""(async () => {{ try {{ const response = await fetch("{url}", {{ method: "{method}", headers: {js_headers}, body: '{method}' === 'GET' || '{method}' === 'HEAD' ? undefined : {js_body}, credentials: "include", mode: 'cors' }}); const responseBody = await response.text(); const responseHeaders = {{}}; for (const [key, value] of response.headers.entries()) {{ responseHeaders[key] = value; }} return {{ status: response.status, statusText: response.statusText, headers: responseHeaders, body: responseBody }}; }} catch (e) {{ return {{ error: e.toString() }}; }} }})()"""
-        result = await execute_cdp_command("Runtime.evaluate", { "expression": js_expression, "awaitPromise": True, "returnByValue": True }, session_id=MONITORED_SESSION_ID)
-        if 'result' in result and 'value' in result['result']:
-            res_val = result['result']['value']
-            if 'error' in res_val: return f"Error executing fetch in browser: {res_val['error']}"
-            status_line = f"HTTP/1.1 {res_val.get('status')} {res_val.get('statusText')}"
-            headers_part = "\n".join([f"{k}: {v}" for k, v in res_val.get('headers', {}).items()])
-            body_part = res_val.get('body', '')
-            return f"{status_line}\n{headers_part}\n\n{body_part}"
-        return f"Failed to get a valid response from browser. CDP Result: {result}"
-    except Exception as e: return f"Error processing repeat request: {str(e)}"
-
-async def cdp_client_logic(cdp_ws_url):
-    global browser_user_agent, MONITORED_SESSION_ID
-    async with websockets.connect(cdp_ws_url, max_size=None) as cdp_ws:
-        print("Successfully connected to Chrome browser.")
+        parts = urllib.parse.urlsplit(url); origin = f"{parts.scheme}://{parts.netloc}" if parts.scheme in ("http", "https") else None
+        spec = {"method": method, "url": url, "headers": headers, "body": body}
+        if timeout: spec["timeout_ms"] = round(timeout * 1000)
+        if abort_id: spec["id"] = abort_id
+        groups.setdefault(origin, []).append((index, spec))
+    results = [None] * len(requests)
+
+    async def send_group(origin, items):
+        specs = [spec for _, spec in items]
+        values = await repeat_pool.fetch(origin, specs) if origin and repeat_pool.available() else None
+        if values is None:
+            if not MONITORED_SESSION_ID: raise RuntimeError("No repeat worker or monitored tab is available to send the request from.")
+            values = await evaluate_fetches(specs, MONITORED_SESSION_ID)
+        for (index, _), value in zip(items, values): results[index] = value
+
+    await asyncio.gather(*(send_group(origin, items) for origin, items in groups.items()))
+    return results
+
+def format_browser_response(res_val):
+    status_line = f"HTTP/1.1 {res_val.get('status')} {res_val.get('statusText')}"
+    headers_part = "\n".join([f"{k}: {v}" for k, v in res_val.get('headers', {}).items()])
+    return f"{status_line}\n{headers_part}\n\n{res_val.get('body', '')}"
+
+def repeat_timing(res_val):
+    """Timing for a repeat: the page's own fetch duration and phases, plus the CDP round trip measured here."""
+    browser_ms = round(res_val.get('time_ms', 0), 3)
+    return {"total_ms": browser_ms, "browser_ms": browser_ms, "roundtrip_ms": res_val.get('roundtrip_ms'), "phases": res_val.get('phases', [])}
+
+async def repeat_request_via_cdp(raw_request, timeout=None, repeat_id=None):
+    """Returns (raw response text, timing dict or None)."""
+    if not MONITORED_SESSION_ID and not repeat_pool.available(): return "Error: No monitored tab is available to send the request from.", None
+    try:
+        res_val = (await send_via_browser([parse_raw_request(raw_request)], timeout, repeat_id))[0]
+        if 'error' in res_val: return f"Error executing fetch in browser: {res_val['error']}", repeat_timing(res_val)
+        return format_browser_response(res_val), repeat_timing(res_val)
+    except Exception as e: return f"Error processing repeat request: {str(e)}", None
 
-        async def cdp_writer():
-            global pending_futures
+async def run_repeat(repeat_id, raw_request, render=False, timeout=None):
+    """One Send from the panel. Up to REPEAT_MAX_IN_FLIGHT run at once, and the reply carries the panel's id."""
+    try:
+        try: seconds = float(timeout or REPEAT_SEND_TIMEOUT)
+        except (TypeError, ValueError): seconds = math.nan
+        if not math.isfinite(seconds): response_data, timing = f"Error: Timeout must be a number of seconds, not {timeout!r}", None
+        else:
+            async with repeat_slots: response_data, timing = await repeat_request_via_cdp(raw_request, min(max(seconds, REPEAT_MIN_TIMEOUT), REPEAT_TIMEOUT), repeat_id)
+    except asyncio.CancelledError:
+        # Cancelled before its fetch reached a page; one already running is aborted there and answers normally
+        if ui_websocket_connection: await ui_websocket_connection.send(json.dumps({"type": "repeated_response", "id": repeat_id, "data": "[Request cancelled before it was sent]", "timing": None}))
+        raise
+    finally: repeats.pop(repeat_id, None)
+    if ui_websocket_connection: await ui_websocket_connection.send(json.dumps({"type": "repeated_response", "id": repeat_id, "data": response_data, "timing": timing}))
+    if render and response_data:
+        local_url = host_response_body(response_data)
+        if local_url: await open_own_tab(local_url)
+
+def abort_fetches(abort_id, reason):
+    """Aborts the fetches tagged abort_id in every page running them. Returns whether any page was."""
+    sessions = list(repeat_tabs.get(abort_id, ()))
+    for session_id in sessions:
+        send_cdp_command("Runtime.evaluate", {"expression": f"window.__cdpRepeaterAborts?.[{json.dumps(abort_id)}]?.forEach(c => c.abort(new DOMException({json.dumps(reason)}, 'AbortError')))"}, session_id)
+    return bool(sessions)
+
+def cancel_repeat(repeat_id):
+    """Aborts a Send: in the page when its fetch is running (it then answers with the AbortError), otherwise by cancelling its task."""
+    if not abort_fetches(repeat_id, "Cancelled") and repeat_id in repeats: repeats[repeat_id].cancel()
+
+# --- Repeat Workers ---
+WORKER_DOCUMENT = base64.b64encode(b"<!DOCTYPE html><title>CDP Repeater worker</title>").decode()
+
+class RepeatWorker:
+    """A hidden tab in its own browser context. It sits on the origin it last sent to, so its fetch() calls are same-origin."""
+    __slots__ = ("context_id", "target_id", "session_id", "origin", "ready", "in_flight", "fetching", "cookie_version", "cookie_lock", "stale_cookies", "healthy", "sent")
+
+    def __init__(self, context_id, target_id, session_id):
+        self.context_id = context_id; self.target_id = target_id; self.session_id = session_id
+        self.origin = None; self.ready = None; self.in_flight = 0; self.fetching = 0; self.healthy = True; self.sent = 0
+        self.cookie_version = -1; self.cookie_lock = asyncio.Lock(); self.stale_cookies = False
+
+class RepeatPool:
+    """Schedules repeats across worker tabs so bulk sends neither share the browsing tab's renderer nor slow it down.
+
+    Each worker gets a fresh browser context and is synced from the cookie jar before it sends.
+    Dispatch is least-loaded: a worker switches origin only when it is idle, by navigating to a blank
+    document that the Fetch domain fulfills locally, so the target server never sees that navigation.
+    """
+    def __init__(self, size, health_interval):
+        self.size = size; self.health_interval = health_interval
+        self.workers = []; self.sessions = {}; self.context_ids = set()
+        self.changed = asyncio.Condition()
+        self.task = None    # run(), referenced here so the running pool isn't garbage collected
+
+    def available(self): return any(worker.healthy for worker in self.workers)
+
+    async def start(self):
+        await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+        print(f"Repeat worker pool: {len(self.workers)}/{self.size} workers ready.")
+
+    async def run(self):
+        await self.start()
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+
+    async def _spawn(self):
+        context = await execute_cdp_command("Target.createBrowserContext", {"disposeOnDetach": True})
+        context_id = context.get("browserContextId")
+        if not context_id: return None
+        self.context_ids.add(context_id)
+        target = await execute_cdp_command("Target.createTarget", {"url": "about:blank", "browserContextId": context_id, "newWindow": True, "background": True})
+        attach = await execute_cdp_command("Target.attachToTarget", {"targetId": target.get("targetId"), "flatten": True}) if target.get("targetId") else {}
+        if not attach.get("sessionId"):
+            await execute_cdp_command("Target.disposeBrowserContext", {"browserContextId": context_id}); self.context_ids.discard(context_id)
+            return None
+        worker = RepeatWorker(context_id, target["targetId"], attach["sessionId"])
+        self.sessions[worker.session_id] = worker
+        # Inspector.enable is what makes the session report Inspector.targetCrashed
+        await asyncio.gather(execute_cdp_command("Fetch.enable", {"patterns": [{"urlPattern": "*", "resourceType": "Document", "requestStage": "Request"}]}, worker.session_id),
+                             execute_cdp_command("Inspector.enable", {}, worker.session_id))
+        self.workers.append(worker)
+        return worker
+
+    async def _retire(self, worker):
+        worker.healthy = False
+        if worker in self.workers: self.workers.remove(worker)
+        self.sessions.pop(worker.session_id, None)
+        await execute_cdp_command("Target.disposeBrowserContext", {"browserContextId": worker.context_id})
+        self.context_ids.discard(worker.context_id)
+        async with self.changed: self.changed.notify_all()
+
+    async def check_health(self):
+        for worker in list(self.workers):
+            try:
+                result = await asyncio.wait_for(execute_cdp_command("Runtime.evaluate", {"expression": "1", "returnByValue": True}, worker.session_id), timeout=5)
+                if result.get("result", {}).get("value") != 1: worker.healthy = False
+            except asyncio.TimeoutError: worker.healthy = False
+            if not worker.healthy:
+                print(f"Repeat worker {worker.target_id} is unresponsive; replacing it.")
+                await self._retire(worker); await self._spawn()
+
+    def on_event(self, worker, method, params):
+        """Handles events from a worker session. Called by the CDP reader, so it never waits on replies."""
+        if method == "Fetch.requestPaused":
+            send_cdp_command("Fetch.fulfillRequest", {"requestId": params["requestId"], "responseCode": 200, "responseHeaders": [{"name": "Content-Type", "value": "text/html"}], "body": WORKER_DOCUMENT}, worker.session_id)
+        elif method == "Inspector.targetCrashed": worker.healthy = False
+
+    def on_detached(self, session_id):
+        worker = self.sessions.get(session_id)
+        if worker: worker.healthy = False
+
+    def _pick(self, origin):
+        # Workers already on this origin, or idle ones that can switch to it
+        candidates = [w for w in self.workers if w.healthy and (w.origin == origin or w.in_flight == 0)]
+        if not candidates: return None
+        return min(candidates, key=lambda w: (w.in_flight, w.origin != origin))
+
+    async def _navigate(self, worker, origin):
+        result = await execute_cdp_command("Page.navigate", {"url": f"{origin}/"}, worker.session_id)
+        if not result or result.get("errorText"):
+            worker.healthy = False
+            raise RuntimeError(f"Repeat worker could not open {origin}: {result.get('errorText', 'no response')}")
+
+    async def _sync_cookies(self, worker):
+        """Brings the worker's context up to date with the jar. Syncs are serialized per worker, and the context is only
+        cleared first (so cookies the jar dropped go too) while none of its fetches is running; otherwise that waits."""
+        async with worker.cookie_lock:
+            version = cookie_jar.version
+            if worker.cookie_version == version and (worker.fetching or not worker.stale_cookies): return
+            if worker.fetching: worker.stale_cookies = True
+            else: await execute_cdp_command("Storage.clearCookies", {"browserContextId": worker.context_id}); worker.stale_cookies = False
+            await execute_cdp_command("Storage.setCookies", {"cookies": cookie_jar.cookie_params(), "browserContextId": worker.context_id})
+            worker.cookie_version = version
+
+    async def fetch(self, origin, specs):
+        """Runs specs (all for one origin) on the least-loaded worker. Returns None when no worker is usable."""
+        async with self.changed:
             while True:
-                command = await cdp_command_queue.get()
-                if 'future' in command: pending_futures[command['id']] = command.pop('future')
-                await cdp_ws.send(json.dumps(command)); cdp_command_queue.task_done()
-
-        async def cdp_reader():
-            global request_history, request_order, CDP_COMMAND_ID, cdp_id_to_req_id, network_id_to_fetch_id
+                if not self.available(): return None
+                worker = self._pick(origin)
+                if worker: break
+                await self.changed.wait()
+            worker.in_flight += 1
+            if worker.origin != origin:
+                worker.origin = origin; worker.ready = asyncio.ensure_future(self._navigate(worker, origin))
+        try:
+            await asyncio.shield(worker.ready)
+            await self._sync_cookies(worker)
+            worker.fetching += 1 # No await since the sync released its lock, so a sync that clears can't have started
+            try: results = await evaluate_fetches(specs, worker.session_id)
+            finally: worker.fetching -= 1
+            worker.sent += len(specs)
+            return results
+        finally:
+            worker.in_flight -= 1
+            async with self.changed: self.changed.notify_all()
+
+repeat_pool = RepeatPool(REPEAT_WORKERS, WORKER_HEALTH_INTERVAL)
+
+# --- Attack Mode ---
+def iter_payloads(spec):
+    """Yields payload strings from a UI payload spec: a literal list or a numeric range."""
+    if spec.get('type') == 'numbers':
+        start, stop, step = int(spec.get('from', 0)), int(spec.get('to', 0)), int(spec.get('step', 1)) or 1
+        for number in range(start, stop + (1 if step > 0 else -1), step): yield str(number)
+    else:
+        for value in spec.get('values', []): yield value
+
+def iter_attack_requests(template, payload_spec, mode):
+    """Yields (position, payload, raw_request) for every variant of a template with §marked§ insertion points.
+
+    "sniper" walks each position in turn, leaving the others at their original values; "ram" puts the same payload in all of them.
+    """
+    parts = template.split(ATTACK_MARKER)
+    if len(parts) < 3 or len(parts) % 2 == 0: raise ValueError(f"Mark insertion points as pairs of {ATTACK_MARKER}")
+    positions = len(parts) // 2
+    if mode == "ram":
+        for payload in iter_payloads(payload_spec):
+            yield 0, payload, "".join(payload if i % 2 else part for i, part in enumerate(parts))
+        return
+    for position in range(positions):
+        for payload in iter_payloads(payload_spec):
+            yield position, payload, "".join(payload if i == position * 2 + 1 else part for i, part in enumerate(parts))
+
+async def run_attack(attack_id, template, payload_spec, mode="sniper", concurrency=10, rate=0, race=False):
+    """Sends every variant of the template and streams one attack_result per response to the UI."""
+    variants = iter_attack_requests(template, payload_spec, mode)
+    sent = 0; in_flight = set()
+
+    def report(index, position, payload, res_val):
+        if 'error' not in res_val: attack_responses.put((attack_id, index), format_browser_response(res_val))
+        send_to_ui({"type": "attack_result", "data": {"attack_id": attack_id, "index": index, "position": position, "payload": payload, "status": res_val.get('status'), "length": len(res_val.get('body', '')), "time_ms": round(res_val.get('time_ms', 0), 2), "error": res_val.get('error')}})
+
+    limit = max(1, min(concurrency, ATTACK_MAX_CONCURRENCY))
+    try:
+        if race:
+            # Waves of up to limit requests; one Runtime.evaluate starts every fetch of a wave in the same JS tick
             while True:
-                message = await cdp_ws.recv(); data = json.loads(message)
-                session_id = data.get("sessionId")
-                if session_id and session_id != MONITORED_SESSION_ID: continue
-                method = data.get("method")
-                if "id" in data:
-                    cmd_id = data.get("id")
-                    if cmd_id in pending_futures:
-                        future = pending_futures.pop(cmd_id); future.set_result(data.get('result', {}))
-                    elif cmd_id in cdp_id_to_req_id:
-                        fetch_id = cdp_id_to_req_id.pop(cmd_id)
-                        body = "[Response body not available]"
-
-                        if 'error' not in data:
-                            result = data.get("result", {})
-                            if result.get("base64Encoded"): body = f"[Binary Content ({len(result.get('body', ''))} bytes, base64)]"
-                            else: body = result.get("body", "")
-                        else:
-                            stored_error = request_history.get(fetch_id, {}).get('error_text')
-                            if stored_error:
-                                body = f"[Request Failed: {stored_error}]"
-                            else:
-                                body = f"[No Content / Body Unavailable (CDP Error: {data['error'].get('message', 'Unknown')})]"
-
-                        if fetch_id in request_history:
-                            headers = request_history[fetch_id].get('response_headers', 'HTTP/1.1 000 Unknown')
-                            full_response = f"{headers}\n\n{body}"
-                            # DECOUPLED: Put in queue, don't await
-                            ui_message_queue.put_nowait({"type": "response_data", "data": { "id": fetch_id, "body": full_response }})
-
-                elif method == "Fetch.requestPaused":
-                    event = data["params"]; fetch_id = event["requestId"]; network_id = event.get("networkId")
-                    if network_id:
-                        network_id_to_fetch_id[network_id] = fetch_id
-
-                    if ui_websocket_connection:
-                        request_data = { "id": fetch_id, "url": event["request"]["url"], "method": event["request"]["method"], "headers": event["request"]["headers"], "postData": event["request"].get("postData") }
-                        request_history[fetch_id] = request_data; request_order.append(fetch_id)
-                        if len(request_order) > HISTORY_LIMIT:
-                            oldest_id = request_order.pop(0)
-                            if oldest_id in request_history: del request_history[oldest_id]
-                            ui_message_queue.put_nowait({ "type": "remove_request", "data": {"id": oldest_id} })
-
-                        # DECOUPLED: Put in queue
-                        ui_message_queue.put_nowait({"type": "new_request", "data": request_data})
-
-                    if not network_id and ui_websocket_connection:
-                         ui_message_queue.put_nowait({"type": "response_data", "data": { "id": fetch_id, "body": "[Cached/Internal Request - No Network Body]" }})
-
-                    CDP_COMMAND_ID += 1
-                    # IMPORTANT: Queue the continue immediately
-                    await cdp_command_queue.put({"id": CDP_COMMAND_ID, "method": "Fetch.continueRequest", "params": {"requestId": fetch_id}, "sessionId": MONITORED_SESSION_ID})
-
-                elif method == "Network.responseReceived":
-                    network_id = data["params"]["requestId"]
-                    fetch_id = network_id_to_fetch_id.get(network_id)
-                    if fetch_id and fetch_id in request_history:
-                        response = data["params"]["response"]
-                        status_line = f"HTTP/{response.get('protocol', '1.1')} {response['status']} {response['statusText']}"
-                        headers = "\n".join([f"{k}: {v}" for k, v in response["headers"].items()])
-                        request_history[fetch_id]['response_headers'] = f"{status_line}\n{headers}"
-
-                elif method == "Network.loadingFinished":
-                    network_id = data["params"]["requestId"]; fetch_id = network_id_to_fetch_id.pop(network_id, None)
-                    if fetch_id and fetch_id in request_history:
-                        CDP_COMMAND_ID += 1; cmd_id = CDP_COMMAND_ID
-                        cdp_id_to_req_id[cmd_id] = fetch_id
-                        await cdp_command_queue.put({"id": cmd_id, "method": "Network.getResponseBody", "params": {"requestId": network_id}, "sessionId": MONITORED_SESSION_ID})
-
-                elif method == "Network.loadingFailed":
-                    network_id = data["params"]["requestId"]
-                    fetch_id = network_id_to_fetch_id.pop(network_id, None)
-                    if fetch_id and fetch_id in request_history:
-                        request_history[fetch_id]['error_text'] = data["params"].get("errorText", "Unknown Error")
-                        CDP_COMMAND_ID += 1; cmd_id = CDP_COMMAND_ID
-                        cdp_id_to_req_id[cmd_id] = fetch_id
-                        await cdp_command_queue.put({"id": cmd_id, "method": "Network.getResponseBody", "params": {"requestId": network_id}, "sessionId": MONITORED_SESSION_ID})
-
-        writer_task = asyncio.create_task(cdp_writer())
-        reader_task = asyncio.create_task(cdp_reader())
-        ui_sender = asyncio.create_task(ui_sender_loop()) # Start the UI sender loop
+                batch = [(position, payload, parse_raw_request(raw)) for position, payload, raw in itertools.islice(variants, limit)]
+                if not batch: break
+                results = await send_via_browser([request for _, _, request in batch], abort_id=attack_id)
+                for index, ((position, payload, _), res_val) in enumerate(zip(batch, results), sent): report(index, position, payload, res_val)
+                sent += len(batch)
+        else:
+            semaphore = asyncio.Semaphore(limit)
+            interval = 1.0 / rate if rate else 0; next_start = time.monotonic()
+
+            async def send_one(index, position, payload, raw):
+                try:
+                    try: res_val = (await send_via_browser([parse_raw_request(raw)], abort_id=attack_id))[0]
+                    except Exception as e: res_val = {"error": str(e)}
+                    report(index, position, payload, res_val)
+                finally: semaphore.release()
+
+            for index, (position, payload, raw) in enumerate(variants):
+                await semaphore.acquire()
+                if interval:
+                    delay = next_start - time.monotonic()
+                    if delay > 0: await asyncio.sleep(delay)
+                    next_start = max(next_start, time.monotonic()) + interval
+                task = asyncio.create_task(send_one(index, position, payload, raw))
+                in_flight.add(task); task.add_done_callback(in_flight.discard)
+                sent = index + 1
+            if in_flight: await asyncio.gather(*in_flight)
+        send_to_ui({"type": "attack_done", "data": {"attack_id": attack_id, "sent": sent}})
+    except asyncio.CancelledError:
+        for task in in_flight: task.cancel() # Stopped: the sends already started don't get to report either
+        send_to_ui({"type": "attack_done", "data": {"attack_id": attack_id, "sent": sent, "stopped": True}})
+        raise
+    except Exception as e:
+        send_to_ui({"type": "attack_done", "data": {"attack_id": attack_id, "sent": sent, "error": str(e)}})
+    finally:
+        attacks.pop(attack_id, None)
 
-        version_info = await execute_cdp_command("Browser.getVersion")
-        if 'userAgent' in version_info:
-            browser_user_agent = version_info['userAgent']; print(f"Captured browser User-Agent: {browser_user_agent[:50]}...")
+# --- Target Monitoring ---
+UI_ORIGIN = f"http://127.0.0.1:{HTTP_PORT}"
 
-        print("Creating control panel tab..."); await execute_cdp_command("Target.createTarget", {"url": f"http://127.0.0.1:{HTTP_PORT}"})
-        print("Creating a blank tab for you to browse in...")
-        user_tab = await execute_cdp_command("Target.createTarget", {"url": "about:blank"})
-        user_target_id = user_tab.get("targetId")
-        if not user_target_id: print("FATAL: Could not create the user browsing tab. Exiting."); return
-        print(f"Attaching listeners to user tab (ID: {user_target_id})...")
-        attach_result = await execute_cdp_command("Target.attachToTarget", {"targetId": user_target_id, "flatten": True})
-        MONITORED_SESSION_ID = attach_result.get("sessionId")
-        if not MONITORED_SESSION_ID: print(f"FATAL: Could not attach to user tab. Exiting."); return
+class MonitoredSession:
+    """Capture state for one attached target. Network requestIds are only unique within their session,
+    so the lifecycle tracker keys them by (session_id, network_id)."""
+    __slots__ = ("session_id", "target_id", "type")
 
-        print(f"Successfully attached with session ID: {MONITORED_SESSION_ID}")
-        await execute_cdp_command("Network.enable", {}, session_id=MONITORED_SESSION_ID)
-        await execute_cdp_command("Fetch.enable", {"patterns": [{"urlPattern": "*"}]}, session_id=MONITORED_SESSION_ID)
+    def __init__(self, session_id, target_id, target_type):
+        self.session_id = session_id; self.target_id = target_id; self.type = target_type
 
-        print("Waiting for UI to connect..."); await ui_ready.wait()
-        print("UI is ready. Please use the blank tab for browsing.")
-        await asyncio.gather(reader_task, writer_task, ui_sender)
+def send_cdp_command(method, params, session_id=None):
+    """Queues a command whose reply nobody waits for."""
+    global CDP_COMMAND_ID
+    CDP_COMMAND_ID += 1
+    command = {"id": CDP_COMMAND_ID, "method": method, "params": params}
+    if session_id: command["sessionId"] = session_id
+    queue_cdp_command(command)
+
+def send_target_list():
+    send_to_ui({"type": "target_list", "data": list(known_targets.values())})
+
+def should_monitor(target_info):
+    if target_info.get("browserContextId") in repeat_pool.context_ids: return False
+    if target_info["targetId"] in ignored_target_ids or target_info.get("type") not in MONITOR_TARGET_TYPES: return False
+    return not target_info.get("url", "").startswith(UI_ORIGIN)
+
+def on_target_attached(session_id, target_info, waiting, parent_session_id=None):
+    """Registers an auto-attached target. Runs inside the CDP reader, so anything that needs a reply is spawned as a task."""
+    if not should_monitor(target_info):
+        # Auto-attach pauses new targets until we let them go
+        if waiting: send_cdp_command("Runtime.runIfWaitingForDebugger", {}, session_id)
+        send_cdp_command("Target.detachFromTarget", {"sessionId": session_id}, parent_session_id)
+        return
+    target_id = target_info["targetId"]
+    # Registered before any command is sent, so no event from the new session is dropped
+    monitored_sessions[session_id] = MonitoredSession(session_id, target_id, target_info["type"])
+    known_targets[target_id] = {"id": target_id, "type": target_info["type"], "title": target_info.get("title", ""), "url": target_info.get("url", ""), "open": True}
+    send_target_list()
+    asyncio.create_task(instrument_session(session_id, target_id, waiting))
+
+async def instrument_session(session_id, target_id, waiting):
+    """Enables capture on a newly attached target, then lets it start."""
+    global MONITORED_SESSION_ID
+    await execute_cdp_command("Network.enable", {}, session_id)
+    if CAPTURE_MODE != "passive":
+        # Response-stage patterns (opt-in, see STREAM_BODY_THRESHOLD) let large bodies be streamed and responses be rewritten
+        patterns = fetch_patterns + [dict(pattern, requestStage="Response") for pattern in fetch_patterns] if STREAM_BODY_THRESHOLD or match_replace.response_rules else fetch_patterns
+        await execute_cdp_command("Fetch.enable", {"patterns": patterns}, session_id)
+    # OOPIFs and workers of this target attach to its session, paused the same way
+    await execute_cdp_command("Target.setAutoAttach", {"autoAttach": True, "waitForDebuggerOnStart": True, "flatten": True}, session_id)
+    if waiting: await execute_cdp_command("Runtime.runIfWaitingForDebugger", {}, session_id)
+    session = monitored_sessions.get(session_id)
+    if session and (target_id == primary_target_id or (MONITORED_SESSION_ID is None and session.type == "page")): MONITORED_SESSION_ID = session_id
+
+def on_target_info_changed(target_info):
+    target = known_targets.get(target_info["targetId"])
+    if not target or not target["open"]: return
+    if target_info.get("url", "").startswith(UI_ORIGIN):
+        release_target(target_info["targetId"]); return
+    if target["title"] != target_info.get("title", "") or target["url"] != target_info.get("url", ""):
+        target["title"] = target_info.get("title", ""); target["url"] = target_info.get("url", "")
+        send_target_list()
+
+def on_session_detached(session_id):
+    global MONITORED_SESSION_ID
+    repeat_pool.on_detached(session_id)
+    session = monitored_sessions.pop(session_id, None)
+    if not session: return
+    lifecycle.discard_where("network", lambda key: key[0] == session_id)
+    if session.target_id in ignored_target_ids: known_targets.pop(session.target_id, None)
+    elif session.target_id in known_targets: known_targets[session.target_id]["open"] = False
+    if session_id == MONITORED_SESSION_ID:
+        # Keep the repeat path working from another open tab
+        MONITORED_SESSION_ID = next((s.session_id for s in monitored_sessions.values() if s.type == "page"), None)
+    send_target_list()
+
+def release_target(target_id):
+    """Stops capturing from a target (e.g. it turned out to be one of our own tabs)."""
+    ignored_target_ids.add(target_id)
+    for session in list(monitored_sessions.values()):
+        if session.target_id == target_id: send_cdp_command("Target.detachFromTarget", {"sessionId": session.session_id})
+
+async def open_own_tab(url):
+    """Opens one of our pages in a new tab, keeping it out of the capture."""
+    result = await execute_cdp_command("Target.createTarget", {"url": url})
+    if result.get("targetId"): release_target(result["targetId"])
+    return result.get("targetId")
+
+# --- CDP Event Dispatch ---
+# Every inbound CDP message goes through cdp_reader(), which stays thin: replies resolve a future or finish a body,
+# events look up a handler here. Handlers never await a CDP reply, so a paused request is always continued promptly.
+SESSION_EVENT_HANDLERS = {}    # method -> handler(session, params), for events from a monitored session
+BROWSER_EVENT_HANDLERS = {}    # method -> handler(params), for browser-level events (no sessionId)
+large_reply_queue = asyncio.Queue()   # Raw replies over LARGE_REPLY_BYTES, parsed by large_reply_decoder()
+
+def cdp_event(method, browser=False):
+    """Registers the decorated function as the handler for a CDP event."""
+    def register(handler):
+        (BROWSER_EVENT_HANDLERS if browser else SESSION_EVENT_HANDLERS)[method] = handler; return handler
+    return register
+
+def tail_session_id(message):
+    """Reads a flattened session's id off the end of a raw message (Chrome appends it last) without parsing the payload."""
+    if not message.endswith('"}'): return None
+    index = message.rfind('"sessionId":"', max(0, len(message) - 128))
+    if index == -1: return None
+    session_id = message[index + 13:-2]
+    return None if '"' in session_id else session_id
+
+async def large_reply_decoder():
+    """Parses big replies (bodies, repeat results) in the default executor, once queued continues are on the wire.
+
+    One at a time and in arrival order; the loop keeps reading events and sending continues while a parse runs.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await large_reply_queue.get()
+        with contextlib.suppress(asyncio.TimeoutError): await asyncio.wait_for(cdp_command_queue.join(), 0.05)
+        dispatch_reply(await loop.run_in_executor(None, json_loads, message))
+
+def dispatch_reply(data):
+    cmd_id = data.get("id")
+    future = lifecycle.pop("command", cmd_id)
+    if future is not None:
+        if not future.done(): future.set_result(data.get('result', {}))
+        return
+    fetch_id = lifecycle.pop("body", cmd_id)
+    if fetch_id is None: return
+    body = "[Response body not available]"
+    if 'error' not in data:
+        result = data.get("result", {})
+        if result.get("base64Encoded"): body = store_binary_body(fetch_id, result.get('body', ''))
+        else: body = result.get("body", "")
+    else:
+        stored_error = request_history.get(fetch_id, 'error_text')
+        if stored_error:
+            body = f"[Request Failed: {stored_error}]"
+        else:
+            body = f"[No Content / Body Unavailable (CDP Error: {data['error'].get('message', 'Unknown')})]"
+
+    if 'error' not in data: publish_body(fetch_id, body)
+    else: set_body_note(fetch_id, body)
+
+def queue_body_fetch(session_id, network_id, fetch_id):
+    global CDP_COMMAND_ID
+    CDP_COMMAND_ID += 1; cmd_id = CDP_COMMAND_ID
+    lifecycle.track("body", cmd_id, fetch_id)
+    queue_cdp_command({"id": cmd_id, "method": "Network.getResponseBody", "params": {"requestId": network_id}, "sessionId": session_id}, fetch_id, "body")
 
-async def main():
-    print("Starting CDP Repeater v6.3")
-    create_ui_files()
+async def lifecycle_sweeper():
+    """Expires correlation entries whose completion never came: lost replies, long-polls, websocket upgrades."""
+    while True:
+        await asyncio.sleep(LIFECYCLE_SWEEP_INTERVAL)
+        expired = lifecycle.sweep()
+        for _, future in expired.get("command", []):
+            if not future.done(): future.set_result({})
+        for _, fetch_id in expired.get("body", []):
+            set_body_note(fetch_id, "[Body Unavailable - Chrome never answered]")
+        if expired: print("Lifecycle sweep expired " + ", ".join(f"{len(entries)} {kind}" for kind, entries in expired.items()) + " entr(ies).")
+
+@cdp_event("Target.attachedToTarget", browser=True)
+def on_browser_target_attached(event):
+    # Browser-level target events: new tabs, popups and workers arrive here paused
+    on_target_attached(event["sessionId"], event["targetInfo"], event.get("waitingForDebugger", False))
+
+@cdp_event("Target.targetInfoChanged", browser=True)
+def on_browser_target_info_changed(event): on_target_info_changed(event["targetInfo"])
+
+@cdp_event("Target.detachedFromTarget", browser=True)
+def on_browser_target_detached(event): on_session_detached(event["sessionId"])
+
+@cdp_event("Target.detachedFromTarget")
+def on_child_target_detached(session, event): on_session_detached(event["sessionId"])
+
+@cdp_event("Target.attachedToTarget")
+def on_child_target_attached(session, event):
+    # Auto-attached child of this session: an OOPIF or a worker, paused until we've instrumented it
+    on_target_attached(event["sessionId"], event["targetInfo"], event.get("waitingForDebugger", False), session.session_id)
+
+@cdp_event("Fetch.requestPaused")
+def on_request_paused(session, event):
+    global CDP_COMMAND_ID
+    paused_at = time.perf_counter(); session_id = session.session_id
+    fetch_id = event["requestId"]; network_id = event.get("networkId")
+    if "responseStatusCode" in event or "responseErrorReason" in event:
+        # Response stage, only paused for when STREAM_BODY_THRESHOLD or response rules are set: large bodies are held to be
+        # streamed to disk, and responses the match-and-replace rules rewrite
+        rewrite = match_replace.response_rules and "responseStatusCode" in event and in_scope(event["request"]["url"], event["request"]["method"], event.get("resourceType"))
+        rules = match_replace.matching('response', event["request"]["url"], event["request"]["method"]) if rewrite else ()
+        if fetch_id in request_history and should_stream_body(event): asyncio.create_task(stream_body_to_blob(session_id, fetch_id, event, rules))
+        elif any(rule.part == 'body' for rule in rules): asyncio.create_task(fulfill_rewritten_response(session_id, fetch_id, event, rules))
+        elif rules: continue_rewritten_response(session_id, fetch_id, event, rules)
+        else: send_cdp_command("Fetch.continueRequest", {"requestId": fetch_id}, session_id)
+        return
+    CDP_COMMAND_ID += 1; request, overrides = event["request"], {}
+    # Fetch patterns over-match the scope, so only what in_scope() accepts is rewritten (and recorded)
+    scoped = in_scope(request["url"], request["method"], event.get("resourceType"))
+    if match_replace.request_rules and scoped:
+        try: request, overrides = match_replace.rewrite_request(request)
+        except re.error as e: print(f"Match-and-replace failed on {fetch_id}: {e}") # e.g. a group reference the regex lacks; sent unchanged
+    # IMPORTANT: Queue the continue immediately, before any bookkeeping
+    queue_cdp_command({"id": CDP_COMMAND_ID, "method": "Fetch.continueRequest", "params": {"requestId": fetch_id, **overrides}, "sessionId": session_id}, fetch_id, "continue", paused_at)
+    if not ui_websocket_connection or not scoped: return
+    record_request(fetch_id, request, network_id, session) # As sent, after any rewrite
+
+    # Only recorded requests are correlated, so nothing is tracked while no UI is connected
+    if network_id:
+        lifecycle.track("network", (session.session_id, network_id), fetch_id)
+    else:
+         set_body_note(fetch_id, "[Cached/Internal Request - No Network Body]")
+
+@cdp_event("Network.requestWillBeSent")
+def on_request_will_be_sent(session, event):
+    if CAPTURE_MODE != "passive": return
+    network_id = event["requestId"]
+    redirect = event.get("redirectResponse")
+    if redirect:
+        # Chrome reuses the requestId across redirect hops; close out the previous hop first.
+        previous_id = lifecycle.pop("network", (session.session_id, network_id))
+        if previous_id and previous_id in request_history:
+            response_headers = format_response_headers(redirect)
+            update_request(previous_id, response_headers=response_headers)
+            set_body_note(previous_id, "[Redirect - No Body]")
+    if not ui_websocket_connection or not in_scope(event["request"]["url"], event["request"]["method"], event.get("type")): return
+
+    history_id = network_id if network_id not in request_history else f"{network_id}-{uuid.uuid4().hex[:6]}"
+    record_request(history_id, event["request"], network_id, session)
+    lifecycle.track("network", (session.session_id, network_id), history_id)
+
+@cdp_event("Network.responseReceived")
+def on_response_received(session, event):
+    fetch_id = lifecycle.get("network", (session.session_id, event["requestId"]))
+    if fetch_id and fetch_id in request_history:
+        response = event["response"]
+        update_request(fetch_id, response_headers=format_response_headers(response), mime_type=response.get('mimeType', ''))
+        publish_entry(fetch_id) # The row's status shows before its body arrives
+        resource_timing = response.get('timing')
+        if resource_timing:
+            record_timing(fetch_id, request_time=resource_timing['requestTime'], phases=network_phases(resource_timing), headers_end_ms=resource_timing.get('receiveHeadersEnd', -1))
+
+@cdp_event("Network.requestWillBeSentExtraInfo")
+def on_request_extra_info(session, event):
+    # The cookies Chrome actually attached to this request, with full domain/path data
+    for associated in event.get("associatedCookies", []):
+        if not associated.get("blockedReasons"): cookie_jar.upsert(associated["cookie"])
+
+@cdp_event("Network.responseReceivedExtraInfo")
+def on_response_extra_info(session, event):
+    set_cookie = next((v for k, v in event.get("headers", {}).items() if k.lower() == "set-cookie"), None)
+    if set_cookie:
+        fetch_id = lifecycle.get("network", (session.session_id, event["requestId"]))
+        blocked_lines = {b.get("cookieLine") for b in event.get("blockedCookies", [])}
+        cookie_jar.apply_set_cookie(set_cookie, request_history.get(fetch_id, 'url') if fetch_id else None, blocked_lines)
+
+@cdp_event("Network.loadingFinished")
+def on_loading_finished(session, event):
+    network_id = event["requestId"]; fetch_id = lifecycle.pop("network", (session.session_id, network_id))
+    if fetch_id and fetch_id in request_history:
+        timing = request_history.get(fetch_id, 'timing') or {}
+        if 'request_time' in timing:
+            # loadingFinished.timestamp is on the same monotonic clock as ResourceTiming.requestTime
+            finished_ms = round((event["timestamp"] - timing['request_time']) * 1000, 3)
+            phases = list(timing.get('phases', []))
+            if timing.get('headers_end_ms', -1) >= 0: phases.append({"name": "receive", "start": timing['headers_end_ms'], "end": finished_ms})
+            record_timing(fetch_id, phases=phases, total_ms=finished_ms, encoded_bytes=event.get("encodedDataLength", 0))
+        if fetch_id in blob_store.by_history: return # Streamed; getResponseBody can't read it
+        if BODY_FETCH_MODE == "lazy" and not should_prefetch_body(fetch_id, event.get("encodedDataLength", 0)):
+            set_body_note(fetch_id, "[Body not loaded - select the request to fetch it]", pending=True)
+            return
+        queue_body_fetch(session.session_id, network_id, fetch_id)
+
+@cdp_event("Network.loadingFailed")
+def on_loading_failed(session, event):
+    network_id = event["requestId"]
+    fetch_id = lifecycle.pop("network", (session.session_id, network_id))
+    if fetch_id and fetch_id in request_history:
+        update_request(fetch_id, error_text=event.get("errorText", "Unknown Error"))
+        queue_body_fetch(session.session_id, network_id, fetch_id)
+
+async def cdp_writer(cdp_ws):
+    while True:
+        command = await cdp_command_queue.get()
+        queued_at = command.pop('_queued_at', None); history_id = command.pop('_history_id', None)
+        timing_key = command.pop('_timing_key', None); started_at = command.pop('_started_at', None)
+        await cdp_ws.send(json_dumps(command)); cdp_command_queue.task_done()
+        if history_id is not None:
+            sent_at = time.perf_counter(); timing = {f"{timing_key}_queue_ms": round((sent_at - queued_at) * 1000, 3)}
+            if started_at is not None:
+                timing[f"pause_to_{timing_key}_ms"] = round((sent_at - started_at) * 1000, 3)
+                if timing_key == "continue": pause_to_continue_seconds.observe(sent_at - started_at)
+            record_timing(history_id, **timing)
+
+async def cdp_reader(cdp_ws):
+    while True:
+        message = await cdp_ws.recv()
+        if message.startswith('{"id":'):
+            # Big replies go to large_reply_decoder(), so events behind them aren't held up by the parse
+            metric_counters["cdp_replies"] += 1
+            if LARGE_REPLY_BYTES and len(message) > LARGE_REPLY_BYTES: large_reply_queue.put_nowait(message)
+            else: dispatch_reply(json_loads(message))
+            continue
+        # Drop traffic from sessions we've let go of (or never wanted) before paying for a parse
+        session_id = tail_session_id(message)
+        if session_id and session_id not in monitored_sessions and session_id not in repeat_pool.sessions: metric_counters["cdp_messages_dropped"] += 1; continue
+        data = json_loads(message)
+        if "id" in data: metric_counters["cdp_replies"] += 1; dispatch_reply(data); continue
+
+        # Events: one dict lookup routes them, however many targets are attached
+        session_id = data.get("sessionId"); method = data.get("method"); cdp_event_counts[method] += 1
+        if not session_id:
+            handler = BROWSER_EVENT_HANDLERS.get(method)
+            if handler: handler(data.get("params", {}))
+        elif session_id in monitored_sessions:
+            handler = SESSION_EVENT_HANDLERS.get(method)
+            if handler: handler(monitored_sessions[session_id], data.get("params", {}))
+        else:
+            worker = repeat_pool.sessions.get(session_id)
+            if worker: repeat_pool.on_event(worker, method, data.get("params", {}))
+
+def pick_browsing_target(target_infos, wanted=None):
+    """The existing tab to browse in when attaching: the one matching wanted (a target id or URL substring), else the first ordinary page."""
+    pages = [t for t in target_infos if t.get("type") == "page" and not t.get("url", "").startswith(UI_ORIGIN) and not t.get("url", "").startswith("devtools://")]
+    if wanted: return next((t for t in pages if t["targetId"] == wanted or wanted in t.get("url", "")), None)
+    return pages[0] if pages else None
+
+async def create_browsing_tab():
+    global primary_target_id
+    print("Creating a blank tab for you to browse in...")
+    primary_target_id = (await execute_cdp_command("Target.createTarget", {"url": "about:blank"})).get("targetId")
+
+async def cdp_client_logic(cdp_ws_url, job=None, attach=False, attach_target=None):
+    """Drives one CDP connection. With attach, reuses the running browser's control panel and a tab of its own instead of opening new ones."""
+    global browser_user_agent, primary_target_id, fetch_patterns, in_scope, MONITORED_SESSION_ID
+    fetch_patterns, in_scope = compile_scope(SCOPE_HOSTS, SCOPE_PATH_PREFIXES, SCOPE_RESOURCE_TYPES, SCOPE_METHODS)
+    async with websockets.connect(cdp_ws_url, max_size=None) as cdp_ws:
+        print("Successfully connected to Chrome browser.")
 
-    http_thread = threading.Thread(target=run_http_server, args=(HTTP_PORT,), daemon=True)
-    http_thread.start()
-    if not await wait_for_http_server(HTTP_PORT):
-        print("Aborting due to UI server launch failure."); return
+        writer_task = asyncio.create_task(cdp_writer(cdp_ws))
+        reader_task = asyncio.create_task(cdp_reader(cdp_ws)); decoder_task = asyncio.create_task(large_reply_decoder())
+        sweeper_task = asyncio.create_task(lifecycle_sweeper())
+        ui_sender = asyncio.create_task(ui_sender_loop()) # Start the UI sender loop
 
-    user_data_dir = os.path.join(os.getcwd(), USER_DATA_DIR_NAME)
-    if not launch_chrome(CHROME_DEBUG_PORT, user_data_dir): return
+        startup = [execute_cdp_command("Browser.getVersion")] + ([execute_cdp_command("Target.getTargets")] if attach else [])
+        version_info, *existing = await asyncio.gather(*startup)
+        if 'userAgent' in version_info:
+            browser_user_agent = version_info['userAgent']; print(f"Captured browser User-Agent: {browser_user_agent[:50]}...")
 
-    print("Waiting for Chrome's debugging port to become available...")
-    cdp_ws_url = None
-    for attempt in range(10):
-        cdp_ws_url = get_websocket_url(CHROME_DEBUG_PORT)
-        if cdp_ws_url: break
-        if attempt < 9: print(f"Connection failed. Retrying in 2 seconds..."); time.sleep(2)
-    if not cdp_ws_url: print("Could not connect to Chrome after multiple attempts. Exiting."); return
+        if job is not None:
+            # Headless batch: no control panel and no capture, only somewhere to send from
+            await repeat_pool.start()
+            if not repeat_pool.available():
+                page = await execute_cdp_command("Target.createTarget", {"url": "about:blank"})
+                attach = await execute_cdp_command("Target.attachToTarget", {"targetId": page.get("targetId"), "flatten": True})
+                MONITORED_SESSION_ID = attach.get("sessionId")
+            try: return await job()
+            finally:
+                for task in (reader_task, writer_task, decoder_task, sweeper_task, ui_sender): task.cancel()
+
+        # The control panel and the browsing tab are set up concurrently
+        target_infos = existing[0].get("targetInfos", []) if existing else []
+        panel = next((t for t in target_infos if t.get("type") == "page" and t.get("url", "").rstrip("/") in (UI_ORIGIN, f"{UI_ORIGIN}/index.html")), None)
+        browsing = pick_browsing_target(target_infos, attach_target) if attach else None
+        setup = []
+        if panel:
+            ignored_target_ids.add(panel["targetId"]); print("Reusing the open control panel tab; it reconnects on its own.")
+        else: print("Creating control panel tab..."); setup.append(open_own_tab(UI_ORIGIN))
+        if browsing:
+            primary_target_id = browsing["targetId"]; print(f"Browsing in the existing tab {browsing.get('url', '')[:80]}")
+        else:
+            if attach_target: print(f"No open tab matches '{attach_target}'.")
+            setup.append(create_browsing_tab())
+        await asyncio.gather(*setup)
+        if not primary_target_id: print("FATAL: Could not create the user browsing tab. Exiting."); return
+        if CAPTURE_MODE == "passive":
+            print("Passive capture mode: recording from Network events, requests are never paused.")
+            if MATCH_REPLACE_RULES: print("Match-and-replace rules need intercept mode; they are not applied.")
+        else:
+            print(f"Intercepting with {len(fetch_patterns)} Fetch pattern(s).")
+            if MATCH_REPLACE_RULES: print(f"Applying {len(MATCH_REPLACE_RULES)} match-and-replace rule(s).")
+
+        # Attach to every tab, popup and worker in the window (existing ones now, new ones paused at creation).
+        # The reader instruments each one as it attaches; our own tabs are released again.
+        print(f"Auto-attaching to browser targets (browsing tab ID: {primary_target_id})...")
+        await asyncio.gather(execute_cdp_command("Target.setDiscoverTargets", {"discover": True}),
+                             execute_cdp_command("Target.setAutoAttach", {"autoAttach": True, "waitForDebuggerOnStart": True, "flatten": True}))
+        if REPEAT_WORKERS:
+            print(f"Starting {REPEAT_WORKERS} repeat worker(s)..."); repeat_pool.task = asyncio.create_task(repeat_pool.run())
 
-    cdp_task = asyncio.create_task(cdp_client_logic(cdp_ws_url))
+        print("Waiting for UI to connect..."); await ui_ready.wait()
+        print("UI is ready. " + (f"Browsing tab: {browsing.get('url', '')[:80]}" if browsing else "Please use the blank tab for browsing."))
+        await asyncio.gather(reader_task, writer_task, decoder_task, sweeper_task, ui_sender)
+
+# --- Batch Replay ---
+def iter_batch_requests(path):
+    """Yields (method, url, headers, body) from a HAR file, or from a JSON list of raw requests / request objects."""
+    try:
+        for har_entry in iter_har_entries(path):
+            request = har_entry.get("request", {})
+            if not request.get("url") or not request.get("method"): continue
+            headers = {h["name"]: h["value"] for h in request.get("headers", []) if not h["name"].startswith(":")}
+            yield request["method"], request["url"], headers, (request.get("postData") or {}).get("text", "")
+        return
+    except ValueError as e:
+        if not str(e).startswith("Not a HAR file"): raise
+    with open(path, encoding="utf-8") as f: items = json.load(f)
+    if not isinstance(items, list): raise ValueError("A request list must be a JSON array")
+    for item in items:
+        if isinstance(item, str): yield parse_raw_request(item.replace('\r\n', '\n'))
+        else: yield item["method"], item["url"], item.get("headers", {}), item.get("body", "")
+
+def endpoint_key(method, url):
+    parts = urllib.parse.urlsplit(url)
+    return f"{method} {parts.scheme}://{parts.netloc}{parts.path or '/'}"
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values: return None
+    return round(sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))], 3)
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies: return {}
+    return {"min": round(latencies[0], 3), "mean": round(sum(latencies) / len(latencies), 3), "p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95), "p99": percentile(latencies, 0.99), "max": round(latencies[-1], 3)}
+
+def batch_report(results, duration):
+    """results holds (endpoint, status, time_ms, error) tuples. A request counts as an error if it failed or got a status >= 400."""
+    endpoints = collections.defaultdict(lambda: {"count": 0, "errors": 0, "status_counts": collections.Counter(), "latencies": []})
+    for endpoint, status, time_ms, error in results:
+        stats = endpoints[endpoint]; stats["count"] += 1
+        stats["status_counts"][str(status) if status is not None else "failed"] += 1
+        if error is not None or status is None or status >= 400: stats["errors"] += 1
+        if error is None and time_ms is not None: stats["latencies"].append(time_ms)
+    report_endpoints = {}
+    for endpoint, stats in sorted(endpoints.items()):
+        report_endpoints[endpoint] = {"count": stats["count"], "errors": stats["errors"], "error_rate": round(stats["errors"] / stats["count"], 4),
+                                      "status_counts": dict(stats["status_counts"]), "latency_ms": latency_summary(stats["latencies"])}
+    total = len(results); errors = sum(stats["errors"] for stats in endpoints.values())
+    return {"requests": total, "duration_s": round(duration, 3), "throughput_rps": round(total / duration, 3) if duration else None,
+            "errors": errors, "error_rate": round(errors / total, 4) if total else 0.0,
+            "latency_ms": latency_summary([latency for stats in endpoints.values() for latency in stats["latencies"]]), "endpoints": report_endpoints}
+
+async def replay_batch(path, concurrency=10, rate=0, iterations=1):
+    """Replays every request in path through the browser, iterations times, and returns the report dict."""
+    semaphore = asyncio.Semaphore(max(1, concurrency)); interval = 1.0 / rate if rate else 0
+    results, in_flight = [], set(); started = next_start = time.monotonic()
+
+    async def send_one(request):
+        key = endpoint_key(request[0], request[1])
+        try:
+            res_val = (await send_via_browser([request]))[0]
+            results.append((key, res_val.get('status'), res_val.get('time_ms'), res_val.get('error')))
+        except Exception as e: results.append((key, None, None, str(e)))
+        finally: semaphore.release()
+
+    for _ in range(iterations):
+        for request in iter_batch_requests(path):
+            await semaphore.acquire()
+            if interval:
+                delay = next_start - time.monotonic()
+                if delay > 0: await asyncio.sleep(delay)
+                next_start = max(next_start, time.monotonic()) + interval
+            task = asyncio.create_task(send_one(request)); in_flight.add(task); task.add_done_callback(in_flight.discard)
+    if in_flight: await asyncio.wait(in_flight)
+    return batch_report(results, time.monotonic() - started)
+
+async def run_batch(args):
+    """Headless entry point: no UI, HTTP server or capture; replays args.batch and returns the report."""
+    repeat_pool.size = max(1, args.workers)
+    user_data_dir = os.path.join(os.getcwd(), USER_DATA_DIR_NAME)
+    chrome, cdp_ws_url = await launch_chrome(CHROME_DEBUG_PORT, user_data_dir, headless=True)
+    if not chrome: return None
+    try:
+        return await cdp_client_logic(cdp_ws_url, job=lambda: replay_batch(args.batch, args.concurrency, args.rate, args.iterations))
+    finally:
+        if chrome.returncode is None: chrome.terminate(); await chrome.wait()
+
+async def main(attach=None, attach_target=None):
+    """Starts the UI servers and Chrome (launched, or found running with attach) concurrently, then runs capture.
+
+    attach is None to launch a fresh Chrome, "" to find one on this profile, or a ws:// URL, http:// URL or port.
+    """
+    global session_store, match_replace
+    print("Starting CDP Repeater v6.3"); started = time.perf_counter()
+    # Checked before anything starts: a bad rule must stop startup, not fail inside the capture task
+    try: match_replace = MatchReplaceRules(MATCH_REPLACE_RULES)
+    except ValueError as e: print(f"Error: {e}. Fix MATCH_REPLACE_RULES and restart."); return
+    if SESSION_DB_PATH:
+        session_store = SessionStore(SESSION_DB_PATH, SESSION_NAME, SESSION_BATCH_SIZE, SESSION_FLUSH_INTERVAL)
+        print(f"Session '{SESSION_NAME}' in {SESSION_DB_PATH}: {session_store.resumed_count} stored entries.")
+    user_data_dir = os.path.join(os.getcwd(), USER_DATA_DIR_NAME)
 
-    async with websockets.serve(ui_websocket_handler, "127.0.0.1", WEBSOCKET_PORT):
+    async def start_chrome():
+        if attach is not None:
+            cdp_ws_url = await find_running_chrome(attach, user_data_dir)
+            if cdp_ws_url: print(f"Attaching to the running Chrome at {cdp_ws_url}"); return cdp_ws_url
+            print("No running Chrome found; launching one that stays open for the next --attach.")
+        _, cdp_ws_url = await launch_chrome(CHROME_DEBUG_PORT, user_data_dir, keep_open=attach is not None)
+        return cdp_ws_url
+
+    # The HTTP server binds first (Chrome's first page is served by it); the rest start together
+    try: http_server = await asyncio.start_server(handle_http_connection, "127.0.0.1", HTTP_PORT)
+    except OSError as e: print(f"Error: UI server could not listen on port {HTTP_PORT} ({e}). Aborting."); return
+    print(f"UI server running at {UI_ORIGIN}")
+    # Batched frames are highly repetitive JSON, so keep permessage-deflate on explicitly
+    ui_server, cdp_ws_url = await asyncio.gather(websockets.serve(ui_websocket_handler, "127.0.0.1", WEBSOCKET_PORT, compression="deflate", origins=[UI_ORIGIN, None]), start_chrome())
+    if not cdp_ws_url: print("Could not reach Chrome's DevTools endpoint. Exiting."); return
+    print(f"Chrome is reachable after {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+    async with http_server, ui_server:
+        cdp_task = asyncio.create_task(cdp_client_logic(cdp_ws_url, attach=attach is not None, attach_target=attach_target))
         print("All services are running. Press Ctrl+C to shut down."); await asyncio.Future()
 
 if __name__ == "__main__":
-    try: asyncio.run(main())
+    parser = argparse.ArgumentParser(description="CDP Repeater: an HTTP repeater driven through the Chrome DevTools Protocol.")
+    parser.add_argument("--batch", metavar="FILE", help="Headless mode: replay a HAR file or JSON request list, print a JSON report and exit")
+    parser.add_argument("--concurrency", type=int, default=10, help="Batch mode: requests in flight at once (default 10)")
+    parser.add_argument("--rate", type=float, default=0, help="Batch mode: maximum requests per second (default 0, unlimited)")
+    parser.add_argument("--iterations", type=int, default=1, help="Batch mode: times to replay the whole file (default 1)")
+    parser.add_argument("--workers", type=int, default=REPEAT_WORKERS or 1, help=f"Batch mode: repeat workers (default {REPEAT_WORKERS or 1})")
+    parser.add_argument("--report", metavar="FILE", help="Batch mode: write the report here instead of stdout")
+    parser.add_argument("--attach", nargs="?", const="", metavar="ENDPOINT", help="Attach to a running Chrome (this profile's, or a ws:// URL, http:// URL or port) instead of launching one; launches a Chrome that stays open if none is running")
+    parser.add_argument("--target", metavar="ID_OR_URL", help="With --attach: browse in the open tab with this target id, or whose URL contains this text")
+    args = parser.parse_args()
+    if args.batch:
+        # Progress goes to stderr so stdout carries nothing but the report
+        with contextlib.redirect_stdout(sys.stderr): report = asyncio.run(run_batch(args))
+        if report is None: sys.exit(1)
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f: json.dump(report, f, indent=2)
+        else: print(json.dumps(report, indent=2))
+        sys.exit(0)
+    try: asyncio.run(main(args.attach, args.target))
     except KeyboardInterrupt:
         print("\nShutting down.")
-        for item in os.listdir():
-            if item.startswith("response-") and item.endswith(".html"):
-                os.remove(item)
-        for f in ["index.html", "style.css", "script.js", "help.html"]:
-            if os.path.exists(f): os.remove(f)
\ No newline at end of file
+        request_history.close(); blob_store.close()
+        if session_store: session_store.close()
\ No newline at end of file